@@ -0,0 +1,273 @@
+"""
+多轮对话压测
+从脚本文件读取多轮对话：同一个会话内的各轮严格按顺序执行，并沿用上一轮返回的 conversation_id；
+多个会话并行执行，同时进行中的请求数不超过全局并发上限。
+按轮次统计端到端延迟和首 token 时间，并拟合延迟随提示词 token 数（会话历史）的增长，
+用来衡量上下文变长对延迟和吞吐量的影响。
+
+脚本文件格式:
+    JSONL，每行一个会话: {"id": "faq-1", "turns": ["你好", "如何重置密码?"], "inputs": {...}}
+    或纯文本：每行一轮，空行分隔不同的会话
+
+用法:
+    python bench_conversations.py conversations.jsonl --concurrency 16 --output conversations.json
+
+    # 把脚本中的会话复制 20 份，每轮之间思考 0.5 秒，对本地模拟服务器运行
+    python bench_conversations.py conversations.txt --repeat 20 --think-time 0.5 --mock
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_load
+import test_chat_messages
+from dify_client import DifyClient
+from dify_stats import format_summary, linear_fit, summarize
+
+
+def load_conversations(path):
+    """
+    读取会话脚本
+
+    返回:
+        [{"id": 会话名, "turns": [查询, ...], "inputs": {...}}, ...]
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+
+    conversations = []
+    if text.lstrip().startswith("{"):
+        for line in text.splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            conversations.append({
+                "id": str(entry.get("id") or f"conversation-{len(conversations) + 1}"),
+                "turns": list(entry["turns"]),
+                "inputs": entry.get("inputs") or {}
+            })
+    else:
+        for block in text.split("\n\n"):
+            turns = [line.strip() for line in block.splitlines() if line.strip() and not line.startswith("#")]
+            if turns:
+                conversations.append({"id": f"conversation-{len(conversations) + 1}", "turns": turns, "inputs": {}})
+    return [conversation for conversation in conversations if conversation["turns"]]
+
+
+class ConversationDriver:
+    """
+    多轮对话执行器
+
+    每个会话的下一轮在上一轮完成（并经过思考时间）之后才提交到线程池，
+    因此会话内严格有序；线程池大小即全局并发上限，思考中的会话不占用并发名额。
+    某一轮失败时，该会话剩余的轮次不再执行（计入 skipped）。
+
+    参数:
+        client: DifyClient 实例
+        conversations: load_conversations() 的结果
+        mode: "streaming" 或 "blocking"
+        concurrency: 同时进行中的请求数上限
+        think_time: 每个会话两轮之间的等待时间（秒）
+        run_options: 可选，传给单次执行函数的额外参数（例如 limiter）
+    """
+
+    def __init__(self, client, conversations, mode="streaming", concurrency=8, think_time=0.0, run_options=None):
+        self.client = client
+        self.conversations = conversations
+        self.run_once = bench_load.RUNNERS[mode]
+        self.mode = mode
+        self.concurrency = concurrency
+        self.think_time = think_time
+        self.run_options = run_options or {}
+
+        self.samples = []
+        self.errors = []
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._remaining = len(conversations)
+        self._done = threading.Event()
+        self._executor = None
+
+    def _submit(self, index, turn, conversation_id):
+        self._executor.submit(self._run_turn, index, turn, conversation_id)
+
+    def _run_turn(self, index, turn, conversation_id):
+        conversation = self.conversations[index]
+        try:
+            sample = self.run_once(
+                self.client, conversation["turns"][turn],
+                conversation_id=conversation_id, inputs=conversation["inputs"], **self.run_options
+            )
+        except Exception as e:
+            with self._lock:
+                self.errors.append({"conversation": conversation["id"], "turn": turn + 1,
+                                    "error": f"{type(e).__name__}: {e}"})
+                self.skipped += len(conversation["turns"]) - turn - 1
+            self._finish_conversation()
+            return
+
+        sample["conversation"] = conversation["id"]
+        sample["turn"] = turn + 1
+        with self._lock:
+            self.samples.append(sample)
+
+        if turn + 1 >= len(conversation["turns"]):
+            self._finish_conversation()
+            return
+        # 沿用返回的 conversation_id 继续下一轮
+        next_id = sample.get("conversation_id") or conversation_id
+        if self.think_time > 0:
+            timer = threading.Timer(self.think_time, self._submit, args=(index, turn + 1, next_id))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._submit(index, turn + 1, next_id)
+
+    def _finish_conversation(self):
+        with self._lock:
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self._done.set()
+
+    def run(self):
+        """执行所有会话，返回报告"""
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="conversation") as executor:
+            self._executor = executor
+            if not self.conversations:
+                self._done.set()
+            for index in range(len(self.conversations)):
+                self._submit(index, 0, None)
+            self._done.wait()
+        return self.report(time.perf_counter() - start_time)
+
+    def report(self, elapsed_time):
+        """按轮次汇总，并拟合延迟随提示词 token 数的增长"""
+        samples = self.samples
+        max_turns = max((len(conversation["turns"]) for conversation in self.conversations), default=0)
+        by_turn = []
+        for turn in range(1, max_turns + 1):
+            turn_samples = [sample for sample in samples if sample["turn"] == turn]
+            prompt_tokens = [sample["prompt_tokens"] for sample in turn_samples if sample.get("prompt_tokens")]
+            by_turn.append({
+                "turn": turn,
+                "count": len(turn_samples),
+                "prompt_tokens": sum(prompt_tokens) / len(prompt_tokens) if prompt_tokens else None,
+                "latency": summarize([sample["latency"] for sample in turn_samples]),
+                "ttft": summarize([sample["ttft"] for sample in turn_samples if "ttft" in sample])
+            })
+
+        growth = {}
+        with_tokens = [sample for sample in samples if sample.get("prompt_tokens")]
+        for metric in ("latency", "ttft"):
+            points = [(sample["prompt_tokens"], sample[metric]) for sample in with_tokens if metric in sample]
+            fit = linear_fit([x for x, _ in points], [y for _, y in points])
+            if fit is not None:
+                # 每增加 1000 个提示词 token 增加的秒数
+                growth[metric] = {"per_1k_prompt_tokens": fit[0] * 1000, "intercept": fit[1]}
+
+        total_tokens = sum(sample.get("tokens", 0) for sample in samples)
+        completed = len(self.conversations) - len({error["conversation"] for error in self.errors})
+        return {
+            "mode": self.mode,
+            "concurrency": self.concurrency,
+            "think_time": self.think_time,
+            "conversations": len(self.conversations),
+            "completed_conversations": completed,
+            "turns": len(samples) + len(self.errors),
+            "succeeded": len(samples),
+            "errors": len(self.errors),
+            "skipped": self.skipped,
+            "elapsed_time": elapsed_time,
+            "throughput_turns_per_sec": len(samples) / elapsed_time if elapsed_time else 0.0,
+            "throughput_tokens_per_sec": total_tokens / elapsed_time if elapsed_time else 0.0,
+            "by_turn": by_turn,
+            "growth": growth,
+            "error_samples": self.errors[:10]
+        }
+
+
+def print_report(report):
+    """打印多轮对话压测报告"""
+    print("=" * 60)
+    print(f"多轮对话压测: {report['conversations']} 个会话  模式: {report['mode']}  "
+          f"并发: {report['concurrency']}  思考时间: {report['think_time']}秒")
+    print("=" * 60)
+    print(f"总耗时: {report['elapsed_time']:.2f}秒")
+    print(f"轮次: {report['turns']}  成功: {report['succeeded']}  失败: {report['errors']}  跳过: {report['skipped']}  "
+          f"完成的会话: {report['completed_conversations']}")
+    print(f"吞吐量: {report['throughput_turns_per_sec']:.2f} 轮/秒, {report['throughput_tokens_per_sec']:.1f} tokens/秒")
+    print("-" * 60)
+    for item in report["by_turn"]:
+        prompt_tokens = f"{item['prompt_tokens']:.0f}" if item["prompt_tokens"] is not None else "N/A"
+        print(f"第 {item['turn']:>2} 轮 (n={item['count']}, 提示词 {prompt_tokens} tokens)")
+        print("  " + format_summary("端到端延迟", item["latency"], "毫秒", 1000))
+        if item["ttft"]["count"]:
+            print("  " + format_summary("首 token 时间", item["ttft"], "毫秒", 1000))
+    if report["growth"]:
+        print("-" * 60)
+        names = {"latency": "端到端延迟", "ttft": "首 token 时间"}
+        for metric, fit in report["growth"].items():
+            print(f"{names[metric]}: 每增加 1000 个提示词 token 增加 {fit['per_1k_prompt_tokens'] * 1000:.1f} 毫秒")
+    for error in report["error_samples"]:
+        print(f"✗ [{error['conversation']} 第 {error['turn']} 轮] {error['error']}")
+    print("=" * 60)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="多轮对话压测")
+    parser.add_argument("script", help="会话脚本文件（JSONL 或空行分隔的纯文本）")
+    parser.add_argument("--mode", choices=("streaming", "blocking"), default="streaming", help="响应模式")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行中的请求数上限")
+    parser.add_argument("--think-time", type=float, default=0.0, help="每个会话两轮之间的等待时间（秒）")
+    parser.add_argument("--repeat", type=int, default=1, help="把脚本中的会话复制多份并行执行")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件路径")
+    parser.add_argument("--mock", action="store_true", help="在本进程中启动模拟服务器并对其运行")
+    parser.add_argument("--mock-token-rate", type=float, default=200, help="模拟服务器 token 速率")
+    parser.add_argument("--mock-context-latency", type=float, default=0.05,
+                        help="模拟服务器每 1000 个提示词 token 增加的首 token 延迟（秒）")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    conversations = []
+    for copy in range(args.repeat):
+        for conversation in load_conversations(args.script):
+            name = conversation["id"] if args.repeat == 1 else f"{conversation['id']}#{copy + 1}"
+            conversations.append(dict(conversation, id=name))
+
+    mock_server = None
+    base_url = test_chat_messages.API_BASE_URL
+    if args.mock:
+        from mock_dify_server import MockConfig, MockServerThread
+        mock_server = MockServerThread(MockConfig(
+            latency=0.05,
+            token_rate=args.mock_token_rate,
+            context_latency=args.mock_context_latency
+        )).start()
+        base_url = mock_server.base_url
+
+    client = DifyClient(test_chat_messages.API_KEY, base_url, pool_size=args.concurrency * 2)
+    try:
+        driver = ConversationDriver(
+            client, conversations,
+            mode=args.mode,
+            concurrency=args.concurrency,
+            think_time=args.think_time
+        )
+        report = driver.run()
+    finally:
+        client.close()
+        if mock_server is not None:
+            mock_server.stop()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.output}")
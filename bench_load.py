@@ -0,0 +1,621 @@
+"""
+压测工具
+按固定并发（闭环）或固定到达率（开环）驱动 send_chat_message_streaming、
+send_chat_message_blocking 和 retrieve_from_knowledge_base，
+统计首 token 时间（TTFT）、tokens/sec、片段间隔和端到端延迟的 p50/p90/p99，
+结果写入 JSON 文件以便对比多次运行。
+
+用法:
+    # 对本地模拟服务器压测流式对话，32 并发，共 500 个请求
+    python bench_load.py --target streaming --concurrency 32 --requests 500 --mock
+
+    # 按每秒 20 个请求的到达率压测检索，持续 30 秒
+    python bench_load.py --target retrieve --rate 20 --duration 30 --output retrieve.json
+
+    # 录制一次压测的流量，之后离线以最快速度回放
+    python bench_load.py --target streaming --requests 50 --record traffic.jsonl.gz
+    python bench_load.py --target streaming --requests 5000 --replay traffic.jsonl.gz --replay-speed 0
+
+    # 在客户端把请求平滑到每秒 10 个请求、每分钟 30000 tokens 以内
+    python bench_load.py --target streaming --concurrency 32 --duration 60 --rps 10 --tpm 30000 --mock
+
+    # 把 512 个并发流分到 8 个工作进程，避免客户端的 GIL 成为瓶颈
+    python bench_load.py --target streaming --concurrency 512 --duration 60 --processes 8 --mock
+"""
+
+import argparse
+import json
+import multiprocessing
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import test_chat_messages
+import test_knowledge_retrieve
+from dify_answer import CallbackSink
+from dify_cassette import RecordingClient, ReplayClient
+from dify_client import DifyClient
+from dify_hedge import Hedger
+from dify_histogram import SharedHistograms
+from dify_ratelimit import RateLimiter
+from dify_retry import Resilience, RetryPolicy
+from dify_stats import format_summary, summarize
+from dify_trace import write_jsonl
+
+TARGETS = ("streaming", "blocking", "retrieve")
+# 多进程模式等待所有工作进程就绪的最长时间（秒），spawn 启动需要重新导入模块
+STARTUP_TIMEOUT = 60
+
+
+def run_streaming(client, query, limiter=None, conversation_id=None, inputs=None):
+    """执行一次流式对话，返回单次采样"""
+    chunk_times = []
+    sink = CallbackSink(lambda chunk: chunk_times.append(time.perf_counter()))
+
+    start_time = time.perf_counter()
+    result = test_chat_messages.send_chat_message_streaming(
+        query, conversation_id=conversation_id, inputs=inputs, client=client, sinks=[sink], limiter=limiter,
+        verbose=False, raise_errors=True
+    )
+    end_time = time.perf_counter()
+
+    usage = (result.get("metadata") or {}).get("usage", {})
+    tokens = usage.get("completion_tokens") or len(chunk_times)
+    sample = {
+        "latency": end_time - start_time,
+        "tokens": tokens,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "conversation_id": result.get("conversation_id"),
+        "trace": result.get("trace")
+    }
+    if chunk_times:
+        sample["ttft"] = chunk_times[0] - start_time
+        sample["gaps"] = [b - a for a, b in zip(chunk_times, chunk_times[1:])]
+        generation_time = end_time - chunk_times[0]
+        if generation_time > 0:
+            sample["tokens_per_sec"] = tokens / generation_time
+    return sample
+
+
+def run_blocking(client, query, limiter=None, conversation_id=None, inputs=None):
+    """执行一次阻塞模式对话，返回单次采样"""
+    start_time = time.perf_counter()
+    result = test_chat_messages.send_chat_message_blocking(
+        query, conversation_id=conversation_id, inputs=inputs, client=client, limiter=limiter,
+        verbose=False, raise_errors=True
+    )
+    latency = time.perf_counter() - start_time
+    usage = (result.get("metadata") or {}).get("usage", {})
+    tokens = usage.get("completion_tokens", 0)
+    sample = {
+        "latency": latency,
+        "tokens": tokens,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "conversation_id": result.get("conversation_id")
+    }
+    if latency > 0:
+        sample["tokens_per_sec"] = tokens / latency
+    return sample
+
+
+def run_retrieve(client, query, hedger=None):
+    """执行一次检索，返回单次采样"""
+    start_time = time.perf_counter()
+    test_knowledge_retrieve.retrieve_from_knowledge_base(
+        query, client=client, hedger=hedger, verbose=False, raise_errors=True
+    )
+    return {"latency": time.perf_counter() - start_time}
+
+
+RUNNERS = {
+    "streaming": run_streaming,
+    "blocking": run_blocking,
+    "retrieve": run_retrieve
+}
+
+
+class LoadRunner:
+    """
+    压测执行器
+
+    参数:
+        target: 压测目标，"streaming" / "blocking" / "retrieve"
+        client: DifyClient 实例
+        queries: 查询列表，按轮转方式使用
+        concurrency: 闭环模式下的并发数；开环模式下为最多同时进行中的请求数
+        rate: 可选，开环模式的到达率（请求/秒），不指定时使用闭环模式
+        total_requests: 可选，请求总数
+        duration: 可选，持续时间（秒）
+        poisson: 开环模式下是否使用泊松到达（否则为均匀间隔）
+        run_options: 可选，传给单次执行函数的额外参数（例如检索的 hedger、对话的 limiter）
+        recorder: 可选，HistogramRecorder；指定时采样只记入直方图，不保存在 samples 中
+    """
+
+    def __init__(self, target, client, queries, concurrency=8, rate=None,
+                 total_requests=None, duration=None, poisson=False, run_options=None, recorder=None):
+        if total_requests is None and duration is None:
+            total_requests = concurrency * 10
+        self.target = target
+        self.run_once = RUNNERS[target]
+        self.client = client
+        self.queries = queries
+        self.concurrency = concurrency
+        self.rate = rate
+        self.total_requests = total_requests
+        self.duration = duration
+        self.poisson = poisson
+        self.run_options = run_options or {}
+        self.recorder = recorder
+
+        self.samples = []
+        self.errors = []
+        self._lock = threading.Lock()
+        self._issued = 0
+
+    def _next_index(self):
+        """分配下一个请求序号，达到请求总数时返回 None"""
+        with self._lock:
+            if self.total_requests is not None and self._issued >= self.total_requests:
+                return None
+            index = self._issued
+            self._issued += 1
+            return index
+
+    def _execute(self, index, scheduled_time):
+        query = self.queries[index % len(self.queries)]
+        try:
+            sample = self.run_once(self.client, query, **self.run_options)
+            # 开环模式下从计划发出时间开始计算，包含排队时间
+            sample["latency"] = time.perf_counter() - scheduled_time
+            if self.recorder is not None:
+                self.recorder.record(sample)
+                return
+            with self._lock:
+                self.samples.append(sample)
+        except Exception as e:
+            if self.recorder is not None:
+                self.recorder.record_error(f"{type(e).__name__}: {e}")
+                return
+            with self._lock:
+                self.errors.append(f"{type(e).__name__}: {e}")
+
+    def _closed_loop(self, deadline):
+        def worker():
+            while deadline is None or time.perf_counter() < deadline:
+                index = self._next_index()
+                if index is None:
+                    return
+                self._execute(index, time.perf_counter())
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _open_loop(self, start_time, deadline):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            scheduled_time = start_time
+            while True:
+                if deadline is not None and scheduled_time >= deadline:
+                    break
+                index = self._next_index()
+                if index is None:
+                    break
+                delay = scheduled_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(self._execute, index, scheduled_time)
+                interval = random.expovariate(self.rate) if self.poisson else 1.0 / self.rate
+                scheduled_time += interval
+
+    def run(self):
+        """执行压测，返回报告（dict）"""
+        start_time = time.perf_counter()
+        deadline = start_time + self.duration if self.duration else None
+        if self.rate:
+            self._open_loop(start_time, deadline)
+        else:
+            self._closed_loop(deadline)
+        elapsed_time = time.perf_counter() - start_time
+        return self.report(elapsed_time)
+
+    def report(self, elapsed_time):
+        """汇总采样结果"""
+        samples = self.samples
+        gaps = [gap for sample in samples for gap in sample.get("gaps", [])]
+        total_tokens = sum(sample.get("tokens", 0) for sample in samples)
+        return {
+            "target": self.target,
+            "mode": "open" if self.rate else "closed",
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "started_at": time.time() - elapsed_time,
+            "elapsed_time": elapsed_time,
+            "requests": len(samples) + len(self.errors),
+            "succeeded": len(samples),
+            "errors": len(self.errors),
+            "throughput_rps": len(samples) / elapsed_time if elapsed_time else 0.0,
+            "throughput_tokens_per_sec": total_tokens / elapsed_time if elapsed_time else 0.0,
+            "latency": summarize([sample["latency"] for sample in samples]),
+            "ttft": summarize([sample["ttft"] for sample in samples if "ttft" in sample]),
+            "tokens_per_sec": summarize([sample["tokens_per_sec"] for sample in samples if "tokens_per_sec" in sample]),
+            "inter_chunk_gap": summarize(gaps),
+            "error_samples": self.errors[:10]
+        }
+
+
+class HistogramRecorder:
+    """
+    把采样记入共享内存中的直方图（多进程模式的工作进程使用），不保留单个采样
+
+    参数:
+        writer: HistogramWriter 实例（见 dify_histogram.py）
+        max_errors: 保留的错误信息条数
+    """
+
+    METRICS = ("latency", "ttft", "tokens_per_sec", "inter_chunk_gap")
+    COUNTERS = ("succeeded", "errors", "tokens")
+
+    def __init__(self, writer, max_errors=10):
+        self.writer = writer
+        self.max_errors = max_errors
+        self.errors = []
+
+    def record(self, sample):
+        writer = self.writer
+        writer.record("latency", sample["latency"])
+        if "ttft" in sample:
+            writer.record("ttft", sample["ttft"])
+        if "tokens_per_sec" in sample:
+            writer.record("tokens_per_sec", sample["tokens_per_sec"])
+        if sample.get("gaps"):
+            writer.record_many("inter_chunk_gap", sample["gaps"])
+        writer.add("tokens", sample.get("tokens", 0))
+        writer.add("succeeded")
+
+    def record_error(self, message):
+        self.writer.add("errors")
+        if len(self.errors) < self.max_errors:
+            self.errors.append(message)
+
+
+def split_evenly(total, parts):
+    """把 total 尽量平均地分成 parts 份"""
+    return [total // parts + (1 if index < total % parts else 0) for index in range(parts)]
+
+
+def _worker_main(worker, shared_name, options, barrier, results):
+    """多进程模式的工作进程：执行分到的虚拟用户，采样写入共享内存"""
+    shared = SharedHistograms.attach(shared_name, HistogramRecorder.METRICS, options["processes"],
+                                     HistogramRecorder.COUNTERS)
+    recorder = HistogramRecorder(shared.writer(worker))
+    test_knowledge_retrieve.API_BASE_URL = options["base_url"]
+
+    resilience = None
+    if options["retries"]:
+        resilience = Resilience(RetryPolicy(max_attempts=options["retries"] + 1))
+    if options["replay"]:
+        client = ReplayClient(options["replay"], speed=options["replay_speed"] or None, base_url=options["base_url"])
+    else:
+        client = DifyClient(options["api_key"], options["base_url"], pool_size=options["concurrency"] * 2,
+                            resilience=resilience)
+    run_options = {}
+    hedger = None
+    if options["hedge"] is not None and options["target"] == "retrieve":
+        hedger = Hedger(percentile=options["hedge"], max_workers=options["concurrency"] * 2)
+        run_options["hedger"] = hedger
+    if options["limiter"]:
+        run_options["limiter"] = RateLimiter(**options["limiter"])
+
+    runner = LoadRunner(
+        options["target"], client, options["queries"],
+        concurrency=options["concurrency"],
+        rate=options["rate"],
+        total_requests=options["total_requests"],
+        duration=options["duration"],
+        poisson=options["poisson"],
+        run_options=run_options,
+        recorder=recorder
+    )
+    try:
+        barrier.wait(timeout=STARTUP_TIMEOUT)
+        runner.run()
+    except threading.BrokenBarrierError:
+        # 父进程已经放弃启动（其它工作进程退出或超时），不执行压测
+        pass
+    finally:
+        client.close()
+        if hedger is not None:
+            hedger.close()
+        results.put({"worker": worker, "errors": recorder.errors})
+        shared.close()
+
+
+def _wait_for_workers(barrier, workers, timeout):
+    """等待所有工作进程就绪；有工作进程提前退出或超时时中止屏障并抛出 RuntimeError"""
+    give_up_at = time.monotonic() + timeout
+    while barrier.n_waiting < len(workers):
+        dead = [f"{worker}（退出码 {process.exitcode}）" for worker, process in enumerate(workers) if not process.is_alive()]
+        if dead or time.monotonic() >= give_up_at:
+            barrier.abort()
+            reason = f"工作进程已退出: {', '.join(dead)}" if dead else f"工作进程没有在 {timeout:g} 秒内全部就绪"
+            raise RuntimeError(f"多进程压测启动失败，{reason}")
+        time.sleep(0.1)
+    try:
+        barrier.wait(timeout=timeout)
+    except threading.BrokenBarrierError:
+        raise RuntimeError("多进程压测启动失败，工作进程等待超时") from None
+
+
+def run_multiprocess(options, processes, interval=1.0, startup_timeout=STARTUP_TIMEOUT):
+    """
+    多进程压测：把虚拟用户分到多个工作进程，父进程实时合并共享内存中的直方图
+
+    参数:
+        options: 压测参数（target / base_url / api_key / queries / concurrency / rate /
+                 total_requests / duration / poisson / retries / hedge / replay / replay_speed / limiter）
+        processes: 工作进程数
+        interval: 打印实时进度的间隔（秒）
+        startup_timeout: 等待所有工作进程就绪的最长时间（秒）
+
+    返回:
+        与 LoadRunner.report() 格式相同的报告
+
+    异常:
+        RuntimeError: 有工作进程在就绪之前退出，或超过 startup_timeout 仍未全部就绪
+    """
+    concurrencies = split_evenly(options["concurrency"], processes)
+    total_requests = options["total_requests"]
+    if total_requests is None and options["duration"] is None:
+        total_requests = options["concurrency"] * 10
+    totals = split_evenly(total_requests, processes) if total_requests is not None else [None] * processes
+
+    shared = SharedHistograms(HistogramRecorder.METRICS, processes, HistogramRecorder.COUNTERS)
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(processes + 1)
+    results = context.Queue()
+    workers = []
+    for worker in range(processes):
+        worker_options = dict(
+            options,
+            processes=processes,
+            concurrency=max(1, concurrencies[worker]),
+            total_requests=totals[worker],
+            rate=options["rate"] / processes if options["rate"] else None,
+            # 轮换查询的起点，避免所有进程同时发送相同的查询
+            queries=options["queries"][worker % len(options["queries"]):] + options["queries"][:worker % len(options["queries"])]
+        )
+        if options["limiter"]:
+            worker_options["limiter"] = {
+                name: value / processes if name in ("requests_per_second", "tokens_per_minute") and value else value
+                for name, value in options["limiter"].items()
+            }
+        process = context.Process(target=_worker_main, args=(worker, shared.name, worker_options, barrier, results),
+                                  daemon=True)
+        process.start()
+        workers.append(process)
+
+    error_samples = []
+    finished = 0
+    try:
+        _wait_for_workers(barrier, workers, startup_timeout)
+        start_time = time.perf_counter()
+        while finished < processes:
+            try:
+                result = results.get(timeout=interval)
+                finished += 1
+                error_samples.extend(result["errors"])
+            except queue.Empty:
+                if not any(process.is_alive() for process in workers):
+                    break
+            latency = shared.merged("latency").summary()
+            if latency["count"]:
+                print(f"[{time.perf_counter() - start_time:6.1f}秒] 完成 {shared.counter('succeeded')}  "
+                      f"失败 {shared.counter('errors')}  "
+                      f"延迟 p50={latency['p50'] * 1000:.1f} p99={latency['p99'] * 1000:.1f} 毫秒", flush=True)
+        elapsed_time = time.perf_counter() - start_time
+        for worker, process in enumerate(workers):
+            process.join()
+            if process.exitcode:
+                error_samples.insert(0, f"工作进程 {worker} 异常退出（退出码 {process.exitcode}），它的结果可能不完整")
+
+        succeeded = shared.counter("succeeded")
+        errors = shared.counter("errors")
+        tokens = shared.counter("tokens")
+        return {
+            "target": options["target"],
+            "mode": "open" if options["rate"] else "closed",
+            "concurrency": options["concurrency"],
+            "rate": options["rate"],
+            "processes": processes,
+            "started_at": time.time() - elapsed_time,
+            "elapsed_time": elapsed_time,
+            "requests": succeeded + errors,
+            "succeeded": succeeded,
+            "errors": errors,
+            "throughput_rps": succeeded / elapsed_time if elapsed_time else 0.0,
+            "throughput_tokens_per_sec": tokens / elapsed_time if elapsed_time else 0.0,
+            "latency": shared.merged("latency").summary(),
+            "ttft": shared.merged("ttft").summary(),
+            "tokens_per_sec": shared.merged("tokens_per_sec").summary(),
+            "inter_chunk_gap": shared.merged("inter_chunk_gap").summary(),
+            "error_samples": error_samples[:10]
+        }
+    finally:
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        shared.close()
+
+
+def print_report(report):
+    """打印压测报告"""
+    print("=" * 60)
+    print(f"压测目标: {report['target']}  模式: {report['mode']}  并发: {report['concurrency']}"
+          + (f"  到达率: {report['rate']}/秒" if report['rate'] else "")
+          + (f"  进程数: {report['processes']}" if report.get('processes') else ""))
+    print("=" * 60)
+    print(f"总耗时: {report['elapsed_time']:.2f}秒")
+    print(f"请求数: {report['requests']}  成功: {report['succeeded']}  失败: {report['errors']}")
+    print(f"吞吐量: {report['throughput_rps']:.2f} 请求/秒, {report['throughput_tokens_per_sec']:.1f} tokens/秒")
+    print("-" * 60)
+    print(format_summary("端到端延迟", report["latency"], "毫秒", 1000))
+    if report["ttft"]["count"]:
+        print(format_summary("首 token 时间", report["ttft"], "毫秒", 1000))
+        print(format_summary("片段间隔", report["inter_chunk_gap"], "毫秒", 1000))
+    if report["tokens_per_sec"]["count"]:
+        print(format_summary("单请求 tokens/秒", report["tokens_per_sec"], "tokens/秒"))
+    if report.get("resilience"):
+        stats = report["resilience"]
+        print(f"重试: {stats['retries']} 次  预算耗尽: {stats['budget_exhausted']} 次  熔断拒绝: {stats['rejected']} 次")
+    if report.get("hedge"):
+        stats = report["hedge"]
+        print(f"对冲: {stats['hedged']} 次 ({stats['hedge_rate']:.1%})  对冲胜出: {stats['hedge_wins']} 次  "
+              f"预算不足: {stats['budget_denied']} 次  当前对冲延迟: {stats['hedge_delay'] * 1000:.1f} 毫秒")
+    if report.get("limiter"):
+        stats = report["limiter"]
+        window = next(iter(stats["windows"].values()))
+        print(f"客户端限流: 排队 {stats['queued']} 次  拒绝 {stats['rejected']} 次  "
+              f"累计等待 {stats['wait_seconds']:.2f}秒  最近一分钟 {window['tokens']} tokens, 费用 {window['price']}")
+    for error in report["error_samples"]:
+        print(f"✗ {error}")
+    print("=" * 60)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Dify API 压测工具")
+    parser.add_argument("--target", choices=TARGETS, default="streaming", help="压测目标")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发数（开环模式下为最多进行中的请求数）")
+    parser.add_argument("--rate", type=float, default=None, help="到达率（请求/秒），指定后使用开环模式")
+    parser.add_argument("--poisson", action="store_true", help="开环模式使用泊松到达")
+    parser.add_argument("--requests", type=int, default=None, help="请求总数")
+    parser.add_argument("--duration", type=float, default=None, help="持续时间（秒）")
+    parser.add_argument("--query", action="append", help="查询内容，可以指定多次")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件路径")
+    parser.add_argument("--traces", default=None, help="流式对话逐事件计时的 JSONL 文件路径（见 dify_trace.py）")
+    parser.add_argument("--hedge", type=float, default=None,
+                        help="检索对冲请求的延迟百分位（例如 95），见 dify_hedge.py")
+    parser.add_argument("--retries", type=int, default=0, help="失败重试次数（见 dify_retry.py），默认不重试")
+    parser.add_argument("--rps", type=float, default=None, help="对话请求的客户端限流：每秒请求数（见 dify_ratelimit.py）")
+    parser.add_argument("--tpm", type=float, default=None, help="对话请求的客户端限流：每分钟 token 数")
+    parser.add_argument("--limit-mode", choices=("queue", "reject"), default="queue",
+                        help="超出限流预算时排队等待还是直接拒绝")
+    parser.add_argument("--record", default=None, help="把压测流量录制到 cassette 文件（见 dify_cassette.py）")
+    parser.add_argument("--replay", default=None, help="回放 cassette 文件代替真实请求")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="回放速度倍数，0 表示最快速度")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="工作进程数，大于 1 时把并发分到多个进程，结果通过共享内存直方图合并")
+    parser.add_argument("--mock", action="store_true", help="在本进程中启动模拟服务器并对其压测")
+    parser.add_argument("--mock-latency", type=float, default=0.05, help="模拟服务器首字节延迟（秒）")
+    parser.add_argument("--mock-token-rate", type=float, default=200, help="模拟服务器 token 速率")
+    parser.add_argument("--mock-slow-rate", type=float, default=0.0, help="模拟服务器长尾请求的概率")
+    parser.add_argument("--mock-slow-latency", type=float, default=0.0, help="模拟服务器长尾请求额外延迟（秒）")
+    args = parser.parse_args(argv)
+    if args.processes > 1 and (args.record or args.traces):
+        parser.error("--processes 不支持 --record / --traces（多进程模式不保留单个采样）")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    queries = args.query or ["什么是人工智能?", "机器学习算法", "深度学习", "神经网络"]
+
+    mock_server = None
+    base_url = test_chat_messages.API_BASE_URL
+    if args.mock:
+        from mock_dify_server import MockConfig, MockServerThread
+        mock_server = MockServerThread(MockConfig(
+            latency=args.mock_latency,
+            slow_rate=args.mock_slow_rate,
+            slow_latency=args.mock_slow_latency,
+            token_rate=args.mock_token_rate
+        )).start()
+        base_url = mock_server.base_url
+        test_knowledge_retrieve.API_BASE_URL = base_url
+
+    if args.target == "retrieve":
+        api_key = test_knowledge_retrieve.API_KEY
+    else:
+        api_key = test_chat_messages.API_KEY
+
+    limiter_options = None
+    if (args.rps or args.tpm) and args.target != "retrieve":
+        limiter_options = {"requests_per_second": args.rps, "tokens_per_minute": args.tpm, "mode": args.limit_mode}
+
+    if args.processes > 1:
+        try:
+            report = run_multiprocess({
+                "target": args.target,
+                "base_url": base_url,
+                "api_key": api_key,
+                "queries": queries,
+                "concurrency": args.concurrency,
+                "rate": args.rate,
+                "total_requests": args.requests,
+                "duration": args.duration,
+                "poisson": args.poisson,
+                "retries": args.retries,
+                "hedge": args.hedge,
+                "replay": args.replay,
+                "replay_speed": args.replay_speed,
+                "limiter": limiter_options
+            }, args.processes)
+        except RuntimeError as e:
+            raise SystemExit(f"✗ {e}")
+        finally:
+            if mock_server is not None:
+                mock_server.stop()
+    else:
+        resilience = None
+        if args.retries:
+            resilience = Resilience(RetryPolicy(max_attempts=args.retries + 1))
+        if args.replay:
+            client = ReplayClient(args.replay, speed=args.replay_speed or None, base_url=base_url)
+        elif args.record:
+            client = RecordingClient(api_key, args.record, base_url, pool_size=args.concurrency * 2, resilience=resilience)
+        else:
+            client = DifyClient(api_key, base_url, pool_size=args.concurrency * 2, resilience=resilience)
+        run_options = {}
+        hedger = None
+        if args.hedge is not None and args.target == "retrieve":
+            hedger = Hedger(percentile=args.hedge, max_workers=args.concurrency * 2)
+            run_options["hedger"] = hedger
+        limiter = None
+        if limiter_options:
+            limiter = RateLimiter(**limiter_options)
+            run_options["limiter"] = limiter
+        try:
+            runner = LoadRunner(
+                args.target, client, queries,
+                concurrency=args.concurrency,
+                rate=args.rate,
+                total_requests=args.requests,
+                duration=args.duration,
+                poisson=args.poisson,
+                run_options=run_options
+            )
+            report = runner.run()
+            if resilience is not None:
+                report["resilience"] = dict(resilience.stats)
+            if hedger is not None:
+                report["hedge"] = hedger.stats()
+            if limiter is not None:
+                report["limiter"] = limiter.spend()
+        finally:
+            client.close()
+            if hedger is not None:
+                hedger.close()
+            if mock_server is not None:
+                mock_server.stop()
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.output}")
+    if args.traces:
+        write_jsonl([sample["trace"] for sample in runner.samples if sample.get("trace")], args.traces)
+        print(f"计时结果已写入: {args.traces}")
@@ -0,0 +1,209 @@
+"""
+检索方式对比工具
+把查询文件中的每个查询在所有 search_method / 重排序 / top_k 组合下并行检索，
+统计每种配置的延迟百分位和分数分布，以及不同配置之间结果的重叠度
+（Jaccard 和排序偏置重叠度 RBO），用数据选出满足质量要求的最便宜配置。
+
+用法:
+    # queries.txt 每行一个查询（也支持 JSONL，每行 {"query": "..."}）
+    python bench_retrieval_methods.py queries.txt --top-k 3 5 10 --rerank --output methods.json
+
+    # 对本地模拟服务器运行
+    python bench_retrieval_methods.py queries.txt --mock
+"""
+
+import argparse
+import itertools
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import test_knowledge_retrieve
+from dify_client import DifyClient
+from dify_stats import format_summary, histogram, jaccard, rank_biased_overlap, summarize
+
+SEARCH_METHODS = ("semantic_search", "full_text_search", "hybrid_search", "keyword_search")
+SCORE_BINS = 10
+
+
+def load_queries(path):
+    """读取查询文件：纯文本每行一个查询，或 JSONL 每行一个 {"query": ...}"""
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["query"]
+            queries.append(line)
+    return queries
+
+
+def build_configs(methods, top_ks, rerank=False, rerank_provider=None, rerank_model=None):
+    """
+    生成所有检索配置组合
+
+    返回:
+        [(配置名, retrieval_config), ...]，配置名形如 "hybrid_search/rerank/top5"
+    """
+    configs = []
+    rerank_options = (False, True) if rerank else (False,)
+    for method, reranking, top_k in itertools.product(methods, rerank_options, top_ks):
+        retrieval_config = {
+            "search_method": method,
+            "reranking_enable": reranking,
+            "top_k": top_k
+        }
+        if reranking and rerank_provider and rerank_model:
+            retrieval_config["reranking_mode"] = {
+                "reranking_provider_name": rerank_provider,
+                "reranking_model_name": rerank_model
+            }
+        name = f"{method}/{'rerank' if reranking else 'no-rerank'}/top{top_k}"
+        configs.append((name, retrieval_config))
+    return configs
+
+
+def run_comparison(queries, configs, client, concurrency=8):
+    """
+    并行执行所有 (配置, 查询) 组合
+
+    返回:
+        {配置名: {查询: {"ids": 分段ID列表, "scores": 分数列表, "latency": 秒} 或 {"error": 错误信息}}}
+    """
+    def run(task):
+        name, retrieval_config, query = task
+        start_time = time.perf_counter()
+        try:
+            result = test_knowledge_retrieve.retrieve_from_knowledge_base(
+                query,
+                retrieval_config=retrieval_config,
+                client=client,
+                verbose=False,
+                raise_errors=True
+            )
+        except Exception as e:
+            return name, query, {"error": f"{type(e).__name__}: {e}"}
+        records = result.get("records", [])
+        return name, query, {
+            "ids": [record.get("segment", {}).get("id") for record in records],
+            "scores": [record.get("score") or 0.0 for record in records],
+            "latency": time.perf_counter() - start_time
+        }
+
+    tasks = [(name, retrieval_config, query) for name, retrieval_config in configs for query in queries]
+    outcomes = {name: {} for name, _ in configs}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for name, query, outcome in executor.map(run, tasks):
+            outcomes[name][query] = outcome
+    return outcomes
+
+
+def build_report(queries, configs, outcomes, rbo_p=0.9):
+    """汇总延迟、分数分布和配置之间的重叠度"""
+    report = {"queries": len(queries), "configs": {}, "overlap": []}
+    for name, retrieval_config in configs:
+        results = [outcome for outcome in outcomes[name].values() if "error" not in outcome]
+        scores = [score for outcome in results for score in outcome["scores"]]
+        report["configs"][name] = {
+            "retrieval_config": retrieval_config,
+            "errors": len(queries) - len(results),
+            "latency": summarize([outcome["latency"] for outcome in results]),
+            "records": summarize([len(outcome["ids"]) for outcome in results]),
+            "scores": summarize(scores),
+            "score_histogram": histogram(scores, SCORE_BINS)
+        }
+
+    for (name_a, _), (name_b, _) in itertools.combinations(configs, 2):
+        jaccards = []
+        rbos = []
+        for query in queries:
+            a = outcomes[name_a].get(query, {})
+            b = outcomes[name_b].get(query, {})
+            if "ids" not in a or "ids" not in b:
+                continue
+            jaccards.append(jaccard(a["ids"], b["ids"]))
+            rbos.append(rank_biased_overlap(a["ids"], b["ids"], rbo_p))
+        if jaccards:
+            report["overlap"].append({
+                "a": name_a,
+                "b": name_b,
+                "jaccard": sum(jaccards) / len(jaccards),
+                "rbo": sum(rbos) / len(rbos)
+            })
+    return report
+
+
+def print_report(report, reference=None):
+    """
+    打印对比报告
+
+    参数:
+        report: build_report() 的结果
+        reference: 可选，参照配置名，只打印其它配置与它的重叠度
+    """
+    print("=" * 60)
+    print(f"检索方式对比: {report['queries']} 个查询, {len(report['configs'])} 种配置")
+    print("=" * 60)
+    for name, stats in report["configs"].items():
+        print(f"\n【{name}】" + (f"  失败 {stats['errors']} 次" if stats["errors"] else ""))
+        print("  " + format_summary("延迟", stats["latency"], "毫秒", 1000))
+        print("  " + format_summary("分数", stats["scores"], ""))
+        print(f"  分数分布 (0.0-1.0, {SCORE_BINS} 段): {stats['score_histogram']}")
+
+    print("\n" + "-" * 60)
+    print("结果重叠度（Jaccard / RBO）")
+    print("-" * 60)
+    for item in sorted(report["overlap"], key=lambda item: item["rbo"], reverse=True):
+        if reference and reference not in (item["a"], item["b"]):
+            continue
+        print(f"  {item['a']:<36} vs {item['b']:<36} Jaccard={item['jaccard']:.3f}  RBO={item['rbo']:.3f}")
+    print("=" * 60)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="检索方式对比工具")
+    parser.add_argument("queries", help="查询文件（每行一个查询，或 JSONL）")
+    parser.add_argument("--methods", nargs="+", default=list(SEARCH_METHODS), choices=SEARCH_METHODS,
+                        help="参与对比的检索方式")
+    parser.add_argument("--top-k", nargs="+", type=int, default=[5], help="参与对比的 top_k")
+    parser.add_argument("--rerank", action="store_true", help="同时对比启用重排序的配置")
+    parser.add_argument("--rerank-provider", default=None, help="重排序模型供应商，例如 cohere")
+    parser.add_argument("--rerank-model", default=None, help="重排序模型，例如 rerank-multilingual-v2.0")
+    parser.add_argument("--concurrency", type=int, default=8, help="并行请求数")
+    parser.add_argument("--rbo-p", type=float, default=0.9, help="RBO 的持续概率 p，越小越看重前几位")
+    parser.add_argument("--reference", default=None, help="只打印与该配置的重叠度，例如 hybrid_search/rerank/top5")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件路径")
+    parser.add_argument("--mock", action="store_true", help="在本进程中启动模拟服务器并对其运行")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    queries = load_queries(args.queries)
+    configs = build_configs(args.methods, args.top_k, args.rerank, args.rerank_provider, args.rerank_model)
+
+    mock_server = None
+    base_url = test_knowledge_retrieve.API_BASE_URL
+    if args.mock:
+        from mock_dify_server import MockConfig, MockServerThread
+        mock_server = MockServerThread(MockConfig(
+            latency=0.05, latency_jitter=0.05, records=max(args.top_k), rerank_latency=0.1
+        )).start()
+        base_url = mock_server.base_url
+
+    client = DifyClient(test_knowledge_retrieve.API_KEY, base_url, pool_size=args.concurrency)
+    try:
+        outcomes = run_comparison(queries, configs, client, args.concurrency)
+    finally:
+        client.close()
+        if mock_server is not None:
+            mock_server.stop()
+
+    report = build_report(queries, configs, outcomes, args.rbo_p)
+    print_report(report, args.reference)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.output}")
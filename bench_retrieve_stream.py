@@ -0,0 +1,137 @@
+"""
+检索响应解码性能基准测试
+对比 response.json()、dify_models 对象解析、增量解码和 top-N 增量解码
+四种方式的首条记录时间、总耗时和峰值内存（RSS）
+
+每种方式在独立的子进程中运行，峰值 RSS 互不影响。
+
+用法:
+    python bench_retrieve_stream.py --records 5000 --segment-size 2000 --bandwidth 20000000
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import test_knowledge_retrieve
+from dify_client import DifyClient
+from dify_json_stream import iter_retrieve_records, top_records
+from dify_models import parse_retrieve_response
+
+MODES = ("json", "models", "stream", "top")
+
+
+def peak_rss_mb():
+    """
+    当前进程的峰值 RSS（MB）
+
+    Linux 下读取 /proc/self/status 的 VmHWM（ru_maxrss 会继承 exec 之前父进程的峰值），
+    其它平台使用 ru_maxrss。
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def reset_peak_rss():
+    """把峰值 RSS 重置为当前值（仅 Linux 支持，其它平台忽略）"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def run_mode(mode, base_url, records, top_n):
+    """在当前进程中执行一次检索，返回测量结果"""
+    client = DifyClient(test_knowledge_retrieve.API_KEY, base_url)
+    path = f"/datasets/{test_knowledge_retrieve.DATASET_ID}/retrieve"
+    payload = {"query": "基准测试", "retrieval_model": {"top_k": records}}
+
+    # 预热连接，基准 RSS 包含解释器、依赖库和连接池
+    client.request(path, {"query": "预热", "retrieval_model": {"top_k": 1}}).json()
+    reset_peak_rss()
+    baseline_rss = peak_rss_mb()
+
+    start_time = time.perf_counter()
+    first_record_time = None
+    if mode in ("json", "models"):
+        response = client.request(path, payload)
+        result = response.json()["records"] if mode == "json" else parse_retrieve_response(response.content).records
+        first_record_time = time.perf_counter()
+        count = len(result)
+    else:
+        response = client.request(path, payload, stream=True)
+        stream = iter_retrieve_records(response.iter_content(chunk_size=65536))
+        if mode == "top":
+            result = top_records(stream, top_n)
+            first_record_time = time.perf_counter()
+            count = len(result)
+        else:
+            result = []
+            for record in stream:
+                if first_record_time is None:
+                    first_record_time = time.perf_counter()
+                result.append(record)
+            count = len(result)
+    total_time = time.perf_counter() - start_time
+    client.close()
+
+    return {
+        "mode": mode,
+        "records": count,
+        "first_record": first_record_time - start_time if first_record_time else None,
+        "total": total_time,
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="检索响应解码性能基准测试")
+    parser.add_argument("--records", type=int, default=5000, help="检索返回的记录数（top_k）")
+    parser.add_argument("--segment-size", type=int, default=2000, help="每条记录的内容长度（字符）")
+    parser.add_argument("--bandwidth", type=float, default=20e6, help="模拟服务器发送速率（字节/秒），0 表示不限速")
+    parser.add_argument("--top-n", type=int, default=10, help="top 模式保留的记录数")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.child, args.base_url, args.records, args.top_n)))
+        sys.exit(0)
+
+    from mock_dify_server import MockConfig, MockServerThread
+
+    print("=" * 60)
+    bandwidth = f"{args.bandwidth / 1e6:.0f} MB/秒" if args.bandwidth else "不限"
+    print(f"检索响应解码基准: {args.records} 条记录, 每条 {args.segment_size} 字符, 带宽 {bandwidth}")
+    print("=" * 60)
+
+    config = MockConfig(records=args.records, segment_size=args.segment_size, bandwidth=args.bandwidth)
+    with MockServerThread(config) as server:
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", mode, "--base-url", server.base_url,
+                 "--records", str(args.records), "--top-n", str(args.top_n)],
+                check=True, capture_output=True, text=True
+            ).stdout
+            result = json.loads(output)
+            print(f"{mode:>7}: 首条记录 {result['first_record'] * 1000:8.1f} 毫秒  "
+                  f"总耗时 {result['total'] * 1000:8.1f} 毫秒  "
+                  f"峰值 RSS {result['peak_rss_mb']:7.1f} MB (+{result['peak_rss_mb'] - result['baseline_rss_mb']:.1f})  "
+                  f"记录数 {result['records']}")
+    print("=" * 60)
@@ -0,0 +1,106 @@
+"""
+SSE 解析性能基准测试
+对比原来的逐行解析循环（iter_lines + decode + startswith + json.loads）
+与增量式字节解析器 dify_sse.SSEParser 的事件吞吐量（events/sec）
+"""
+
+import io
+import json
+import time
+
+import requests
+
+from dify_sse import iter_sse_events
+
+# 基准测试配置
+EVENT_COUNT = 50000
+CHUNK_SIZES = [64, 512, 8192]
+ROUNDS = 3
+
+
+def build_stream(event_count):
+    """构造一段模拟的 Dify 流式响应"""
+    parts = []
+    for i in range(event_count):
+        data = {
+            "event": "message",
+            "task_id": "900bbd43-dc0b-4383-a372-aa6e6c414227",
+            "message_id": "663c5084-a254-4040-8ad3-51f2a3c1a77c",
+            "conversation_id": "45701982-8118-4bc5-8e9b-64562b4555f2",
+            "answer": f"第{i}个词元",
+            "created_at": 1705398420
+        }
+        parts.append(f"data: {json.dumps(data, ensure_ascii=False)}\n\n")
+        if i % 100 == 0:
+            parts.append("event: ping\n\n")
+    parts.append('data: {"event": "message_end", "metadata": {}}\n\n')
+    return "".join(parts).encode("utf-8")
+
+
+def make_response(body):
+    """用内存中的字节构造一个 requests.Response，模拟从连接读取"""
+    response = requests.models.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(body)
+    return response
+
+
+def parse_line_loop(body, chunk_size):
+    """原来的解析方式"""
+    count = 0
+    response = make_response(body)
+    for line in response.iter_lines(chunk_size=chunk_size):
+        if line:
+            line_text = line.decode('utf-8')
+            if line_text.startswith('data: '):
+                data_str = line_text[6:]
+                try:
+                    data = json.loads(data_str)
+                    data.get('event', '')
+                    count += 1
+                except json.JSONDecodeError:
+                    pass
+    return count
+
+
+def parse_sse_parser(body, chunk_size):
+    """增量式字节解析器"""
+    count = 0
+    response = make_response(body)
+    for sse in iter_sse_events(response.iter_content(chunk_size=chunk_size)):
+        data = sse.json()
+        data.get('event', '')
+        count += 1
+    return count
+
+
+def run_benchmark(name, func, body, chunk_size):
+    """多轮运行取最好成绩，返回 events/sec"""
+    best = None
+    count = 0
+    for _ in range(ROUNDS):
+        start_time = time.perf_counter()
+        count = func(body, chunk_size)
+        elapsed_time = time.perf_counter() - start_time
+        best = elapsed_time if best is None else min(best, elapsed_time)
+    rate = count / best
+    print(f"  {name:<16} {count:>8} 个事件  {best:.3f}秒  {rate:>12,.0f} events/sec")
+    return rate
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("SSE 解析性能基准测试")
+    print("=" * 60)
+
+    body = build_stream(EVENT_COUNT)
+    print(f"模拟流大小: {len(body) / 1024 / 1024:.2f} MB, 消息事件数: {EVENT_COUNT}")
+
+    for chunk_size in CHUNK_SIZES:
+        print("-" * 60)
+        print(f"数据块大小: {chunk_size} 字节")
+        old_rate = run_benchmark("逐行解析循环", parse_line_loop, body, chunk_size)
+        new_rate = run_benchmark("SSEParser", parse_sse_parser, body, chunk_size)
+        print(f"  提升: {new_rate / old_rate:.2f}x")
+
+    print("=" * 60)
@@ -0,0 +1,190 @@
+"""
+流式回复的累积缓冲区和输出目标（sink）
+"""
+
+import sys
+import threading
+import time
+
+DEFAULT_FPS = 30
+
+
+class NullSink:
+    """
+    丢弃所有输出的 sink，也是其他 sink 的基类
+
+    sink 需要实现:
+        write(chunk): 收到一个新的回复片段
+        replace(text): 回复内容被整体替换（message_replace 事件）
+        flush(): 把尚未输出的内容立即输出
+        close(): 结束输出
+    """
+
+    def write(self, chunk):
+        pass
+
+    def replace(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class TerminalSink(NullSink):
+    """
+    终端输出（打字机效果）
+
+    按固定帧率合并输出，而不是每个片段都 flush 一次，
+    避免高 token 速率下打印本身拖慢对流的读取。
+    帧间隔内到达的片段在这一帧结束时由定时器输出，模型停顿时不会停留在缓冲区中。
+
+    参数:
+        stream: 输出流，默认为 sys.stdout
+        fps: 每秒最多刷新次数
+    """
+
+    def __init__(self, stream=None, fps=DEFAULT_FPS):
+        self.stream = stream or sys.stdout
+        self.interval = 1.0 / fps
+        self._pending = []
+        self._last_flush = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def write(self, chunk):
+        with self._lock:
+            self._pending.append(chunk)
+            delay = self._last_flush + self.interval - time.monotonic()
+            if delay <= 0:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def replace(self, text):
+        with self._lock:
+            self._flush()
+            self.stream.write(f"\n[消息替换] {text}")
+            self.stream.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            self.stream.write("".join(self._pending))
+            self._pending = []
+        self.stream.flush()
+        self._last_flush = time.monotonic()
+
+
+class FileSink(NullSink):
+    """
+    写入文件
+
+    message_replace 时清空文件并写入替换后的内容，文件中始终是当前完整回复。
+
+    参数:
+        path: 文件路径
+        encoding: 文件编码
+    """
+
+    def __init__(self, path, encoding="utf-8"):
+        self.path = path
+        self.file = open(path, "w", encoding=encoding)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def replace(self, text):
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class CallbackSink(NullSink):
+    """
+    回调函数
+
+    参数:
+        on_chunk: 收到回复片段时调用 on_chunk(chunk)
+        on_replace: 可选，回复被替换时调用 on_replace(text)
+    """
+
+    def __init__(self, on_chunk, on_replace=None):
+        self.on_chunk = on_chunk
+        self.on_replace = on_replace
+
+    def write(self, chunk):
+        self.on_chunk(chunk)
+
+    def replace(self, text):
+        if self.on_replace:
+            self.on_replace(text)
+
+
+class AnswerBuffer:
+    """
+    流式回复缓冲区
+
+    片段追加到列表中（均摊 O(1)），只在需要完整回复时拼接一次，
+    避免 full_answer += chunk 在长回复下的二次方开销。
+    每个片段同时转发给所有 sink。
+
+    参数:
+        sinks: 可选，sink 列表，默认不输出
+    """
+
+    def __init__(self, sinks=None):
+        self.sinks = list(sinks or [])
+        self._chunks = []
+        self._length = 0
+
+    def append(self, chunk):
+        """追加一个回复片段"""
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        for sink in self.sinks:
+            sink.write(chunk)
+
+    def replace(self, text):
+        """用 text 替换目前为止的全部回复（message_replace 事件）"""
+        self._chunks = [text] if text else []
+        self._length = len(text)
+        for sink in self.sinks:
+            sink.replace(text)
+
+    def getvalue(self):
+        """返回完整回复"""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def flush(self):
+        """让所有 sink 立即输出尚未输出的内容"""
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        """结束输出"""
+        for sink in self.sinks:
+            sink.close()
+
+    def __len__(self):
+        return self._length
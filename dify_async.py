@@ -0,0 +1,260 @@
+"""
+Dify API 异步客户端（asyncio）
+在同一个事件循环中并发执行多个检索 / 流式对话请求
+"""
+
+import asyncio
+import json
+
+import aiohttp
+
+from dify_client import DEFAULT_BASE_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from dify_deadline import DEADLINE_EXCEEDED, STALLED, Deadline
+from dify_sse import aiter_sse_events
+
+DEFAULT_MAX_CONCURRENCY = 20
+
+
+class AsyncDifyClient:
+    """
+    异步 Dify API 客户端
+
+    所有请求共用一个 aiohttp 连接池，并通过信号量限制同时进行中的请求数
+    （流式对话在整个流读取期间都占用一个名额）。
+
+    参数:
+        api_key: API 密钥
+        base_url: API 基础 URL，测试时可指向本地桩服务器
+        max_concurrency: 最大并发请求数
+        connect_timeout: 连接超时（秒）
+        read_timeout: 读取超时（秒）
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self._session = None
+
+    @property
+    def session(self):
+        """延迟创建 ClientSession（必须在事件循环中创建）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=self.timeout,
+                connector=connector
+            )
+        return self._session
+
+    def url(self, path):
+        """拼接完整的请求 URL"""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def post(self, path, payload, deadline=None, stall_timeout=None):
+        """
+        发送 POST 请求，返回可用于 async with 的响应上下文
+
+        参数:
+            deadline: 可选，Deadline，从发出请求到读完响应体的总时间不超过剩余时间；
+                      已经超过截止时间时不发出请求，抛出 asyncio.TimeoutError
+            stall_timeout: 可选，两次收到数据之间的最长间隔（秒），代替默认的读取超时
+        """
+        if deadline is None and stall_timeout is None:
+            return self.session.post(self.url(path), json=payload)
+        if deadline is not None and deadline.expired():
+            # ClientTimeout(total=0) 表示不限制总时间，已经超过截止时间时不能再发出请求
+            raise asyncio.TimeoutError("已超过截止时间")
+        timeout = aiohttp.ClientTimeout(
+            total=deadline.remaining() if deadline is not None else None,
+            sock_connect=self.connect_timeout,
+            sock_read=stall_timeout or self.read_timeout
+        )
+        return self.session.post(self.url(path), json=payload, timeout=timeout)
+
+    async def close(self):
+        """关闭连接池"""
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+def _timeout_reason(deadline):
+    """asyncio.TimeoutError 的原因：超过截止时间，否则是读取停顿"""
+    return DEADLINE_EXCEEDED if deadline is not None and deadline.expired() else STALLED
+
+
+async def retrieve_from_knowledge_base_async(client, dataset_id, query, retrieval_config=None, deadline=None):
+    """
+    从知识库检索相关块 - 异步版本
+
+    参数:
+        client: AsyncDifyClient 实例（知识库 API Key）
+        dataset_id: 知识库ID
+        query: 搜索查询字符串
+        retrieval_config: 可选的检索配置
+        deadline: 可选，截止时间（Deadline 或秒数），包括等待并发名额的时间
+
+    返回:
+        检索结果，失败时返回 None
+    """
+    deadline = Deadline.of(deadline)
+    payload = {
+        "query": query
+    }
+    if retrieval_config:
+        payload["retrieval_model"] = retrieval_config
+
+    async with client.semaphore:
+        try:
+            async with client.post(f"/datasets/{dataset_id}/retrieve", payload, deadline=deadline) as response:
+                if response.status == 200:
+                    return await response.json()
+                print(f"✗ 检索失败! 状态码: {response.status}, 错误信息: {await response.text()}")
+                return None
+        except asyncio.TimeoutError:
+            print(f"✗ 请求超时: {_timeout_reason(deadline)}")
+            return None
+        except aiohttp.ClientError as e:
+            print(f"✗ 发生异常: {str(e)}")
+            return None
+
+
+async def send_chat_message_streaming_async(client, query, conversation_id=None, inputs=None, user="test-user",
+                                            deadline=None, stall_timeout=None):
+    """
+    发送聊天消息 - 流式模式的异步版本
+
+    以异步生成器的形式逐个产出 SSE 事件（已解析的 dict）。
+    请求失败时产出一个 event 为 "error" 的事件后结束；超时时该事件的 code 为
+    "deadline_exceeded" 或 "stalled"，连接随之关闭。
+
+    参数:
+        client: AsyncDifyClient 实例（App API Key）
+        query: 用户输入/提问内容
+        conversation_id: 可选，会话ID
+        inputs: 可选，App 定义的各变量值
+        user: 用户标识
+        deadline: 可选，截止时间（Deadline 或秒数），从发出请求到读完最后一个事件
+        stall_timeout: 可选，两次收到数据之间的最长间隔（秒），ping 事件也算收到数据
+
+    用法:
+        async for event in send_chat_message_streaming_async(client, "你好"):
+            if event["event"] == "message":
+                print(event["answer"], end="")
+    """
+    payload = {
+        "query": query,
+        "inputs": inputs or {},
+        "response_mode": "streaming",
+        "user": user
+    }
+    if conversation_id:
+        payload["conversation_id"] = conversation_id
+    deadline = Deadline.of(deadline)
+
+    async with client.semaphore:
+        try:
+            async with client.post("/chat-messages", payload, deadline=deadline, stall_timeout=stall_timeout) as response:
+                if response.status != 200:
+                    yield {
+                        "event": "error",
+                        "status": response.status,
+                        "message": await response.text()
+                    }
+                    return
+
+                # 处理 SSE 流
+                async for sse in aiter_sse_events(response.content.iter_any()):
+                    try:
+                        yield sse.json()
+                    except json.JSONDecodeError:
+                        print(f"✗ [无法解析的事件数据] {sse.data[:200]}")
+        except asyncio.TimeoutError:
+            reason = _timeout_reason(deadline)
+            yield {"event": "error", "status": None, "code": reason, "message": f"请求超时: {reason}"}
+        except aiohttp.ClientError as e:
+            yield {"event": "error", "status": None, "message": str(e)}
+
+
+async def collect_chat_answer_async(client, query, conversation_id=None, inputs=None, user="test-user",
+                                    deadline=None, stall_timeout=None):
+    """
+    消费流式对话并汇总结果，返回结构与 send_chat_message_streaming 相同
+    """
+    answer_chunks = []
+    result = {
+        "message_id": None,
+        "conversation_id": None,
+        "task_id": None,
+        "answer": "",
+        "metadata": None
+    }
+
+    async for data in send_chat_message_streaming_async(client, query, conversation_id, inputs, user,
+                                                        deadline=deadline, stall_timeout=stall_timeout):
+        event = data.get('event', '')
+        if event == 'message':
+            answer_chunks.append(data.get('answer', ''))
+            result["message_id"] = result["message_id"] or data.get('message_id')
+            result["conversation_id"] = result["conversation_id"] or data.get('conversation_id')
+            result["task_id"] = result["task_id"] or data.get('task_id')
+        elif event == 'message_replace':
+            answer_chunks = [data.get('answer', '')]
+        elif event == 'message_end':
+            result["metadata"] = data.get('metadata', {})
+            result["message_id"] = data.get('message_id') or result["message_id"]
+            result["conversation_id"] = data.get('conversation_id') or result["conversation_id"]
+        elif event == 'error':
+            print(f"✗ [错误] {data.get('message')}")
+            return None
+
+    result["answer"] = "".join(answer_chunks)
+    return result
+
+
+async def main():
+    """示例：并发执行多个检索和流式对话"""
+    from test_chat_messages import API_BASE_URL, API_KEY as APP_API_KEY
+    from test_knowledge_retrieve import API_KEY as DATASET_API_KEY, DATASET_ID
+
+    queries = ["什么是人工智能?", "机器学习算法", "深度学习", "神经网络"]
+
+    async with AsyncDifyClient(DATASET_API_KEY, API_BASE_URL, max_concurrency=4) as dataset_client:
+        results = await asyncio.gather(*[
+            retrieve_from_knowledge_base_async(dataset_client, DATASET_ID, query)
+            for query in queries
+        ])
+        for query, result in zip(queries, results):
+            count = len(result.get('records', [])) if result else 0
+            print(f"{query}: {count} 条结果")
+
+    print("-" * 60)
+
+    async with AsyncDifyClient(APP_API_KEY, API_BASE_URL, max_concurrency=4) as app_client:
+        results = await asyncio.gather(*[
+            collect_chat_answer_async(app_client, query)
+            for query in queries
+        ])
+        for query, result in zip(queries, results):
+            print(f"\n【{query}】")
+            print(result["answer"] if result else "（请求失败）")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
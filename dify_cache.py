@@ -0,0 +1,366 @@
+"""
+知识库检索结果缓存和对话回复缓存
+- RetrievalCache: LRU + TTL 的内存缓存，可选使用 SQLite 文件持久化（进程重启后仍然有效）
+- ChatResponseCache: 无会话（首轮）对话的精确匹配回复缓存，按总字节数限制大小
+"""
+
+import copy
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from dify_sse import encode_sse_event
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 3600
+DEFAULT_MAX_DISK_ENTRIES = 100000
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def normalize_query(query):
+    """
+    规范化查询字符串
+
+    统一全角 / 半角（NFKC）、大小写，合并连续空白，
+    使 "什么是人工智能？" 和 "什么是人工智能?" 命中同一条缓存。
+    """
+    query = unicodedata.normalize("NFKC", query).casefold()
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def make_cache_key(dataset_id, query, retrieval_config=None):
+    """
+    生成缓存键：知识库ID + 规范化查询 + 检索配置的规范 JSON
+    """
+    canonical = json.dumps(
+        [dataset_id, normalize_query(query), retrieval_config or {}],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class RetrievalCache:
+    """
+    检索结果缓存
+
+    内存中按 LRU 淘汰，每个条目有独立的过期时间；
+    指定 path 时同时写入 SQLite 文件，内存未命中时会回查磁盘。
+    线程安全，可以在多个线程中共用。写入和读取的都是副本，修改返回的结果不会影响缓存。
+
+    参数:
+        max_entries: 内存中最多保存的条目数
+        ttl: 默认过期时间（秒）
+        path: 可选，SQLite 持久化文件路径
+        max_disk_entries: 磁盘中最多保存的条目数
+
+    统计:
+        hits / misses / evictions / expirations / disk_hits，见 stats()
+        （evictions 包括内存中的 LRU 淘汰和磁盘超出 max_disk_entries 时删除的条目）
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, path=None,
+                 max_disk_entries=DEFAULT_MAX_DISK_ENTRIES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.disk_hits = 0
+
+        self._db = None
+        self._disk_count = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS retrieve_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS retrieve_cache_accessed_at ON retrieve_cache (accessed_at)"
+            )
+            self._db.execute("DELETE FROM retrieve_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+            # 之后按写入和删除维护条目数，写入时不再 COUNT(*) 全表
+            self._disk_count = self._db.execute("SELECT COUNT(*) FROM retrieve_cache").fetchone()[0]
+
+    def make_key(self, dataset_id, query, retrieval_config=None):
+        """生成缓存键，见 make_cache_key"""
+        return make_cache_key(dataset_id, query, retrieval_config)
+
+    def get(self, key):
+        """
+        读取缓存
+
+        返回:
+            缓存的检索结果，未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._entries[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM retrieve_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        value = json.loads(row[0])
+                        self._db.execute(
+                            "UPDATE retrieve_cache SET accessed_at = ? WHERE key = ?", (now, key)
+                        )
+                        self._db.commit()
+                        self._put(key, value, row[1])
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return copy.deepcopy(value)
+                    self._db.execute("DELETE FROM retrieve_cache WHERE key = ?", (key,))
+                    self._db.commit()
+                    self._disk_count -= 1
+                    self.expirations += 1
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value, ttl=None):
+        """
+        写入缓存
+
+        参数:
+            key: 缓存键
+            value: 检索结果（必须可以序列化为 JSON）
+            ttl: 可选，覆盖默认过期时间（秒）
+        """
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._put(key, copy.deepcopy(value), expires_at)
+            if self._db is not None:
+                exists = self._db.execute("SELECT 1 FROM retrieve_cache WHERE key = ?", (key,)).fetchone()
+                if exists is None:
+                    self._disk_count += 1
+                self._db.execute(
+                    "INSERT OR REPLACE INTO retrieve_cache (key, value, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at, now)
+                )
+                self._trim_disk()
+                self._db.commit()
+
+    def clear(self):
+        """清空缓存（包括磁盘）"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM retrieve_cache")
+                self._db.commit()
+                self._disk_count = 0
+
+    def stats(self):
+        """返回命中 / 未命中 / 淘汰等统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "disk_hits": self.disk_hits
+            }
+
+    def close(self):
+        """关闭磁盘存储"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _trim_disk(self):
+        if self._disk_count > self.max_disk_entries:
+            deleted = self._db.execute(
+                "DELETE FROM retrieve_cache WHERE key IN ("
+                "SELECT key FROM retrieve_cache ORDER BY accessed_at LIMIT ?)",
+                (self._disk_count - self.max_disk_entries,)
+            ).rowcount
+            self.evictions += deleted
+            self._disk_count = self.max_disk_entries
+
+
+def make_chat_cache_key(app, query, inputs=None, user=None):
+    """
+    生成对话缓存键：App（API Key 的摘要）+ 规范化查询 + inputs 的规范 JSON + 用户范围
+    """
+    canonical = json.dumps(
+        [hashlib.sha256(app.encode("utf-8")).hexdigest(), normalize_query(query), inputs or {}, user],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ChatResponseCache:
+    """
+    对话回复缓存
+
+    只用于没有 conversation_id 的请求（首轮对话的回复不依赖历史消息）。
+    保存回复内容和 metadata，不保存 message_id / conversation_id，
+    命中时不会把别人的会话交给当前用户。
+    内存中按 LRU 淘汰，每个条目有独立的过期时间，所有条目的总字节数不超过 max_bytes。
+
+    参数:
+        max_bytes: 缓存内容的总字节数上限（按 JSON 序列化后的大小计算）
+        ttl: 默认过期时间（秒）
+        per_user: 为 True 时不同用户的缓存互相隔离；为 False 时同一个 App 的所有用户共享
+
+    统计:
+        hits / misses / evictions / expirations / saved_tokens / saved_seconds，见 stats()
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL, per_user=True):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.per_user = per_user
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_tokens = 0
+        self.saved_seconds = 0.0
+
+    def make_key(self, app, query, inputs=None, user=None):
+        """生成缓存键，见 make_chat_cache_key"""
+        return make_chat_cache_key(app, query, inputs, user if self.per_user else None)
+
+    def get(self, key):
+        """
+        读取缓存
+
+        返回:
+            {"answer": 回复, "metadata": metadata}，未命中或已过期时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, size, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    usage = (value.get("metadata") or {}).get("usage") or {}
+                    self.saved_tokens += usage.get("total_tokens") or 0
+                    self.saved_seconds += float(usage.get("latency") or 0)
+                    return value
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+
+    def set(self, key, answer, metadata=None, ttl=None):
+        """
+        写入缓存
+
+        参数:
+            key: 缓存键
+            answer: 完整的回复内容
+            metadata: 可选，回复的 metadata（usage、retriever_resources 等）
+            ttl: 可选，覆盖默认过期时间（秒）
+        """
+        value = {"answer": answer, "metadata": metadata or {}}
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        """返回命中 / 未命中 / 淘汰以及节省的 tokens 和生成时间"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "saved_tokens": self.saved_tokens,
+                "saved_seconds": self.saved_seconds
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+
+def iter_cached_sse(value, chunk_chars=8):
+    """
+    把缓存的回复编码为合成的 SSE 字节流
+
+    依次产出若干 message 事件（每个最多 chunk_chars 个字符）和一个 message_end 事件，
+    可以直接交给 iter_sse_events 解析，使缓存命中与真实请求走同一条处理路径。
+
+    参数:
+        value: ChatResponseCache.get() 返回的条目
+        chunk_chars: 每个 message 事件的字符数
+    """
+    answer = value.get("answer", "")
+    for start in range(0, len(answer), chunk_chars):
+        yield encode_sse_event({"event": "message", "answer": answer[start:start + chunk_chars]})
+    yield encode_sse_event({"event": "message_end", "metadata": value.get("metadata") or {}})
@@ -0,0 +1,221 @@
+"""
+流式生成的取消与提前停止
+CancellationToken 用于从其它线程取消正在进行的流式请求；
+StopConditions 描述自动停止的条件（最大 token 数、最大字符数、截止时间、停止序列）。
+
+触发后 send_chat_message_streaming 会关闭连接，并用捕获到的 task_id 调用
+POST /chat-messages/{task_id}/stop，让服务端也停止生成，不再继续消耗 token。
+
+用法:
+    token = CancellationToken()
+    threading.Timer(2.0, token.cancel).start()
+    result = send_chat_message_streaming(
+        "写一篇长文",
+        cancel_token=token,
+        stop=StopConditions(max_chars=500, deadline=10, stop_sequences=["\\n\\n"])
+    )
+    print(result["stopped"])   # None / "cancelled" / "max_tokens" / "max_chars" / "deadline" / "stop_sequence"
+"""
+
+import socket
+import threading
+import time
+
+# 停止原因
+CANCELLED = "cancelled"
+MAX_TOKENS = "max_tokens"
+MAX_CHARS = "max_chars"
+DEADLINE = "deadline"
+STOP_SEQUENCE = "stop_sequence"
+
+
+class CancellationToken:
+    """
+    取消令牌（线程安全）
+
+    cancel() 可以在任意线程调用，只有第一次调用生效；
+    注册的回调在取消时立即执行（已取消时注册则马上执行），用于中断阻塞中的读取。
+
+    参数:
+        parent: 可选，父令牌；父令牌取消时本令牌随之取消，本令牌取消不影响父令牌
+    """
+
+    def __init__(self, parent=None):
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._unlink = parent.register(self.cancel) if parent is not None else None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self, reason=CANCELLED):
+        """取消，返回本次调用是否生效"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(reason)
+            except Exception:
+                pass
+        return True
+
+    def register(self, callback):
+        """
+        注册取消回调 callback(reason)
+
+        返回:
+            注销该回调的函数
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback(self.reason)
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def detach(self):
+        """与父令牌解除关联（请求结束后调用，避免长期存在的父令牌累积回调）"""
+        if self._unlink is not None:
+            self._unlink()
+            self._unlink = None
+
+    def wait(self, timeout=None):
+        """等待取消，返回是否已取消"""
+        return self._event.wait(timeout)
+
+
+class StopConditions:
+    """
+    流式回复的停止条件，可以在多个请求之间复用
+
+    参数:
+        max_tokens: 最多接收的 message 事件数（Dify 大约每个 token 发送一个 message 事件）
+        max_chars: 回复的最大字符数，超出部分被截掉
+        deadline: 从请求开始算起的最长时间（秒）
+        stop_sequences: 停止序列列表，回复在第一个停止序列之前截断（不包含停止序列本身）
+    """
+
+    def __init__(self, max_tokens=None, max_chars=None, deadline=None, stop_sequences=None):
+        self.max_tokens = max_tokens
+        self.max_chars = max_chars
+        self.deadline = deadline
+        self.stop_sequences = [sequence for sequence in (stop_sequences or []) if sequence]
+
+    def monitor(self):
+        """为一次请求创建 StopMonitor"""
+        return StopMonitor(self)
+
+
+class StopMonitor:
+    """
+    一次流式请求的停止条件检查器
+
+    回复片段经过 feed() 后再输出：可能是停止序列开头的尾部字符会被暂时保留，
+    确定不是停止序列后才输出，因此停止序列跨越多个片段时也不会有任何部分被输出。
+    """
+
+    def __init__(self, conditions):
+        self.conditions = conditions
+        self.tokens = 0
+        self.chars = 0
+        self.reason = None
+        self.start_time = time.monotonic()
+        self._pending = ""
+        self._holdback = max((len(sequence) for sequence in conditions.stop_sequences), default=1) - 1
+
+    def remaining(self):
+        """距离截止时间的秒数，没有设置 deadline 时返回 None"""
+        if self.conditions.deadline is None:
+            return None
+        return self.conditions.deadline - (time.monotonic() - self.start_time)
+
+    def feed(self, chunk):
+        """
+        输入一个回复片段
+
+        返回:
+            (可以输出的文本, 停止原因或 None)
+        """
+        if self.reason is not None:
+            return "", self.reason
+        self.tokens += 1
+        text = self._pending + chunk
+        self._pending = ""
+
+        cut = -1
+        for sequence in self.conditions.stop_sequences:
+            index = text.find(sequence)
+            if index >= 0 and (cut < 0 or index < cut):
+                cut = index
+        if cut >= 0:
+            text = text[:cut]
+            self.reason = STOP_SEQUENCE
+        elif self.conditions.max_tokens is not None and self.tokens >= self.conditions.max_tokens:
+            self.reason = MAX_TOKENS
+        elif self.conditions.deadline is not None and self.remaining() <= 0:
+            self.reason = DEADLINE
+        elif self._holdback:
+            keep = self._partial_match(text)
+            if keep:
+                text, self._pending = text[:-keep], text[-keep:]
+
+        max_chars = self.conditions.max_chars
+        if max_chars is not None and self.chars + len(text) >= max_chars:
+            text = text[:max_chars - self.chars]
+            self._pending = ""
+            self.reason = self.reason or MAX_CHARS
+        self.chars += len(text)
+        return text, self.reason
+
+    def reset(self):
+        """回复被整体替换（message_replace）时清空计数和暂时保留的文本，截止时间仍从请求开始算起"""
+        self.tokens = 0
+        self.chars = 0
+        self.reason = None
+        self._pending = ""
+
+    def _partial_match(self, text):
+        """text 末尾可能是某个停止序列开头的最长长度"""
+        for size in range(min(self._holdback, len(text)), 0, -1):
+            tail = text[-size:]
+            if any(sequence.startswith(tail) for sequence in self.conditions.stop_sequences):
+                return size
+        return 0
+
+    def flush(self):
+        """流正常结束时输出暂时保留的文本"""
+        text, self._pending = self._pending, ""
+        if self.conditions.max_chars is not None:
+            text = text[:max(0, self.conditions.max_chars - self.chars)]
+        self.chars += len(text)
+        return text
+
+
+def abort_response(response):
+    """
+    立即中断一个正在读取的流式响应
+
+    只调用 response.close() 不能唤醒另一个线程中阻塞的 recv，
+    这里先对底层 socket 调用 shutdown，使阻塞的读取立即返回，再关闭响应。
+    连接不会被放回连接池。
+    """
+    connection = getattr(response.raw, "_connection", None)
+    sock = getattr(connection, "sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
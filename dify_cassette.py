@@ -0,0 +1,313 @@
+"""
+录制 / 回放 Dify API 流量（cassette）
+把真实的 /chat-messages（包括 SSE 流）和 /retrieve 响应连同数据块之间的时间间隔
+录制到压缩的 JSONL 文件中，之后可以按原始速度或以最快速度离线回放，
+用于可重复的解析和渲染性能回归测试。
+
+文件格式（.gz 结尾时使用 gzip 压缩）：每行一个 JSON 对象
+    第一行: {"type": "cassette", "version": 1, "created_at": ...}
+    之后每行一次请求:
+    {"type": "interaction", "path": "/chat-messages", "request": {...}, "stream": true,
+     "status": 200, "headers": {...}, "ttfb": 0.31, "chunks": [[0.31, "data: ..."], ...]}
+    chunks 中的时间为相对请求开始的秒数，内容为 UTF-8 文本。
+    响应没有读到结尾就被关闭（提前停止、取消、超时中断）时记录已经收到的部分，并带有 "truncated": true，
+    回放时同样在这里结束。
+
+用法:
+    # 录制
+    with RecordingClient(API_KEY, "traffic.jsonl.gz", base_url=API_BASE_URL) as client:
+        send_chat_message_streaming("你好", client=client)
+
+    # 回放（speed=1 为原始速度，speed=None 为最快速度）
+    client = ReplayClient("traffic.jsonl.gz", speed=None)
+    send_chat_message_streaming("你好", client=client)
+"""
+
+import codecs
+import collections
+import gzip
+import itertools
+import json
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from dify_client import DEFAULT_BASE_URL, DifyClient
+
+CASSETTE_VERSION = 1
+
+# 录制的响应头（其余的响应头与回放无关）
+RECORDED_HEADERS = ("Content-Type", "Retry-After")
+
+
+def open_cassette(path, mode="rt"):
+    """按扩展名打开 cassette 文件（.gz 结尾时使用 gzip）"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode.replace("t", ""), encoding="utf-8")
+
+
+def load_cassette(path):
+    """
+    读取 cassette 文件
+
+    返回:
+        interaction 列表
+    """
+    interactions = []
+    with open_cassette(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry.get("type") == "interaction":
+                interactions.append(entry)
+    return interactions
+
+
+def request_key(path, payload):
+    """请求的匹配键：路径 + 规范化的请求体"""
+    return f"{path} {json.dumps(payload, sort_keys=True, ensure_ascii=False)}"
+
+
+class _RecordingStream:
+    """
+    包装 urllib3 响应，读取数据块的同时记录内容和时间
+
+    读到结尾或被关闭（可能来自看门狗等其它线程）时调用一次 on_finish(chunks, truncated)。
+    """
+
+    def __init__(self, raw, start_time, on_finish):
+        self._raw = raw
+        self._start_time = start_time
+        self._on_finish = on_finish
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._chunks = []
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def _record(self, chunk):
+        with self._lock:
+            if self._finished:
+                return
+            text = self._decoder.decode(chunk)
+            if text:
+                self._chunks.append([round(time.perf_counter() - self._start_time, 6), text])
+
+    def _finish(self, truncated=False):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            tail = self._decoder.decode(b"", final=True)
+            if tail:
+                self._chunks.append([round(time.perf_counter() - self._start_time, 6), tail])
+        self._on_finish(self._chunks, truncated)
+
+    def stream(self, amt=None, decode_content=True):
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._record(chunk)
+            yield chunk
+        self._finish()
+
+    def read(self, amt=None, *args, **kwargs):
+        chunk = self._raw.read(amt, *args, **kwargs)
+        if chunk:
+            self._record(chunk)
+        else:
+            self._finish()
+        return chunk
+
+    def close(self):
+        # 没有读到结尾就关闭（提前停止、取消、超时中断）时记录已经收到的部分
+        self._finish(truncated=True)
+        self._raw.close()
+
+    def release_conn(self):
+        self._finish(truncated=True)
+        self._raw.release_conn()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class RecordingClient(DifyClient):
+    """
+    录制流量的 DifyClient
+
+    与 DifyClient 用法相同，每个请求的响应在被完整读取后写入 cassette 文件。
+    请求头（含 API Key）不会被录制。
+
+    参数:
+        api_key: API 密钥
+        path: cassette 文件路径（.gz 结尾时压缩）
+        其余参数同 DifyClient
+    """
+
+    def __init__(self, api_key, path, base_url=DEFAULT_BASE_URL, **kwargs):
+        super().__init__(api_key, base_url, **kwargs)
+        self.path = path
+        self._file = open_cassette(path, "wt")
+        self._write_lock = threading.Lock()
+        self._write({"type": "cassette", "version": CASSETTE_VERSION, "created_at": time.time()})
+
+    def _write(self, entry):
+        with self._write_lock:
+            if self._file.closed:
+                return
+            self._file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def post(self, path, payload, stream=False, timeout=None):
+        start_time = time.perf_counter()
+        # 总是以流式方式发出请求，才能在读取时记录每个数据块的时间
+        response = super().post(path, payload, stream=True, timeout=timeout)
+        interaction = {
+            "type": "interaction",
+            "path": "/" + path.lstrip("/"),
+            "request": payload,
+            "stream": stream,
+            "status": response.status_code,
+            "headers": {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            "ttfb": round(time.perf_counter() - start_time, 6)
+        }
+
+        def on_finish(chunks, truncated):
+            interaction["chunks"] = chunks
+            if truncated:
+                interaction["truncated"] = True
+            self._write(interaction)
+
+        response.raw = _RecordingStream(response.raw, start_time, on_finish)
+        if not stream:
+            response.content
+        return response
+
+    def close(self):
+        super().close()
+        with self._write_lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+class _ReplayStream:
+    """按录制的时间间隔产出数据块"""
+
+    def __init__(self, chunks, start_time, speed):
+        self._chunks = chunks
+        self._start_time = start_time
+        self._speed = speed
+        self._buffer = b""
+        self._iterator = self._generate()
+
+    def _generate(self):
+        for offset, text in self._chunks:
+            if self._speed:
+                delay = self._start_time + offset / self._speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            yield text.encode("utf-8")
+
+    def stream(self, amt=None, decode_content=True):
+        yield from self._iterator
+
+    def read(self, amt=None, *args, **kwargs):
+        while amt is None or len(self._buffer) < amt:
+            chunk = next(self._iterator, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if amt is None:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def close(self):
+        pass
+
+    def release_conn(self):
+        pass
+
+
+class ReplayClient(DifyClient):
+    """
+    回放 cassette 的 DifyClient，不发出任何网络请求
+
+    请求优先按 路径 + 请求体 精确匹配；找不到时按路径轮流使用录制的响应
+    （strict=True 时抛出 LookupError），因此也可以用少量录制的流量驱动压测。
+
+    参数:
+        path: cassette 文件路径
+        speed: 回放速度倍数，1 为原始速度，None 或 0 为最快速度
+        strict: 是否只允许精确匹配
+        其余参数同 DifyClient（只用于构造 URL 等，不会建立连接）
+    """
+
+    def __init__(self, path, speed=1.0, strict=False, api_key="replay", base_url=DEFAULT_BASE_URL, **kwargs):
+        super().__init__(api_key, base_url, **kwargs)
+        self.speed = speed
+        self.strict = strict
+        self.interactions = load_cassette(path)
+
+        by_key = collections.defaultdict(list)
+        by_path = collections.defaultdict(list)
+        for interaction in self.interactions:
+            by_key[request_key(interaction["path"], interaction["request"])].append(interaction)
+            by_path[interaction["path"]].append(interaction)
+        self._by_key = {key: itertools.cycle(items) for key, items in by_key.items()}
+        self._by_path = {key: itertools.cycle(items) for key, items in by_path.items()}
+        self._lock = threading.Lock()
+
+    def _match(self, path, payload):
+        path = "/" + path.lstrip("/")
+        with self._lock:
+            matches = self._by_key.get(request_key(path, payload))
+            if matches is None and not self.strict:
+                matches = self._by_path.get(path)
+            if matches is None:
+                raise LookupError(f"cassette 中没有匹配的请求: {path}")
+            return next(matches)
+
+    def post(self, path, payload, stream=False, timeout=None):
+        interaction = self._match(path, payload)
+        start_time = time.perf_counter()
+        if self.speed:
+            time.sleep(interaction["ttfb"] / self.speed)
+
+        response = requests.Response()
+        response.status_code = interaction["status"]
+        response.headers = CaseInsensitiveDict(interaction.get("headers") or {})
+        response.encoding = "utf-8"
+        response.url = self.url(path)
+        response.raw = _ReplayStream(interaction.get("chunks") or [], start_time, self.speed)
+        if not stream:
+            response.content
+        return response
+
+
+def print_cassette_summary(path):
+    """打印 cassette 中的请求概况"""
+    interactions = load_cassette(path)
+    print(f"cassette: {path}")
+    print(f"请求数: {len(interactions)}")
+    print("-" * 60)
+    for index, interaction in enumerate(interactions, 1):
+        chunks = interaction.get("chunks") or []
+        size = sum(len(text.encode("utf-8")) for _, text in chunks)
+        duration = chunks[-1][0] if chunks else interaction["ttfb"]
+        query = (interaction.get("request") or {}).get("query", "")
+        print(f"{index:>4}. {interaction['path']:<40} {interaction['status']}  "
+              f"{'流式' if interaction['stream'] else '阻塞'}  数据块 {len(chunks):>5}  "
+              f"{size:>8} 字节  {duration * 1000:8.1f} 毫秒  {query[:20]}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        print("用法: python dify_cassette.py traffic.jsonl.gz")
+        sys.exit(1)
+    print_cassette_summary(sys.argv[1])
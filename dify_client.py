@@ -0,0 +1,178 @@
+"""
+Dify API 客户端
+复用 HTTP 连接池，避免每次请求都重新进行 TCP+TLS 握手
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from dify_cancel import abort_response
+from dify_deadline import Deadline, get_watchdog
+from dify_errors import DeadlineExceededError, RequestCancelledError, error_from_exception, error_from_response
+
+# 默认配置
+DEFAULT_BASE_URL = "https://api.dify.ai/v1"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 120
+
+
+class DifyClient:
+    """
+    可复用的 Dify API 客户端
+
+    持有一个 keep-alive 连接池，请求头（含 Bearer Token）只构建一次，
+    所有请求共用同一组连接超时 / 读取超时。
+
+    参数:
+        api_key: API 密钥（知识库 API Key 或 App API Key）
+        base_url: API 基础 URL
+        pool_size: 连接池大小（同一主机可保持的最大连接数）
+        connect_timeout: 连接超时（秒）
+        read_timeout: 读取超时（秒），流式模式下为两次数据之间的最长等待时间
+                      （单次 recv 的超时，不限制整个请求；整个请求的时间上限使用 request() 的 deadline）
+        resilience: 可选，dify_retry.Resilience 实例，request() 按其策略重试和熔断
+    """
+
+    def __init__(self, api_key, base_url=DEFAULT_BASE_URL, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 resilience=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.resilience = resilience
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    def url(self, path):
+        """拼接完整的请求 URL"""
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def post(self, path, payload, stream=False, timeout=None):
+        """
+        发送 POST 请求
+
+        参数:
+            path: API 路径，例如 "/chat-messages"
+            payload: 请求体（会被序列化为 JSON）
+            stream: 是否以流式方式读取响应
+            timeout: 可选，覆盖默认的 (连接超时, 读取超时)
+
+        返回:
+            requests.Response 对象
+        """
+        return self.session.post(
+            self.url(path),
+            json=payload,
+            stream=stream,
+            timeout=timeout or self.timeout
+        )
+
+    def request(self, path, payload, stream=False, timeout=None, deadline=None, cancel_token=None):
+        """
+        发送 POST 请求并检查状态码
+
+        非 200 响应和网络异常会被转换为 dify_errors 中对应的异常；
+        配置了 resilience 时按其策略重试。流式请求只在收到响应头之前重试，
+        返回之后读取到的任何数据都不会再触发重试。
+
+        参数:
+            deadline: 可选，端到端截止时间（Deadline 或秒数，见 dify_deadline.py）；
+                      每次尝试的连接 / 读取超时都不超过剩余时间，超过时抛出 DeadlineExceededError。
+                      非流式请求在截止时间内读完整个响应体；流式请求的响应体由调用方负责监视
+            cancel_token: 可选，dify_cancel.CancellationToken；取消后不再发起新的尝试，
+                      正在读取的非流式响应体被立即中断，抛出 RequestCancelledError。
+                      等待响应头期间无法中断，收到响应头后才会中断
+
+        返回:
+            状态码为 200 的 requests.Response 对象
+        """
+        deadline = Deadline.of(deadline)
+
+        def attempt():
+            if cancel_token is not None and cancel_token.cancelled:
+                raise RequestCancelledError(f"请求已取消: {cancel_token.reason}")
+            request_timeout = timeout or self.timeout
+            if deadline is not None:
+                request_timeout = deadline.timeout(request_timeout)
+            try:
+                # 有截止时间时先只读响应头，响应体在看门狗监视下读取
+                response = self.post(path, payload, stream=stream or deadline is not None or cancel_token is not None,
+                                     timeout=request_timeout)
+            except requests.RequestException as e:
+                if deadline is not None and deadline.expired():
+                    raise DeadlineExceededError(f"已超过截止时间（{deadline.seconds:g}秒）: {e}") from e
+                raise error_from_exception(e) from e
+            if response.status_code != 200:
+                error = error_from_response(response)
+                response.close()
+                raise error
+            if (deadline is not None or cancel_token is not None) and not stream:
+                self._read_body(response, deadline, cancel_token)
+            return response
+
+        if self.resilience is None:
+            return attempt()
+        return self.resilience.call(attempt, deadline=deadline)
+
+    def _read_body(self, response, deadline, cancel_token=None):
+        """在截止时间内读完响应体，超时或取消时中断读取并释放连接"""
+        unregister = None
+        if cancel_token is not None:
+            unregister = cancel_token.register(lambda reason: abort_response(response))
+        try:
+            with get_watchdog().watch(lambda reason: abort_response(response), deadline=deadline) as watch:
+                try:
+                    response.content
+                except Exception as e:
+                    if watch.reason is not None:
+                        raise watch.error() from e
+                    if cancel_token is not None and cancel_token.cancelled:
+                        raise RequestCancelledError(f"请求已取消: {cancel_token.reason}") from e
+                    if isinstance(e, requests.RequestException):
+                        raise error_from_exception(e) from e
+                    raise
+        finally:
+            if unregister is not None:
+                unregister()
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# 按 (api_key, base_url) 共享的客户端，供脚本中的函数默认使用
+_shared_clients = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_client(api_key, base_url=DEFAULT_BASE_URL):
+    """
+    获取共享的客户端实例
+
+    同一个 API Key 和 base_url 只创建一个客户端，
+    多次调用（例如多轮对话的每一轮）复用同一个连接池。
+    """
+    key = (api_key, base_url.rstrip("/"))
+    with _shared_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = DifyClient(api_key, base_url)
+            _shared_clients[key] = client
+    return client
@@ -0,0 +1,205 @@
+"""
+端到端截止时间与流停顿检测
+Deadline 表示整个调用（包括重试、读取响应体、后续的子请求）必须完成的时间点，
+同一个 Deadline 对象在各层之间传递，每一层只使用剩余的时间。
+
+StreamWatchdog 在一个后台线程中检查所有正在读取的响应：
+- 超过截止时间，或距离上一次收到数据超过 stall_timeout 秒（ping 事件同样算作收到数据）时，
+  调用 on_timeout 中断读取（通常是关闭 socket），连接池名额随即释放，可以被后续请求复用
+- 读取方随后通过 watch.error() 得到 DeadlineExceededError / StreamStalledError
+
+用法:
+    deadline = Deadline(30)
+    send_chat_message_streaming(query, deadline=deadline, stall_timeout=20)
+    retrieve_from_knowledge_base(query, deadline=deadline)   # 使用剩余的时间
+"""
+
+import threading
+import time
+
+from dify_errors import DeadlineExceededError, StreamStalledError
+
+# 超时原因
+DEADLINE_EXCEEDED = "deadline_exceeded"
+STALLED = "stalled"
+
+# 流式响应两次收到数据之间的默认最长间隔（秒）
+DEFAULT_STALL_TIMEOUT = 60.0
+
+
+class Deadline:
+    """
+    截止时间
+
+    参数:
+        seconds: 从现在开始的剩余秒数
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def of(cls, value):
+        """把 None / 秒数 / Deadline 统一为 Deadline 或 None（Deadline 原样返回，不重新计时）"""
+        if value is None or isinstance(value, Deadline):
+            return value
+        return cls(value)
+
+    def remaining(self):
+        """剩余秒数（可能为负）"""
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        """已经超过截止时间时抛出 DeadlineExceededError"""
+        if self.expired():
+            raise DeadlineExceededError(f"已超过截止时间（{self.seconds:g}秒）")
+
+    def timeout(self, timeout):
+        """
+        把 (连接超时, 读取超时) 限制在剩余时间之内
+
+        参数:
+            timeout: requests 的 timeout 参数（数值或二元组）
+
+        返回:
+            (连接超时, 读取超时)；已经超过截止时间时抛出 DeadlineExceededError
+        """
+        self.check()
+        remaining = self.remaining()
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        return tuple(remaining if value is None else min(value, remaining) for value in timeout)
+
+    def __repr__(self):
+        return f"Deadline({self.seconds!r}, remaining={self.remaining():.3f})"
+
+
+class Watch:
+    """
+    一次被监视的读取
+
+    由 StreamWatchdog.watch() 创建；读取到数据时调用 touch()，读取结束后调用 close()。
+
+    属性:
+        reason: 触发超时的原因（DEADLINE_EXCEEDED / STALLED），没有超时时为 None
+    """
+
+    def __init__(self, watchdog, on_timeout, deadline, stall_timeout):
+        self.on_timeout = on_timeout
+        self.deadline = deadline
+        self.stall_timeout = stall_timeout
+        self.reason = None
+        self.last_seen = time.monotonic()
+        self._watchdog = watchdog
+
+    def touch(self):
+        """记录收到数据"""
+        self.last_seen = time.monotonic()
+
+    def wrap(self, chunks):
+        """包装字节块迭代器，每收到一个数据块调用一次 touch()"""
+        for chunk in chunks:
+            self.last_seen = time.monotonic()
+            yield chunk
+
+    def expired(self, now):
+        """检查是否超时，返回原因或 None"""
+        if self.deadline is not None and now >= self.deadline.expires_at:
+            return DEADLINE_EXCEEDED
+        if self.stall_timeout is not None and now - self.last_seen >= self.stall_timeout:
+            return STALLED
+        return None
+
+    def error(self):
+        """超时对应的异常，没有超时时返回 None"""
+        if self.reason == DEADLINE_EXCEEDED:
+            return DeadlineExceededError(f"已超过截止时间（{self.deadline.seconds:g}秒）")
+        if self.reason == STALLED:
+            return StreamStalledError(f"流式响应停顿超过 {self.stall_timeout:g} 秒没有收到数据", self.stall_timeout)
+        return None
+
+    def close(self):
+        """停止监视"""
+        self._watchdog._remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class StreamWatchdog:
+    """
+    流读取看门狗
+
+    所有监视共用一个后台线程（第一次 watch() 时启动），每 interval 秒检查一次，
+    因此超时的触发精度约为 interval。
+
+    参数:
+        interval: 检查间隔（秒）
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self._watches = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.triggered = {DEADLINE_EXCEEDED: 0, STALLED: 0}
+
+    def watch(self, on_timeout, deadline=None, stall_timeout=None):
+        """
+        开始监视一次读取
+
+        参数:
+            on_timeout: 超时时在看门狗线程中调用 on_timeout(reason)，用于中断阻塞中的读取
+            deadline: 可选，Deadline / 秒数
+            stall_timeout: 可选，两次 touch() 之间的最长间隔（秒）
+
+        返回:
+            Watch 对象
+        """
+        watch = Watch(self, on_timeout, Deadline.of(deadline), stall_timeout)
+        if watch.deadline is None and stall_timeout is None:
+            return watch
+        with self._lock:
+            self._watches.add(watch)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="dify-watchdog", daemon=True)
+                self._thread.start()
+        return watch
+
+    def _remove(self, watch):
+        with self._lock:
+            self._watches.discard(watch)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            expired = []
+            with self._lock:
+                for watch in self._watches:
+                    reason = watch.expired(now)
+                    if reason is not None:
+                        watch.reason = reason
+                        self.triggered[reason] += 1
+                        expired.append(watch)
+                self._watches.difference_update(expired)
+            for watch in expired:
+                try:
+                    watch.on_timeout(watch.reason)
+                except Exception:
+                    pass
+
+
+_watchdog = StreamWatchdog()
+
+
+def get_watchdog():
+    """进程内共享的看门狗"""
+    return _watchdog
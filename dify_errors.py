@@ -0,0 +1,212 @@
+"""
+Dify API 错误分类
+把 HTTP 状态码、错误事件和网络异常转换为带分类信息的异常
+"""
+
+import email.utils
+import json
+import time
+
+import requests
+
+
+class DifyError(Exception):
+    """
+    Dify API 错误的基类
+
+    属性:
+        retryable: 是否可以安全重试
+        breaker_failure: 是否说明上游不健康（计入熔断器失败次数）
+    """
+
+    retryable = False
+    breaker_failure = False
+
+
+class DifyAPIError(DifyError):
+    """
+    API 返回了非 200 的状态码
+
+    属性:
+        status: HTTP 状态码
+        code: Dify 错误码（例如 invalid_param、provider_quota_exceeded）
+        message: 错误信息
+        body: 原始响应内容
+        retry_after: Retry-After 响应头（秒），没有时为 None
+    """
+
+    def __init__(self, status, code=None, message=None, body=None, retry_after=None):
+        self.status = status
+        self.code = code
+        self.message = message
+        self.body = body
+        self.retry_after = retry_after
+        super().__init__(f"{status} {code or ''}: {message or body or ''}".strip())
+
+
+class ClientError(DifyAPIError):
+    """4xx 错误（429 除外），请求本身有问题，重试没有意义"""
+
+
+class RateLimitError(DifyAPIError):
+    """429 请求过多"""
+
+    retryable = True
+    breaker_failure = True
+
+
+class ServerError(DifyAPIError):
+    """5xx 服务器错误"""
+
+    retryable = True
+    breaker_failure = True
+
+
+class StreamError(DifyError):
+    """
+    流式响应中收到 error 事件
+
+    属性:
+        status: 事件中的状态码
+        code: 事件中的错误码
+        message: 错误信息
+    """
+
+    breaker_failure = True
+
+    def __init__(self, message, status=None, code=None):
+        self.status = status
+        self.code = code
+        self.message = message
+        super().__init__(f"{status or ''} {code or ''}: {message}".strip())
+
+
+class DifyConnectionError(DifyError):
+    """无法建立连接（请求尚未发出，可以安全重试）"""
+
+    retryable = True
+    breaker_failure = True
+
+
+class DifyTimeoutError(DifyError):
+    """
+    请求超时
+
+    连接超时时请求尚未发出，可以重试；读取超时时服务器可能已经在处理，
+    对话请求重试会重复生成，因此不重试。
+    """
+
+    breaker_failure = True
+
+    def __init__(self, message, retryable=False):
+        self.retryable = retryable
+        super().__init__(message)
+
+
+class DeadlineExceededError(DifyTimeoutError):
+    """
+    超过了调用方设置的端到端截止时间（见 dify_deadline.py）
+
+    截止时间是调用方的预算而不是上游健康状况，不重试，也不计入熔断器失败次数。
+    """
+
+    breaker_failure = False
+
+    def __init__(self, message):
+        super().__init__(message)
+
+
+class StreamStalledError(DifyTimeoutError):
+    """
+    流式响应停顿：超过 stall_timeout 秒没有收到任何数据（包括 ping）
+
+    属性:
+        stall_timeout: 停顿检测的阈值（秒）
+    """
+
+    def __init__(self, message, stall_timeout=None):
+        self.stall_timeout = stall_timeout
+        super().__init__(message)
+
+
+class CircuitOpenError(DifyError):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class RequestCancelledError(DifyError):
+    """请求被调用方取消（例如对冲请求中落败的一方），不重试，也不计入熔断器失败次数"""
+
+
+class BudgetExhaustedError(DifyError):
+    """
+    客户端限流：请求速率或 token 预算已用完，请求没有发出
+
+    属性:
+        wait: 预计还需要等待的秒数
+    """
+
+    def __init__(self, message, wait=None):
+        self.wait = wait
+        super().__init__(message)
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 响应头
+
+    支持秒数和 HTTP 日期两种格式，无法解析时返回 None。
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def error_from_response(response):
+    """
+    根据非 200 响应构造对应的 DifyAPIError 子类
+
+    参数:
+        response: requests.Response 对象
+    """
+    status = response.status_code
+    body = response.text
+    code = message = None
+    try:
+        data = json.loads(body)
+        if isinstance(data, dict):
+            code = data.get('code')
+            message = data.get('message')
+    except ValueError:
+        pass
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+    if status == 429:
+        error_class = RateLimitError
+    elif status >= 500:
+        error_class = ServerError
+    else:
+        error_class = ClientError
+    return error_class(status, code, message, body, retry_after)
+
+
+def error_from_exception(exc):
+    """
+    把 requests 的网络异常转换为 DifyError
+
+    参数:
+        exc: requests.RequestException
+    """
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return DifyTimeoutError(f"连接超时: {exc}", retryable=True)
+    if isinstance(exc, requests.exceptions.Timeout):
+        return DifyTimeoutError(f"读取超时: {exc}")
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        return DifyConnectionError(f"连接失败: {exc}")
+    return DifyError(str(exc))
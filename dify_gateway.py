@@ -0,0 +1,531 @@
+"""
+本地缓存网关（反向代理）
+多个应用进程改为请求本地网关，而不是直接请求 https://api.dify.ai/v1：
+- 到上游的 keep-alive 连接池由所有进程共用，启动时预先建立连接
+- POST /datasets/{id}/retrieve 的结果按 API Key + 知识库 + 规范化查询 + 检索配置缓存（LRU + TTL，可选 SQLite）
+- 相同的检索请求同时到达时只向上游发送一次，其余请求等待同一个结果
+- /chat-messages 的 SSE 流收到一块就转发一块，不做缓冲；客户端断开时立即关闭上游连接
+- 其它请求原样转发
+- GET /metrics 输出 Prometheus 文本格式的指标，GET /gateway/stats 输出 JSON
+
+用法:
+    python dify_gateway.py --upstream https://api.dify.ai/v1 --port 8081 --cache-ttl 600
+
+    # 让脚本指向网关
+    export DIFY_API_BASE_URL=http://127.0.0.1:8081/v1
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+import aiohttp
+from aiohttp import web
+
+from dify_cache import DEFAULT_MAX_ENTRIES, RetrievalCache
+from dify_client import DEFAULT_BASE_URL, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from dify_trace import DEFAULT_BUCKETS
+
+DEFAULT_POOL_SIZE = 100
+DEFAULT_CACHE_TTL = 300
+DEFAULT_KEEPALIVE = 60
+
+# 不转发的逐跳头部；上游响应已经被解压，长度和编码由网关重新设置
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+    "transfer-encoding", "upgrade", "host", "content-length", "content-encoding"
+}
+
+
+class GatewayConfig:
+    """
+    网关配置
+
+    参数:
+        upstream: 上游 API 基础 URL
+        pool_size: 到上游的最大连接数
+        warm_connections: 启动时预先建立的上游连接数
+        keepalive: 空闲上游连接的保持时间（秒）
+        connect_timeout: 上游连接超时（秒）
+        read_timeout: 上游读取超时（秒），流式响应为两次收到数据之间的最长间隔
+        cache_ttl: 检索结果缓存时间（秒），0 表示不缓存（仍然合并同时到达的相同请求）
+        cache_entries: 内存中最多缓存的检索结果数
+        cache_path: 可选，SQLite 持久化文件路径，网关重启后缓存仍然有效
+    """
+
+    def __init__(self, upstream=DEFAULT_BASE_URL, pool_size=DEFAULT_POOL_SIZE, warm_connections=4,
+                 keepalive=DEFAULT_KEEPALIVE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=DEFAULT_READ_TIMEOUT, cache_ttl=DEFAULT_CACHE_TTL,
+                 cache_entries=DEFAULT_MAX_ENTRIES, cache_path=None):
+        self.upstream = upstream.rstrip("/")
+        self.pool_size = pool_size
+        self.warm_connections = warm_connections
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.cache_ttl = cache_ttl
+        self.cache_entries = cache_entries
+        self.cache_path = cache_path
+
+
+def error_response(status, code, message):
+    """Dify 格式的错误响应"""
+    return web.json_response({"code": code, "message": message, "status": status}, status=status)
+
+
+class LatencyHistogram:
+    """Prometheus 直方图的累积计数（只保存各分桶的计数，不保存样本）"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def lines(self, metric, labels):
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            result.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+        result.append(f'{metric}_bucket{{{labels},le="+Inf"}} {self.count}')
+        result.append(f"{metric}_sum{{{labels}}} {self.sum}")
+        result.append(f"{metric}_count{{{labels}}} {self.count}")
+        return result
+
+
+class GatewayMetrics:
+    """
+    网关指标
+
+    所有更新都在事件循环线程中进行，不需要加锁。
+    """
+
+    def __init__(self):
+        self.requests = {}
+        self.upstream_requests = 0
+        self.upstream_errors = {}
+        self.coalesced = 0
+        self.active_streams = 0
+        self.stream_bytes = 0
+        self.streams = 0
+        self.client_disconnects = 0
+        self.warmed = 0
+        self.latency = {}
+        self.first_byte = LatencyHistogram()
+        self.started_at = time.time()
+
+    def count_request(self, route, status):
+        key = (route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+
+    def count_error(self, kind):
+        self.upstream_errors[kind] = self.upstream_errors.get(kind, 0) + 1
+
+    def observe_latency(self, route, value):
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = LatencyHistogram()
+        histogram.observe(value)
+
+    def to_dict(self, cache_stats):
+        return {
+            "uptime": time.time() - self.started_at,
+            "requests": {f"{route} {status}": count for (route, status), count in sorted(self.requests.items())},
+            "upstream_requests": self.upstream_requests,
+            "upstream_errors": dict(self.upstream_errors),
+            "coalesced": self.coalesced,
+            "cache": cache_stats,
+            "active_streams": self.active_streams,
+            "streams": self.streams,
+            "stream_bytes": self.stream_bytes,
+            "client_disconnects": self.client_disconnects,
+            "warmed_connections": self.warmed
+        }
+
+    def to_prometheus(self, cache_stats, prefix="dify_gateway"):
+        """Prometheus 文本格式"""
+        lines = [
+            f"# HELP {prefix}_requests_total 网关收到的请求数",
+            f"# TYPE {prefix}_requests_total counter"
+        ]
+        for (route, status), count in sorted(self.requests.items()):
+            lines.append(f'{prefix}_requests_total{{route="{route}",status="{status}"}} {count}')
+        lines += [
+            f"# HELP {prefix}_upstream_requests_total 发往上游的请求数（不含缓存命中和合并的请求）",
+            f"# TYPE {prefix}_upstream_requests_total counter",
+            f"{prefix}_upstream_requests_total {self.upstream_requests}",
+            f"# HELP {prefix}_upstream_errors_total 上游连接失败 / 超时次数",
+            f"# TYPE {prefix}_upstream_errors_total counter"
+        ]
+        for kind, count in sorted(self.upstream_errors.items()):
+            lines.append(f'{prefix}_upstream_errors_total{{kind="{kind}"}} {count}')
+        lines += [
+            f"# HELP {prefix}_cache_hits_total 检索缓存命中次数",
+            f"# TYPE {prefix}_cache_hits_total counter",
+            f"{prefix}_cache_hits_total {cache_stats['hits']}",
+            f"# HELP {prefix}_cache_misses_total 检索缓存未命中次数",
+            f"# TYPE {prefix}_cache_misses_total counter",
+            f"{prefix}_cache_misses_total {cache_stats['misses']}",
+            f"# HELP {prefix}_cache_entries 内存中缓存的检索结果数",
+            f"# TYPE {prefix}_cache_entries gauge",
+            f"{prefix}_cache_entries {cache_stats['entries']}",
+            f"# HELP {prefix}_coalesced_total 合并到同时进行中的相同检索的请求数",
+            f"# TYPE {prefix}_coalesced_total counter",
+            f"{prefix}_coalesced_total {self.coalesced}",
+            f"# HELP {prefix}_active_streams 正在转发的流式响应数",
+            f"# TYPE {prefix}_active_streams gauge",
+            f"{prefix}_active_streams {self.active_streams}",
+            f"# HELP {prefix}_stream_bytes_total 转发的流式响应字节数",
+            f"# TYPE {prefix}_stream_bytes_total counter",
+            f"{prefix}_stream_bytes_total {self.stream_bytes}",
+            f"# HELP {prefix}_client_disconnects_total 转发过程中客户端断开的次数",
+            f"# TYPE {prefix}_client_disconnects_total counter",
+            f"{prefix}_client_disconnects_total {self.client_disconnects}"
+        ]
+        metric = f"{prefix}_upstream_latency_seconds"
+        lines += [f"# HELP {metric} 上游响应时间（检索为读完响应体，其它请求为收到响应头）",
+                  f"# TYPE {metric} histogram"]
+        for route, histogram in sorted(self.latency.items()):
+            lines += histogram.lines(metric, f'route="{route}"')
+        metric = f"{prefix}_stream_first_byte_seconds"
+        lines += [f"# HELP {metric} 流式响应从收到请求到转发第一个数据块的时间",
+                  f"# TYPE {metric} histogram"]
+        lines += self.first_byte.lines(metric, 'route="chat_messages"')
+        return "\n".join(lines) + "\n"
+
+
+def _route_name(tail):
+    """按路径分类，用作指标标签"""
+    parts = tail.strip("/").split("/")
+    if len(parts) == 3 and parts[0] == "datasets" and parts[2] == "retrieve":
+        return "retrieve"
+    if parts[0] == "chat-messages":
+        return "chat_messages" if len(parts) == 1 else "chat_messages_stop"
+    return "other"
+
+
+def _forward_headers(headers):
+    return {name: value for name, value in headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+
+
+class DifyGateway:
+    """
+    网关的 aiohttp 应用
+
+    参数:
+        config: GatewayConfig 实例
+    """
+
+    def __init__(self, config=None):
+        self.config = config or GatewayConfig()
+        self.metrics = GatewayMetrics()
+        self.cache = RetrievalCache(max_entries=self.config.cache_entries, ttl=self.config.cache_ttl,
+                                    path=self.config.cache_path)
+        self.session = None
+        self._inflight = {}
+
+    def create_app(self, prefix="/v1"):
+        """创建 aiohttp 应用：prefix 下的所有路径转发到上游"""
+        app = web.Application()
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        app.router.add_get("/metrics", self.handle_metrics)
+        app.router.add_get("/gateway/stats", self.handle_stats)
+        app.router.add_route("*", f"{prefix.rstrip('/')}/{{tail:.*}}", self.handle_proxy)
+        return app
+
+    async def _on_startup(self, app):
+        config = self.config
+        connector = aiohttp.TCPConnector(limit=config.pool_size, keepalive_timeout=config.keepalive)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(sock_connect=config.connect_timeout, sock_read=config.read_timeout),
+            auto_decompress=True
+        )
+        await self.warm_up(config.warm_connections)
+
+    async def _on_cleanup(self, app):
+        if self.session is not None:
+            await self.session.close()
+        self.cache.close()
+
+    async def warm_up(self, connections):
+        """
+        预先建立上游连接（同时发送 connections 个轻量 GET 请求，读完响应后连接留在池中）
+
+        返回:
+            成功建立的连接数
+        """
+        async def touch():
+            try:
+                async with self.session.get(self.config.upstream + "/") as response:
+                    await response.read()
+                return True
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return False
+
+        if connections <= 0:
+            return 0
+        results = await asyncio.gather(*(touch() for _ in range(connections)))
+        self.metrics.warmed += sum(results)
+        return sum(results)
+
+    async def handle_metrics(self, request):
+        """GET /metrics"""
+        return web.Response(text=self.metrics.to_prometheus(self.cache.stats()),
+                            content_type="text/plain", charset="utf-8")
+
+    async def handle_stats(self, request):
+        """GET /gateway/stats"""
+        return web.json_response(self.metrics.to_dict(self.cache.stats()))
+
+    async def handle_proxy(self, request):
+        """转发 prefix 下的所有请求"""
+        tail = request.match_info["tail"]
+        route = _route_name(tail)
+        url = f"{self.config.upstream}/{tail}"
+        if request.query_string:
+            url += "?" + request.query_string
+        body = await request.read()
+
+        if route == "retrieve" and request.method == "POST":
+            response = await self._handle_retrieve(request, url, body)
+        else:
+            response = await self._relay(request, url, body, route)
+        self.metrics.count_request(route, response.status)
+        return response
+
+    def _retrieve_key(self, request, tail_url, body):
+        """检索缓存键：API Key 的摘要 + 知识库 + 规范化查询 + 检索配置；请求体无法解析时返回 None"""
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(payload, dict) or not isinstance(payload.get("query"), str):
+            return None
+        auth = hashlib.sha256(request.headers.get("Authorization", "").encode("utf-8")).hexdigest()[:16]
+        return self.cache.make_key(f"{auth}:{tail_url}", payload["query"], payload.get("retrieval_model"))
+
+    async def _handle_retrieve(self, request, url, body):
+        key = self._retrieve_key(request, url, body)
+        no_cache = "no-cache" in request.headers.get("Cache-Control", "")
+        if key is not None and self.config.cache_ttl > 0 and not no_cache:
+            cached = await self._cache_call(self.cache.get, key)
+            if cached is not None:
+                return web.Response(text=cached, content_type="application/json",
+                                    headers={"X-Gateway-Cache": "hit"})
+
+        if key is None:
+            return await self._relay(request, url, body, "retrieve")
+
+        # 合并同时进行中的相同请求：第一个请求向上游发送，其余请求等待同一个结果。
+        # 上游请求在独立的任务中执行，发起它的客户端断开时不会影响其余等待者
+        task = self._inflight.get(key)
+        if task is not None:
+            self.metrics.coalesced += 1
+            cache_status = "coalesced"
+        else:
+            task = asyncio.ensure_future(self._fetch_and_cache(request, url, body, key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            cache_status = "miss"
+        try:
+            status, headers, content = await asyncio.shield(task)
+        except asyncio.TimeoutError:
+            return error_response(504, "gateway_timeout", "上游响应超时")
+        except aiohttp.ClientError as e:
+            return error_response(502, "bad_gateway", f"上游请求失败: {e}")
+        return web.Response(status=status, body=content, headers=dict(headers, **{"X-Gateway-Cache": cache_status}))
+
+    async def _fetch_and_cache(self, request, url, body, key):
+        """
+        向上游发送检索请求并写入缓存
+
+        写缓存在上游任务中完成，而不是在发起请求的客户端的处理函数中，
+        该客户端中途断开时其余等待者拿到的结果仍然会被缓存。
+        """
+        status, headers, content = await self._fetch(request, url, body)
+        if status == 200 and self.config.cache_ttl > 0:
+            await self._cache_call(self.cache.set, key, content.decode("utf-8"))
+        return status, headers, content
+
+    async def _cache_call(self, func, *args):
+        """调用缓存方法；有磁盘存储时放到线程池中执行，SQLite 读写不阻塞事件循环"""
+        if self.cache.path is None:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _fetch(self, request, url, body):
+        """向上游发送请求并读完响应体，返回 (状态码, 响应头, 响应体)"""
+        self.metrics.upstream_requests += 1
+        start_time = time.perf_counter()
+        try:
+            async with self.session.request(request.method, url, data=body,
+                                            headers=_forward_headers(request.headers)) as upstream:
+                content = await upstream.read()
+                self.metrics.observe_latency("retrieve", time.perf_counter() - start_time)
+                return upstream.status, _forward_headers(upstream.headers), content
+        except asyncio.TimeoutError:
+            self.metrics.count_error("timeout")
+            raise
+        except aiohttp.ClientError:
+            self.metrics.count_error("connection")
+            raise
+
+    async def _relay(self, request, url, body, route):
+        """转发请求，响应体收到一块就写回一块（SSE 不缓冲）"""
+        self.metrics.upstream_requests += 1
+        start_time = time.perf_counter()
+        try:
+            async with self.session.request(request.method, url, data=body,
+                                            headers=_forward_headers(request.headers)) as upstream:
+                self.metrics.observe_latency(route, time.perf_counter() - start_time)
+                response = web.StreamResponse(status=upstream.status, headers=_forward_headers(upstream.headers))
+                streaming = upstream.content_type == "text/event-stream"
+                if streaming:
+                    # 提示中间的 nginx 等代理也不要缓冲
+                    response.headers["Cache-Control"] = "no-cache"
+                    response.headers["X-Accel-Buffering"] = "no"
+                    self.metrics.active_streams += 1
+                    self.metrics.streams += 1
+                try:
+                    await response.prepare(request)
+                    chunks = upstream.content.iter_any().__aiter__()
+                    first = True
+                    while True:
+                        try:
+                            chunk = await chunks.__anext__()
+                        except StopAsyncIteration:
+                            break
+                        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                            # 响应头已经发出，无法再改状态码；流式响应补发一个 error 事件后结束
+                            self.metrics.count_error("timeout" if isinstance(e, asyncio.TimeoutError) else "connection")
+                            if streaming:
+                                error = {"event": "error", "status": 504, "code": "gateway_timeout",
+                                         "message": f"上游流中断: {type(e).__name__}"}
+                                await response.write(f"data: {json.dumps(error, ensure_ascii=False)}\n\n".encode("utf-8"))
+                            break
+                        await response.write(chunk)
+                        if streaming:
+                            self.metrics.stream_bytes += len(chunk)
+                            if first:
+                                self.metrics.first_byte.observe(time.perf_counter() - start_time)
+                                first = False
+                    await response.write_eof()
+                except ConnectionResetError:
+                    # 客户端断开：退出 async with 时上游连接随之关闭，不再继续接收
+                    self.metrics.client_disconnects += 1
+                except asyncio.CancelledError:
+                    self.metrics.client_disconnects += 1
+                    raise
+                finally:
+                    if streaming:
+                        self.metrics.active_streams -= 1
+                return response
+        except asyncio.TimeoutError:
+            self.metrics.count_error("timeout")
+            return error_response(504, "gateway_timeout", "上游响应超时")
+        except aiohttp.ClientError as e:
+            self.metrics.count_error("connection")
+            return error_response(502, "bad_gateway", f"上游请求失败: {e}")
+
+
+class GatewayThread:
+    """
+    在后台线程中运行网关，便于在脚本和基准测试中直接启动
+
+    用法:
+        with GatewayThread(GatewayConfig(upstream=mock.base_url)) as gateway:
+            client = DifyClient("test-key", gateway.base_url)
+
+    参数:
+        config: GatewayConfig 实例
+        host: 监听地址
+        port: 监听端口，0 表示自动选择空闲端口
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.gateway = DifyGateway(config)
+        self.host = host
+        self.port = port
+        self.base_url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def start(self):
+        """启动网关，返回自身"""
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    async def _start(self):
+        self._runner = web.AppRunner(self.gateway.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        self.base_url = f"http://{self.host}:{self.port}/v1"
+
+    def stop(self):
+        """停止网关"""
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Dify API 本地缓存网关")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--upstream", default=DEFAULT_BASE_URL, help="上游 API 基础 URL")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE, help="到上游的最大连接数")
+    parser.add_argument("--warm-connections", type=int, default=4, help="启动时预先建立的上游连接数")
+    parser.add_argument("--keepalive", type=float, default=DEFAULT_KEEPALIVE, help="空闲上游连接的保持时间（秒）")
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT,
+                        help="上游读取超时（秒），流式响应为两次收到数据之间的最长间隔")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL, help="检索结果缓存时间（秒），0 表示不缓存")
+    parser.add_argument("--cache-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="内存中最多缓存的检索结果数")
+    parser.add_argument("--cache-path", default=None, help="SQLite 持久化文件路径")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = GatewayConfig(
+        upstream=args.upstream,
+        pool_size=args.pool_size,
+        warm_connections=args.warm_connections,
+        keepalive=args.keepalive,
+        read_timeout=args.read_timeout,
+        cache_ttl=args.cache_ttl,
+        cache_entries=args.cache_entries,
+        cache_path=args.cache_path
+    )
+    print("=" * 60)
+    print("Dify API 本地缓存网关")
+    print("=" * 60)
+    print(f"API基础URL: http://{args.host}:{args.port}/v1")
+    print(f"上游: {config.upstream}")
+    print(f"指标: http://{args.host}:{args.port}/metrics")
+    print("=" * 60)
+    web.run_app(DifyGateway(config).create_app(), host=args.host, port=args.port, print=None)
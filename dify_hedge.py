@@ -0,0 +1,149 @@
+"""
+对冲请求（hedged requests）
+第一个请求超过近期延迟的某个百分位仍未返回时，再发送一个相同的请求，
+先返回的结果生效，另一个被取消（通过 CancellationToken 中断）或丢弃。只适用于幂等请求（例如知识库检索）。
+
+用法:
+    from dify_hedge import Hedger
+
+    hedger = Hedger(percentile=95, max_hedge_rate=0.1)
+    retrieve_from_knowledge_base(query, hedger=hedger)
+    print(hedger.stats())
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from dify_cancel import CancellationToken
+from dify_retry import RetryBudget
+from dify_stats import percentile
+
+
+class Hedger:
+    """
+    对冲请求执行器
+
+    参数:
+        percentile: 触发对冲的延迟百分位（0-100）
+        min_samples: 样本数少于该值时使用 initial_delay
+        window: 保留的最近延迟样本数
+        initial_delay: 样本不足时的对冲等待时间（秒）
+        min_delay: 对冲等待时间下限（秒）
+        max_hedge_rate: 对冲请求占请求总数的比例上限，用于限制额外负载
+        max_workers: 执行请求的线程数
+    """
+
+    def __init__(self, percentile=95, min_samples=20, window=1000, initial_delay=0.5,
+                 min_delay=0.01, max_hedge_rate=0.1, max_workers=16):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.budget = RetryBudget(ratio=max_hedge_rate, min_retries_per_sec=0)
+        self._latencies = collections.deque(maxlen=window)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def hedge_delay(self):
+        """当前的对冲等待时间（秒）"""
+        with self._lock:
+            samples = list(self._latencies)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        return max(self.min_delay, percentile(samples, self.percentile))
+
+    def _run(self, func, token, started=None):
+        start_time = time.perf_counter()
+        if started is not None:
+            started.set()
+        try:
+            result = func(token)
+        except Exception:
+            if token.cancelled:
+                # 落败被中断的请求至少用了这么久，仍然计入样本，否则延迟分布只剩下较快的请求
+                self._record_latency(start_time)
+            raise
+        self._record_latency(start_time)
+        return result
+
+    def _record_latency(self, start_time):
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start_time)
+
+    def call(self, func, on_discard=None):
+        """
+        执行 func(token)，必要时发送对冲请求
+
+        参数:
+            func: 请求函数，失败时抛出异常；token 为该次请求的 CancellationToken，
+                  请求落败时被取消，func 应据此中断正在进行的读取（例如 DifyClient.request 的 cancel_token）
+            on_discard: 可选，落败请求仍然返回了结果时调用（例如关闭响应释放连接）
+
+        返回:
+            先成功返回的结果；两个请求都失败时抛出第一个请求的异常
+        """
+        self._count("requests")
+        self.budget.record_request()
+
+        # 对冲等待时间从第一个请求开始执行时算起，不包括在线程池中排队的时间
+        started = threading.Event()
+        primary_token = CancellationToken()
+        primary = self._executor.submit(self._run, func, primary_token, started)
+        started.wait()
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if done:
+            return primary.result()
+
+        if not self.budget.try_acquire():
+            self._count("budget_denied")
+            return primary.result()
+
+        self._count("hedged")
+        hedge_token = CancellationToken()
+        hedge = self._executor.submit(self._run, func, hedge_token)
+        tokens = {primary: primary_token, hedge: hedge_token}
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    if first_error is None or future is primary:
+                        first_error = future.exception()
+                    continue
+                if future is hedge:
+                    self._count("hedge_wins")
+                for loser in pending:
+                    self._discard(loser, tokens[loser], on_discard)
+                return future.result()
+        raise first_error
+
+    def _discard(self, future, token, on_discard):
+        """取消落败的请求：还没开始的直接取消，已经在执行的通过令牌中断，仍然返回了结果的交给 on_discard 处理"""
+        if future.cancel():
+            return
+        token.cancel()
+
+        def callback(f):
+            if on_discard is not None and not f.cancelled() and f.exception() is None:
+                on_discard(f.result())
+
+        future.add_done_callback(callback)
+
+    def stats(self):
+        """对冲统计：请求数、对冲次数、对冲率、对冲胜出次数、因预算不足未对冲的次数"""
+        with self._lock:
+            counts = dict(self._counts)
+        counts["hedge_rate"] = counts["hedged"] / counts["requests"] if counts["requests"] else 0.0
+        counts["hedge_delay"] = self.hedge_delay()
+        return counts
+
+    def close(self):
+        self._executor.shutdown(wait=False)
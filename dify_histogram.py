@@ -0,0 +1,239 @@
+"""
+对数分桶直方图，可以放在共享内存中跨进程合并
+多进程压测时每个工作进程把延迟直接记入共享内存中属于自己的一块直方图，
+父进程随时把所有区域相加得到实时的百分位数，单个采样不需要在进程之间传递或 pickle。
+
+分桶方式与 HDR Histogram 类似：每个 2 的幂区间再均分为 SUB_BUCKETS 个桶，
+相对误差不超过 1 / SUB_BUCKETS（约 3%），范围约为 1 微秒到 100 万。
+
+用法:
+    histograms = SharedHistograms(["latency"], workers=4, counters=["succeeded"])
+    # 工作进程中
+    shared = SharedHistograms.attach(name, ["latency"], workers=4, counters=["succeeded"])
+    writer = shared.writer(worker_index)
+    writer.record("latency", 0.123)
+    writer.add("succeeded")
+    # 父进程中
+    print(histograms.merged("latency").summary())
+"""
+
+import math
+import threading
+from array import array
+from multiprocessing import shared_memory
+
+SUB_BUCKETS = 32
+MIN_EXPONENT = -20
+MAX_EXPONENT = 20
+# 第一个桶记录小于 2^MIN_EXPONENT 的值，最后一个桶记录不小于 2^MAX_EXPONENT 的值
+BUCKETS = (MAX_EXPONENT - MIN_EXPONENT) * SUB_BUCKETS + 2
+# 每个直方图开头的汇总字段：count, sum, min, max（值乘以 SCALE 后取整）
+HEADER = 4
+SCALE = 1e6
+SLOTS = HEADER + BUCKETS
+
+
+def bucket_index(value):
+    """值所在的桶"""
+    if value < 2.0 ** MIN_EXPONENT:
+        return 0
+    mantissa, exponent = math.frexp(value)
+    octave = exponent - 1 - MIN_EXPONENT
+    if octave >= MAX_EXPONENT - MIN_EXPONENT:
+        return BUCKETS - 1
+    return 1 + octave * SUB_BUCKETS + int((mantissa * 2 - 1) * SUB_BUCKETS)
+
+
+def bucket_value(index):
+    """桶的代表值（桶的中点）"""
+    if index <= 0:
+        return 0.0
+    if index >= BUCKETS - 1:
+        return 2.0 ** MAX_EXPONENT
+    octave, sub = divmod(index - 1, SUB_BUCKETS)
+    return 2.0 ** (octave + MIN_EXPONENT) * (1 + (sub + 0.5) / SUB_BUCKETS)
+
+
+class Histogram:
+    """
+    对数分桶直方图
+
+    参数:
+        counters: 可选，长度为 SLOTS 的 int64 序列（例如共享内存上的 memoryview），默认新建
+    """
+
+    def __init__(self, counters=None):
+        self.counters = counters if counters is not None else array("q", bytes(8 * SLOTS))
+
+    @property
+    def count(self):
+        return self.counters[0]
+
+    def record(self, value):
+        """记录一个值（不加锁，多线程写入时由调用方加锁）"""
+        counters = self.counters
+        scaled = int(value * SCALE)
+        if counters[0] == 0 or scaled < counters[2]:
+            counters[2] = scaled
+        if scaled > counters[3]:
+            counters[3] = scaled
+        counters[0] += 1
+        counters[1] += scaled
+        counters[HEADER + bucket_index(value)] += 1
+
+    def merge(self, other):
+        """把另一个直方图加到本直方图上"""
+        source = other.counters
+        if not source[0]:
+            return self
+        target = self.counters
+        if target[0] == 0 or source[2] < target[2]:
+            target[2] = source[2]
+        target[3] = max(target[3], source[3])
+        target[0] += source[0]
+        target[1] += source[1]
+        for index in range(HEADER, SLOTS):
+            if source[index]:
+                target[index] += source[index]
+        return self
+
+    def percentile(self, p):
+        """百分位数（0-100），结果限制在记录到的最小值和最大值之间"""
+        counters = self.counters
+        count = counters[0]
+        if not count:
+            return None
+        rank = p / 100 * count
+        seen = 0
+        for index in range(BUCKETS):
+            seen += counters[HEADER + index]
+            if seen >= rank and seen:
+                value = bucket_value(index)
+                break
+        else:
+            value = counters[3] / SCALE
+        return min(max(value, counters[2] / SCALE), counters[3] / SCALE)
+
+    def summary(self):
+        """与 dify_stats.summarize() 格式相同的汇总"""
+        counters = self.counters
+        count = counters[0]
+        if not count:
+            return {"count": 0, "mean": None, "min": None, "p50": None, "p90": None, "p99": None, "max": None}
+        return {
+            "count": count,
+            "mean": counters[1] / SCALE / count,
+            "min": counters[2] / SCALE,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": counters[3] / SCALE
+        }
+
+
+class SharedHistograms:
+    """
+    共享内存中的一组直方图和计数器
+
+    每个工作进程占用一块独立的区域，只写自己的区域，因此进程之间不需要加锁；
+    父进程读取时把所有区域相加。
+
+    参数:
+        metrics: 直方图名称列表
+        workers: 工作进程数
+        counters: 每个工作进程的计数器名称列表（例如 succeeded / errors / tokens）
+    """
+
+    def __init__(self, metrics, workers, counters=(), name=None):
+        self.metrics = list(metrics)
+        self.workers = workers
+        self.counter_names = list(counters)
+        self.region_slots = len(self.metrics) * SLOTS + len(self.counter_names)
+        size = max(8, workers * self.region_slots * 8)
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self.name = self._shm.name
+        self._view = self._shm.buf.cast("q")
+        self._views = []
+
+    @classmethod
+    def attach(cls, name, metrics, workers, counters=()):
+        """在工作进程中连接已有的共享内存"""
+        # 以 spawn 方式启动的工作进程与父进程共用 resource_tracker，共享内存由父进程在 close() 时删除
+        return cls(metrics, workers, counters, name=name)
+
+    def _slice(self, start, length):
+        view = self._view[start:start + length]
+        self._views.append(view)
+        return view
+
+    def _offset(self, worker, metric):
+        return worker * self.region_slots + self.metrics.index(metric) * SLOTS
+
+    def histogram(self, worker, metric):
+        """某个工作进程的某个直方图（直接读写共享内存）"""
+        return Histogram(self._slice(self._offset(worker, metric), SLOTS))
+
+    def writer(self, worker):
+        """某个工作进程的写入器"""
+        return HistogramWriter(self, worker)
+
+    def merged(self, metric):
+        """所有工作进程的某个直方图之和（复制到本地）"""
+        result = Histogram()
+        for worker in range(self.workers):
+            start = self._offset(worker, metric)
+            view = self._view[start:start + SLOTS]
+            result.merge(Histogram(view))
+            view.release()
+        return result
+
+    def counter(self, name):
+        """所有工作进程的某个计数器之和"""
+        offset = len(self.metrics) * SLOTS + self.counter_names.index(name)
+        return sum(self._view[worker * self.region_slots + offset] for worker in range(self.workers))
+
+    def close(self):
+        """断开共享内存；创建者同时删除共享内存"""
+        for view in self._views:
+            view.release()
+        self._views = []
+        self._view.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class HistogramWriter:
+    """
+    一个工作进程的写入器（进程内线程安全）
+
+    参数:
+        shared: SharedHistograms 实例
+        worker: 工作进程编号
+    """
+
+    def __init__(self, shared, worker):
+        self._histograms = {metric: shared.histogram(worker, metric) for metric in shared.metrics}
+        offset = worker * shared.region_slots + len(shared.metrics) * SLOTS
+        self._counters = shared._slice(offset, len(shared.counter_names))
+        self._counter_index = {name: index for index, name in enumerate(shared.counter_names)}
+        self._lock = threading.Lock()
+
+    def record(self, metric, value):
+        with self._lock:
+            self._histograms[metric].record(value)
+
+    def record_many(self, metric, values):
+        histogram = self._histograms[metric]
+        with self._lock:
+            for value in values:
+                histogram.record(value)
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self._counters[self._counter_index[name]] += amount
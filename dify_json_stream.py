@@ -0,0 +1,205 @@
+"""
+检索响应的增量式 JSON 解码
+在响应体还没有接收完时，就逐条产出 records 数组中的记录
+
+检索响应的结构为 {"query": {...}, "records": [{...}, {...}, ...]}。
+解码器只扫描结构字符（括号、引号、逗号、冒号）来确定每条记录的边界，
+字符串内容用 bytes.find 整段跳过；每条记录完整到达后立即解析为 Record 对象，
+已解析的字节随即丢弃，因此内存中只保留当前未完成的一条记录。
+
+用法:
+    decoder = RetrieveStreamDecoder()
+    for chunk in response.iter_content(chunk_size=65536):
+        for record in decoder.feed(chunk):
+            ...
+    decoder.close()
+    print(decoder.query)
+"""
+
+import heapq
+import json
+import re
+
+from dify_models import make_object_hook
+
+STRUCTURAL = re.compile(rb'[{}\[\]",:]')
+BACKSLASH = 0x5C
+
+
+class RetrieveStreamDecoder:
+    """
+    检索响应的增量式解码器
+
+    参数:
+        records_key: 记录数组的字段名
+        as_records: 为 True 时产出 Record 对象，否则产出 dict
+    """
+
+    def __init__(self, records_key="records", as_records=True):
+        self.records_key = records_key
+        self.extra = {}
+        self.done = False
+        self._object_hook = make_object_hook() if as_records else None
+
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._string_start = None
+        self._key = None
+        self._expect_key = False
+        self._value_start = None
+        self._in_records = False
+        self._record_start = None
+
+    @property
+    def query(self):
+        """查询内容（响应中的 query.content）"""
+        return (self.extra.get("query") or {}).get("content", "")
+
+    def feed(self, chunk):
+        """
+        输入一个数据块
+
+        返回:
+            本次数据块中已经完整到达的记录列表
+        """
+        buffer = self._buffer
+        buffer += chunk
+        records = []
+        pos = self._pos
+
+        while True:
+            if self._in_string:
+                end = buffer.find(b'"', pos)
+                if end < 0:
+                    pos = len(buffer)
+                    break
+                # 前面有奇数个反斜杠时引号是被转义的
+                backslashes = 0
+                index = end - 1
+                while buffer[index] == BACKSLASH:
+                    backslashes += 1
+                    index -= 1
+                pos = end + 1
+                if backslashes % 2:
+                    continue
+                self._in_string = False
+                if self._depth == 1 and self._expect_key:
+                    self._key = json.loads(bytes(buffer[self._string_start:pos]))
+                continue
+
+            match = STRUCTURAL.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                break
+            index = match.start()
+            char = buffer[index]
+            pos = index + 1
+
+            if char == 0x22:  # "
+                self._in_string = True
+                self._string_start = index
+            elif char == 0x7B or char == 0x5B:  # { [
+                self._depth += 1
+                if self._depth == 1:
+                    if char != 0x7B:
+                        raise ValueError("检索响应不是 JSON 对象")
+                    self._expect_key = True
+                elif self._depth == 2 and self._key == self.records_key and char == 0x5B:
+                    self._in_records = True
+                    self._value_start = None
+                elif self._depth == 3 and self._in_records:
+                    self._record_start = index
+            elif char == 0x7D or char == 0x5D:  # } ]
+                self._depth -= 1
+                if self._depth == 2 and self._in_records and self._record_start is not None:
+                    records.append(self._decode_record(bytes(buffer[self._record_start:pos])))
+                    self._record_start = None
+                elif self._depth == 1 and self._in_records:
+                    self._in_records = False
+                elif self._depth == 0:
+                    self._finish_value(buffer, index)
+                    self.done = True
+            elif self._depth == 1:
+                if char == 0x3A:  # :
+                    self._value_start = pos
+                    self._expect_key = False
+                elif char == 0x2C:  # ,
+                    self._finish_value(buffer, index)
+                    self._expect_key = True
+
+        self._pos = pos
+        self._compact()
+        return records
+
+    def _decode_record(self, raw):
+        if self._object_hook is None:
+            return json.loads(raw)
+        return json.loads(raw, object_hook=self._object_hook)
+
+    def _finish_value(self, buffer, end):
+        """顶层除记录数组之外的字段整体解析后保存到 extra"""
+        if self._value_start is not None:
+            self.extra[self._key] = json.loads(bytes(buffer[self._value_start:end]))
+            self._value_start = None
+
+    def _compact(self):
+        """丢弃已经处理完的字节"""
+        keep = self._pos
+        for start in (self._record_start, self._value_start,
+                      self._string_start if self._in_string else None):
+            if start is not None and start < keep:
+                keep = start
+        if keep == 0:
+            return
+        del self._buffer[:keep]
+        self._pos -= keep
+        if self._record_start is not None:
+            self._record_start -= keep
+        if self._value_start is not None:
+            self._value_start -= keep
+        if self._string_start is not None:
+            self._string_start -= keep
+
+    def close(self):
+        """输入结束，响应不完整时抛出 ValueError"""
+        if not self.done:
+            raise ValueError("检索响应不完整")
+
+
+def iter_retrieve_records(chunks, as_records=True, decoder=None):
+    """
+    从字节块迭代器中逐条产出检索记录
+
+    参数:
+        chunks: 字节块迭代器，例如 response.iter_content(chunk_size=65536)
+        as_records: 为 True 时产出 Record 对象，否则产出 dict
+        decoder: 可选，RetrieveStreamDecoder 实例（用于在结束后读取 query 等字段）
+    """
+    decoder = decoder or RetrieveStreamDecoder(as_records=as_records)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    decoder.close()
+
+
+def top_records(records, n):
+    """
+    只保留分数最高的 n 条记录（内存中最多同时保存 n 条）
+
+    参数:
+        records: Record 对象或 dict 的迭代器
+        n: 保留的记录数
+
+    返回:
+        按分数从高到低排序的列表
+    """
+    heap = []
+    for sequence, record in enumerate(records):
+        score = record.score if hasattr(record, "score") else record.get("score")
+        item = (score or 0.0, -sequence, record)
+        if len(heap) < n:
+            heapq.heappush(heap, item)
+        elif item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+    return [item[2] for item in sorted(heap, key=lambda item: item[:2], reverse=True)]
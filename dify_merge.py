@@ -0,0 +1,96 @@
+"""
+多知识库检索结果合并
+按分数保留全局 top-k，合并时按分段ID / 内容摘要去重
+"""
+
+import hashlib
+import heapq
+import re
+
+
+def content_digest(content):
+    """分段内容的摘要（忽略空白差异），用于识别不同知识库中内容相同的分段"""
+    normalized = re.sub(r"\s+", " ", content or "").strip()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class TopKMerger:
+    """
+    流式 top-k 合并器
+
+    记录可以分批、按任意顺序加入（例如每个知识库返回时加入一批），
+    内存中最多保留 k 条不重复的记录。分段ID 或内容摘要相同的记录视为重复，
+    只保留分数最高的一条。
+
+    参数:
+        k: 保留的记录数，None 表示不限制
+
+    用法:
+        merger = TopKMerger(10)
+        merger.add_many(result["records"], dataset_id=dataset_id)
+        records = merger.results()
+    """
+
+    def __init__(self, k=None):
+        self.k = k
+        self.duplicates = 0
+        self._heap = []
+        self._live = {}
+        self._id_keys = {}
+        self._digest_keys = {}
+        self._sequence = 0
+
+    def _key(self, segment):
+        """去重键：先按分段ID 匹配，再按内容摘要匹配"""
+        segment_id = segment.get("id")
+        digest = content_digest(segment.get("content"))
+        key = self._id_keys.get(segment_id) or self._digest_keys.get(digest) or segment_id or digest
+        if segment_id:
+            self._id_keys.setdefault(segment_id, key)
+        self._digest_keys.setdefault(digest, key)
+        return key
+
+    def add(self, record, dataset_id=None):
+        """
+        加入一条记录
+
+        参数:
+            record: 检索结果中的一条记录（dict）
+            dataset_id: 可选，记录所属的知识库ID，会写入返回记录的 "dataset_id" 字段
+        """
+        score = record.get("score") or 0.0
+        key = self._key(record.get("segment") or {})
+        current = self._live.get(key)
+        if current is not None:
+            self.duplicates += 1
+            if current[0] >= score:
+                return
+        if dataset_id is not None:
+            record = dict(record, dataset_id=dataset_id)
+
+        # 分数相同时先加入的记录优先
+        self._sequence += 1
+        item = (score, -self._sequence, key, record)
+        self._live[key] = item
+        heapq.heappush(self._heap, item)
+
+        if self.k is not None:
+            while len(self._live) > self.k:
+                evicted = heapq.heappop(self._heap)
+                if self._live.get(evicted[2]) is evicted:
+                    del self._live[evicted[2]]
+        if len(self._heap) > 2 * len(self._live) + 16:
+            # 被更高分的重复记录替换掉的条目积累过多时重建堆
+            self._heap = list(self._live.values())
+            heapq.heapify(self._heap)
+
+    def add_many(self, records, dataset_id=None):
+        for record in records:
+            self.add(record, dataset_id)
+
+    def results(self):
+        """按分数从高到低返回保留的记录"""
+        return [item[3] for item in sorted(self._live.values(), reverse=True)]
+
+    def __len__(self):
+        return len(self._live)
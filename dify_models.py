@@ -0,0 +1,214 @@
+"""
+检索结果数据模型
+用 __slots__ 对象代替嵌套的 dict，减少大批量检索结果的内存占用。
+
+- 直接从响应字节解析，解析过程中每个 dict 一构建完就被转换为对象并释放
+- 同一次解析中相同的文档只保留一个 Document 实例，重复的短字符串（状态、数据源类型等）会被驻留
+- content 保留解析得到的原始值（缺失时为 None），第一次访问时才转换为字符串
+- 关键词解析时合并为一个紧凑字符串，第一次访问 keywords 时才拆分为列表，之后缓存在对象中
+
+用法:
+    from dify_models import parse_retrieve_response
+
+    result = parse_retrieve_response(response.content)
+    for record in result.records:
+        print(record.score, record.segment.document.name, record.segment.content[:50])
+"""
+
+import json
+import sys
+
+# 关键词之间的分隔符（ASCII 单元分隔符，不会出现在正常文本中）
+KEYWORD_SEPARATOR = "\x1f"
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Document:
+    """检索记录所属的文档"""
+
+    __slots__ = ("id", "name", "data_source_type", "metadata")
+
+    def __init__(self, id=None, name=None, data_source_type=None, metadata=None):
+        self.id = id
+        self.name = name
+        self.data_source_type = data_source_type
+        self.metadata = metadata
+
+    @classmethod
+    def from_dict(cls, data):
+        metadata = {key: value for key, value in data.items()
+                    if key not in ("id", "name", "data_source_type")}
+        return cls(data.get("id"), data.get("name"), _intern(data.get("data_source_type")), metadata or None)
+
+    def to_dict(self):
+        data = {"id": self.id, "data_source_type": self.data_source_type, "name": self.name}
+        if self.metadata:
+            data.update(self.metadata)
+        return data
+
+    def __repr__(self):
+        return f"Document(id={self.id!r}, name={self.name!r})"
+
+
+class Segment:
+    """文档中的一个分段"""
+
+    __slots__ = ("id", "document_id", "position", "word_count", "tokens", "hit_count",
+                 "enabled", "status", "answer", "document", "_content", "_keywords")
+
+    # 解析时只保留这些字段，其余字段（index_node_hash、created_by 等）会被丢弃
+    FIELDS = ("id", "document_id", "position", "word_count", "tokens", "hit_count",
+              "enabled", "status", "answer")
+
+    def __init__(self, id=None, document_id=None, position=None, content=None, keywords=None,
+                 word_count=None, tokens=None, hit_count=None, enabled=None, status=None,
+                 answer=None, document=None):
+        self.id = id
+        self.document_id = document_id
+        self.position = position
+        self.word_count = word_count
+        self.tokens = tokens
+        self.hit_count = hit_count
+        self.enabled = enabled
+        self.status = _intern(status)
+        self.answer = answer
+        self.document = document
+        self._content = content
+        self._keywords = KEYWORD_SEPARATOR.join(keywords) if keywords else None
+
+    @property
+    def content(self):
+        """分段内容"""
+        if self._content is None:
+            self._content = ""
+        return self._content
+
+    @property
+    def keywords(self):
+        """关键词列表（第一次访问时从紧凑的字符串中拆分，之后返回同一个列表）"""
+        if not isinstance(self._keywords, list):
+            self._keywords = self._keywords.split(KEYWORD_SEPARATOR) if self._keywords else []
+        return self._keywords
+
+    @classmethod
+    def from_dict(cls, data, documents=None):
+        """
+        从 dict 构造
+
+        参数:
+            data: segment dict，其中的 document 可以是 dict 或已构造好的 Document
+            documents: 可选，{文档ID: Document} 缓存，用于共享相同的文档实例
+        """
+        document = data.get("document")
+        if isinstance(document, dict):
+            document = Document.from_dict(document)
+        if document is not None and documents is not None:
+            document = documents.setdefault(document.id, document)
+        segment = cls(content=data.get("content"), keywords=data.get("keywords"), document=document)
+        for field in cls.FIELDS:
+            if field in data:
+                setattr(segment, field, data[field])
+        segment.status = _intern(segment.status)
+        return segment
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data["content"] = self.content
+        data["keywords"] = list(self.keywords)
+        data["document"] = self.document.to_dict() if self.document is not None else None
+        return data
+
+    def __repr__(self):
+        return f"Segment(id={self.id!r}, position={self.position!r}, content={self.content[:20]!r})"
+
+
+class Record:
+    """一条检索记录：分段 + 相关度分数"""
+
+    __slots__ = ("segment", "score")
+
+    def __init__(self, segment, score=None):
+        self.segment = segment
+        self.score = score
+
+    @classmethod
+    def from_dict(cls, data, documents=None):
+        segment = data.get("segment")
+        if isinstance(segment, dict):
+            segment = Segment.from_dict(segment, documents)
+        return cls(segment, data.get("score"))
+
+    def to_dict(self):
+        return {"segment": self.segment.to_dict() if self.segment is not None else None, "score": self.score}
+
+    def __repr__(self):
+        return f"Record(score={self.score!r}, segment={self.segment!r})"
+
+
+class RetrieveResult:
+    """一次检索的结果"""
+
+    __slots__ = ("query", "records")
+
+    def __init__(self, query, records):
+        self.query = query
+        self.records = records
+
+    @classmethod
+    def from_dict(cls, data):
+        """从 retrieve_from_knowledge_base 返回的 dict（例如缓存中的结果）构造"""
+        documents = {}
+        records = [Record.from_dict(record, documents) for record in data.get("records", [])]
+        return cls((data.get("query") or {}).get("content", ""), records)
+
+    def to_dict(self):
+        """转换为与 API 响应相同结构的 dict"""
+        return {"query": {"content": self.query}, "records": [record.to_dict() for record in self.records]}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __repr__(self):
+        return f"RetrieveResult(query={self.query!r}, records={len(self.records)})"
+
+
+def make_object_hook(documents=None):
+    """
+    构造 json.loads 的 object_hook，把 document / segment / record 的 dict 转换为对象
+
+    参数:
+        documents: 可选，{文档ID: Document} 缓存，在多次解析之间共享相同的文档实例
+    """
+    if documents is None:
+        documents = {}
+
+    def object_hook(data):
+        if "segment" in data and "score" in data:
+            return Record.from_dict(data)
+        if "document_id" in data and "content" in data:
+            return Segment.from_dict(data, documents)
+        if "data_source_type" in data and "id" in data:
+            return Document.from_dict(data)
+        return data
+
+    return object_hook
+
+
+def parse_retrieve_response(raw):
+    """
+    把检索 API 的响应字节解析为 RetrieveResult
+
+    通过 object_hook 自底向上构造对象：document、segment、record 的 dict
+    一构建完就被替换为对应的对象，不会同时保留整棵 dict 树。
+
+    参数:
+        raw: 响应内容（bytes 或 str）
+    """
+    data = json.loads(raw, object_hook=make_object_hook())
+    return RetrieveResult((data.get("query") or {}).get("content", ""), data.get("records", []))
@@ -0,0 +1,292 @@
+"""
+检索与对话并行的流水线
+同一个查询同时发起知识库检索和流式对话：检索结果一到就交给界面展示（引用），
+回复片段同时流式输出；对话结束后把检索到的记录与 message_end 中的
+retriever_resources（App 实际引用的分段）进行比较。
+
+检索使用知识库 API Key，对话使用 App API Key，两个请求各用各的连接池。
+
+用法:
+    from dify_pipeline import retrieve_and_chat
+
+    result = retrieve_and_chat(
+        "如何重置密码?",
+        on_records=lambda records: show_citations(records),
+        sinks=[CallbackSink(show_chunk)]
+    )
+    print(result["comparison"]["recall"])
+
+    # 对本地模拟服务器运行，并与先检索后对话的耗时对比
+    python dify_pipeline.py "什么是生成式UI?" --mock --compare-sequential
+"""
+
+import argparse
+import threading
+import time
+
+import test_chat_messages
+import test_knowledge_retrieve
+from dify_client import get_shared_client
+from dify_deadline import Deadline
+from dify_merge import content_digest
+from dify_stats import jaccard, rank_biased_overlap
+
+
+def _match_key(segment_id, content, ids, digests):
+    """按分段ID 匹配，找不到时按内容摘要匹配（与 dify_merge 的去重方式相同）"""
+    if segment_id and segment_id in ids:
+        return ids[segment_id]
+    return digests.get(content_digest(content))
+
+
+def compare_citations(records, resources):
+    """
+    比较检索到的记录和回复实际引用的资源
+
+    参数:
+        records: 检索结果中的 records 列表（按分数从高到低）
+        resources: message_end metadata 中的 retriever_resources 列表
+
+    返回:
+        {"retrieved": 检索到的记录数, "cited": 引用数, "matched": 两边都有的分段数,
+         "recall": 引用中被检索到的比例, "precision": 检索结果中被引用的比例,
+         "jaccard", "rbo": 两个排序的排序偏置重叠度,
+         "matches": [{"rank", "position", "retrieved_score", "cited_score", "segment_id", "document_name"}],
+         "only_retrieved": [没有被引用的检索结果序号], "only_cited": [没有被检索到的引用序号]}
+    """
+    records = records or []
+    resources = resources or []
+    ids = {}
+    digests = {}
+    retrieved_keys = []
+    for rank, record in enumerate(records, 1):
+        segment = record.get("segment") or {}
+        key = ("record", rank)
+        if segment.get("id"):
+            ids.setdefault(segment["id"], key)
+        digests.setdefault(content_digest(segment.get("content")), key)
+        retrieved_keys.append(key)
+
+    matches = []
+    cited_keys = []
+    only_cited = []
+    for position, resource in enumerate(resources, 1):
+        key = _match_key(resource.get("segment_id"), resource.get("content"), ids, digests)
+        if key is None:
+            only_cited.append(position)
+            cited_keys.append(("resource", position))
+            continue
+        cited_keys.append(key)
+        record = records[key[1] - 1]
+        matches.append({
+            "rank": key[1],
+            "position": position,
+            "retrieved_score": record.get("score"),
+            "cited_score": resource.get("score"),
+            "segment_id": resource.get("segment_id"),
+            "document_name": resource.get("document_name")
+        })
+
+    matched = len({match["rank"] for match in matches})
+    cited_set = set(cited_keys)
+    return {
+        "retrieved": len(records),
+        "cited": len(resources),
+        "matched": matched,
+        "recall": matched / len(resources) if resources else None,
+        "precision": matched / len(records) if records else None,
+        "jaccard": jaccard(retrieved_keys, cited_keys),
+        "rbo": rank_biased_overlap(retrieved_keys, cited_keys),
+        "matches": matches,
+        "only_retrieved": [key[1] for key in retrieved_keys if key not in cited_set],
+        "only_cited": only_cited
+    }
+
+
+def print_citations(records, elapsed_time=None):
+    """打印检索到的引用（on_records 的默认实现）"""
+    timing = f" ({elapsed_time * 1000:.0f}毫秒)" if elapsed_time is not None else ""
+    print(f"\n[引用] 检索到 {len(records)} 条记录{timing}")
+    for idx, record in enumerate(records, 1):
+        segment = record.get("segment") or {}
+        document = segment.get("document") or {}
+        content = (segment.get("content") or "").replace("\n", " ")
+        print(f"  [{idx}] {document.get('name', 'N/A')} 相关度 {record.get('score', 0):.4f}: {content[:40]}...")
+
+
+def retrieve_and_chat(query, conversation_id=None, inputs=None, user="test-user", retrieval_config=None,
+                      dataset_id=None, kb_client=None, chat_client=None, on_records=None, sinks=None,
+                      deadline=None, verbose=True, raise_errors=False, **chat_options):
+    """
+    同时发起知识库检索和流式对话
+
+    检索在后台线程中执行，返回后立即调用 on_records（在检索线程中调用，不等待对话）；
+    对话在当前线程中执行，回复片段照常经过 sinks 输出。检索失败不影响对话。
+
+    参数:
+        query: 用户输入/提问内容（检索和对话共用）
+        conversation_id: 可选，会话ID
+        inputs: 可选，App 定义的各变量值
+        user: 用户标识
+        retrieval_config: 可选的检索配置
+        dataset_id: 可选，知识库ID（默认为 test_knowledge_retrieve.DATASET_ID）
+        kb_client: 可选，知识库 API Key 的 DifyClient（默认使用共享的连接池客户端）
+        chat_client: 可选，App API Key 的 DifyClient（默认使用共享的连接池客户端）
+        on_records: 可选，检索返回时调用 on_records(records)；默认在 verbose 时打印引用
+        sinks: 可选，回复片段的输出目标列表（见 dify_answer.py）
+        deadline: 可选，截止时间（Deadline 或秒数），检索和对话共用
+        verbose: 是否打印请求、引用和统计信息
+        raise_errors: 为 True 时对话失败抛出 dify_errors 中的异常（检索失败只记录在 "retrieval_error" 中）
+        chat_options: 传给 send_chat_message_streaming 的其它参数（例如 cancel_token、stop、limiter、stall_timeout）
+
+    返回:
+        {"query", "records": 检索到的记录（失败时为 None）, "retrieval_error": 错误信息或 None,
+         "chat": send_chat_message_streaming 的结果, "comparison": compare_citations() 的结果,
+         "timing": {"retrieval": 检索耗时, "first_message": 首个回复片段时间, "chat": 对话耗时,
+                    "total": 总耗时, "sequential": 先检索后对话的预计耗时}}
+    """
+    kb_client = kb_client or get_shared_client(test_knowledge_retrieve.API_KEY, test_knowledge_retrieve.API_BASE_URL)
+    chat_client = chat_client or get_shared_client(test_chat_messages.API_KEY, test_chat_messages.API_BASE_URL)
+    deadline = Deadline.of(deadline)
+    retrieval = {"records": None, "error": None, "elapsed_time": None}
+    start_time = time.perf_counter()
+
+    def run_retrieval():
+        try:
+            result = test_knowledge_retrieve.retrieve_from_knowledge_base(
+                query,
+                retrieval_config=retrieval_config,
+                client=kb_client,
+                dataset_id=dataset_id,
+                deadline=deadline,
+                verbose=False,
+                raise_errors=True
+            )
+            retrieval["records"] = result.get("records", [])
+        except Exception as e:
+            retrieval["error"] = f"{type(e).__name__}: {e}"
+        retrieval["elapsed_time"] = time.perf_counter() - start_time
+        if retrieval["records"] is None:
+            if verbose:
+                print(f"\n✗ [检索失败] {retrieval['error']}")
+            return
+        if on_records is not None:
+            on_records(retrieval["records"])
+        elif verbose:
+            print_citations(retrieval["records"], retrieval["elapsed_time"])
+
+    retrieval_thread = threading.Thread(target=run_retrieval, name="pipeline-retrieve", daemon=True)
+    retrieval_thread.start()
+    try:
+        chat = test_chat_messages.send_chat_message_streaming(
+            query,
+            conversation_id=conversation_id,
+            inputs=inputs,
+            user=user,
+            client=chat_client,
+            sinks=sinks,
+            deadline=deadline,
+            verbose=verbose,
+            raise_errors=raise_errors,
+            **chat_options
+        )
+        chat_elapsed = time.perf_counter() - start_time
+    finally:
+        retrieval_thread.join()
+    total_elapsed = time.perf_counter() - start_time
+
+    resources = ((chat or {}).get("metadata") or {}).get("retriever_resources")
+    comparison = None
+    if chat is not None and retrieval["records"] is not None:
+        comparison = compare_citations(retrieval["records"], resources)
+
+    first_message = ((chat or {}).get("trace") or {}).get("first_message")
+    sequential = None
+    if retrieval["elapsed_time"] is not None and chat is not None:
+        sequential = retrieval["elapsed_time"] + chat_elapsed
+    result = {
+        "query": query,
+        "records": retrieval["records"],
+        "retrieval_error": retrieval["error"],
+        "chat": chat,
+        "comparison": comparison,
+        "timing": {
+            "retrieval": retrieval["elapsed_time"],
+            "first_message": first_message,
+            "chat": chat_elapsed,
+            "total": total_elapsed,
+            "sequential": sequential
+        }
+    }
+    if verbose:
+        print_pipeline_result(result)
+    return result
+
+
+def print_pipeline_result(result):
+    """打印流水线的耗时和引用比较"""
+    timing = result["timing"]
+    print("=" * 60)
+    print(f"检索与对话并行: {result['query']}")
+    print("=" * 60)
+    if timing["retrieval"] is not None:
+        print(f"检索耗时: {timing['retrieval'] * 1000:.0f}毫秒")
+    if timing["first_message"] is not None:
+        print(f"首个回复片段: {timing['first_message'] * 1000:.0f}毫秒")
+    print(f"对话耗时: {timing['chat'] * 1000:.0f}毫秒  总耗时: {timing['total'] * 1000:.0f}毫秒")
+    if timing["sequential"] is not None:
+        saved = timing["sequential"] - timing["total"]
+        print(f"先检索后对话预计: {timing['sequential'] * 1000:.0f}毫秒（节省 {saved * 1000:.0f}毫秒）")
+    if result["retrieval_error"]:
+        print(f"✗ 检索失败: {result['retrieval_error']}")
+
+    comparison = result["comparison"]
+    if comparison is not None:
+        print("-" * 60)
+        print(f"检索到 {comparison['retrieved']} 条，回复引用 {comparison['cited']} 条，重合 {comparison['matched']} 条")
+        if comparison["recall"] is not None:
+            print(f"  引用被检索到的比例: {comparison['recall']:.1%}")
+        if comparison["precision"] is not None:
+            print(f"  检索结果被引用的比例: {comparison['precision']:.1%}")
+        print(f"  Jaccard: {comparison['jaccard']:.3f}  RBO: {comparison['rbo']:.3f}")
+        for match in comparison["matches"]:
+            print(f"  检索第 {match['rank']} 条 = 引用第 {match['position']} 条 "
+                  f"({match['document_name']}, 分数 {match['retrieved_score']} / {match['cited_score']})")
+        if comparison["only_retrieved"]:
+            print(f"  未被引用的检索结果: {comparison['only_retrieved']}")
+        if comparison["only_cited"]:
+            print(f"  未被检索到的引用: {comparison['only_cited']}")
+    print("=" * 60)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="检索与对话并行")
+    parser.add_argument("query", help="查询内容（检索和对话共用）")
+    parser.add_argument("--dataset-id", default=None, help="知识库ID")
+    parser.add_argument("--top-k", type=int, default=None, help="检索返回的记录数")
+    parser.add_argument("--compare-sequential", action="store_true", help="再按先检索后对话的顺序执行一次，对比耗时")
+    parser.add_argument("--mock", action="store_true", help="在本进程中启动模拟服务器并对其运行")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    mock_server = None
+    if args.mock:
+        from mock_dify_server import MockConfig, MockServerThread
+        mock_server = MockServerThread(MockConfig(latency=0.3, token_rate=50)).start()
+        test_knowledge_retrieve.API_BASE_URL = test_chat_messages.API_BASE_URL = mock_server.base_url
+
+    retrieval_config = {"top_k": args.top_k} if args.top_k else None
+    try:
+        retrieve_and_chat(args.query, retrieval_config=retrieval_config, dataset_id=args.dataset_id)
+        if args.compare_sequential:
+            start_time = time.perf_counter()
+            test_knowledge_retrieve.retrieve_from_knowledge_base(
+                args.query, retrieval_config=retrieval_config, dataset_id=args.dataset_id, verbose=False
+            )
+            test_chat_messages.send_chat_message_streaming(args.query, verbose=False)
+            print(f"先检索后对话实测: {(time.perf_counter() - start_time) * 1000:.0f}毫秒")
+    finally:
+        if mock_server is not None:
+            mock_server.stop()
@@ -0,0 +1,317 @@
+"""
+按 usage 元数据计费的客户端限流
+在客户端把请求速率和 token 消耗平滑到供应商配额之内，而不是等到 429 风暴再处理：
+- 请求速率（RPS）和每分钟 token 数（TPM）各用一个令牌桶限制
+- 请求前按预估 token 数预留额度，message_end / 阻塞响应的 usage 到达后按实际用量结算
+- 滚动窗口统计请求数、token 数和费用（total_price）
+- 预算用完时排队等待（mode="queue"）或直接拒绝（mode="reject"）
+
+用法:
+    from dify_ratelimit import RateLimiter
+
+    limiter = RateLimiter(requests_per_second=5, tokens_per_minute=60000)
+    send_chat_message_streaming(query, limiter=limiter)
+    print(limiter.spend())
+"""
+
+import collections
+import threading
+import time
+
+from dify_errors import BudgetExhaustedError, DeadlineExceededError
+
+QUEUE = "queue"
+REJECT = "reject"
+
+
+class TokenBucket:
+    """
+    令牌桶
+
+    余额可以为负（实际用量超过预留时记为欠额），欠额还清之前不会放行新的请求。
+
+    参数:
+        rate: 每秒补充的令牌数
+        capacity: 桶容量（允许的突发量）
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def level(self):
+        """当前余额"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._level
+
+    def wait_time(self, amount):
+        """余额达到 amount 还需要等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (amount - self._level) / self.rate)
+
+    def try_acquire(self, amount):
+        """余额足够时扣除 amount 并返回 0，否则不扣除，返回还需要等待的秒数"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._level >= amount:
+                self._level -= amount
+                return 0.0
+            return (amount - self._level) / self.rate
+
+    def adjust(self, amount):
+        """直接增减余额（amount 为正表示扣除，为负表示退还）"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level = min(self.capacity, self._level - amount)
+
+
+class UsageWindow:
+    """
+    滚动窗口内的用量统计
+
+    参数:
+        window: 窗口长度（秒）
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._events = collections.deque()
+        self._requests = 0
+        self._tokens = 0
+        self._price = 0.0
+
+    def _expire(self, now):
+        while self._events and self._events[0][0] <= now - self.window:
+            _, tokens, price = self._events.popleft()
+            self._requests -= 1
+            self._tokens -= tokens
+            self._price -= price
+
+    def add(self, tokens, price, now=None):
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+        self._events.append((now, tokens, price))
+        self._requests += 1
+        self._tokens += tokens
+        self._price += price
+
+    def totals(self, now=None):
+        """窗口内的 {"requests", "tokens", "price"}"""
+        self._expire(time.monotonic() if now is None else now)
+        return {"requests": self._requests, "tokens": self._tokens, "price": round(max(0.0, self._price), 7)}
+
+
+class RateLimiter:
+    """
+    请求速率 + token 预算限流器（线程安全）
+
+    请求前调用 acquire() 预留额度，请求结束后调用 record(usage, reservation) 按实际用量结算；
+    请求没有产生用量（例如返回了 4xx/5xx）时调用 release(reservation) 退还。
+    send_chat_message_blocking / send_chat_message_streaming 的 limiter 参数会自动完成这些步骤。
+
+    参数:
+        requests_per_second: 每秒请求数上限，None 表示不限制
+        tokens_per_minute: 每分钟 token 数上限，None 表示不限制
+        request_burst: 请求突发量，默认 max(1, requests_per_second)
+        token_burst: token 突发量，默认为一分钟的额度
+        estimate_tokens: 还没有实际用量数据时每个请求预留的 token 数；
+                         之后使用近期实际用量的指数滑动平均
+        mode: "queue" 预算不足时排队等待，"reject" 直接抛出 BudgetExhaustedError
+        max_wait: 排队模式下最长等待时间（秒），超过时抛出 BudgetExhaustedError
+        windows: 用量统计的滚动窗口（秒）
+    """
+
+    def __init__(self, requests_per_second=None, tokens_per_minute=None, request_burst=None,
+                 token_burst=None, estimate_tokens=1000, mode=QUEUE, max_wait=60.0, windows=(60, 3600)):
+        if mode not in (QUEUE, REJECT):
+            raise ValueError(f"未知的限流模式: {mode}")
+        self.mode = mode
+        self.max_wait = max_wait
+        self.request_bucket = None
+        self.token_bucket = None
+        if requests_per_second:
+            self.request_bucket = TokenBucket(requests_per_second, request_burst or max(1.0, requests_per_second))
+        if tokens_per_minute:
+            self.token_bucket = TokenBucket(tokens_per_minute / 60.0, token_burst or tokens_per_minute)
+        self.windows = [UsageWindow(window) for window in windows]
+
+        self._estimate = float(estimate_tokens)
+        self._observed = False
+        self._blocked_until = 0.0
+        self._reserved = 0
+        self._lock = threading.Lock()
+        # 排队的请求依次检查额度，避免大量请求同时轮询令牌桶
+        self._turn = threading.Lock()
+        self._counts = {"acquired": 0, "queued": 0, "rejected": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    def estimate(self):
+        """当前每个请求预留的 token 数"""
+        with self._lock:
+            estimate = int(self._estimate)
+        if self.token_bucket is not None:
+            estimate = min(estimate, int(self.token_bucket.capacity))
+        return estimate
+
+    def _wait_time(self, tokens):
+        """两个令牌桶都满足条件还需要等待的秒数（0 表示已扣除额度）"""
+        wait = self._blocked_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.request_bucket is not None:
+            wait = self.request_bucket.wait_time(1)
+            if wait > 0:
+                return wait
+        if self.token_bucket is not None and tokens:
+            wait = self.token_bucket.try_acquire(tokens)
+            if wait > 0:
+                return wait
+        if self.request_bucket is not None:
+            self.request_bucket.try_acquire(1)
+        return 0.0
+
+    def acquire(self, tokens=None, deadline=None):
+        """
+        预留一个请求的额度
+
+        参数:
+            tokens: 预留的 token 数，默认使用 estimate()
+            deadline: 可选，dify_deadline.Deadline；排队（包括等待前面排队的请求）不超过剩余时间
+
+        返回:
+            预留的 token 数（传给 record / release）
+
+        异常:
+            BudgetExhaustedError: 拒绝模式下额度不足，或排队模式下等待超过 max_wait
+            DeadlineExceededError: 等到额度时已经超过截止时间
+        """
+        tokens = self.estimate() if tokens is None else tokens
+        start_time = time.monotonic()
+        queued = False
+        # 前面的请求可能正持有 _turn 等待额度，轮到自己之前的等待同样受 max_wait 和截止时间限制
+        turn_timeout = self.max_wait if deadline is None else min(self.max_wait, deadline.remaining())
+        if not self._turn.acquire(timeout=max(0.0, turn_timeout)):
+            waited = time.monotonic() - start_time
+            raise self._give_up(f"等待前面排队的请求 {waited:.2f} 秒后仍未轮到", waited, deadline)
+        try:
+            while True:
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                waited = time.monotonic() - start_time
+                if self.mode == REJECT or waited + wait > self.max_wait:
+                    self._count("rejected")
+                    raise BudgetExhaustedError(f"超出客户端限流预算，需要等待 {wait:.2f} 秒", wait)
+                if deadline is not None and wait >= deadline.remaining():
+                    raise self._give_up(f"限流排队需要等待 {wait:.2f} 秒", wait, deadline)
+                if not queued:
+                    queued = True
+                    self._count("queued")
+                time.sleep(wait)
+        finally:
+            self._turn.release()
+
+        with self._lock:
+            self._reserved += tokens
+            self._counts["acquired"] += 1
+            self._counts["wait_seconds"] += time.monotonic() - start_time
+        return tokens
+
+    def _give_up(self, message, wait, deadline):
+        """排队等待超过 max_wait 或截止时间时的异常"""
+        self._count("rejected")
+        if deadline is not None and deadline.remaining() < self.max_wait:
+            return DeadlineExceededError(f"{message}，超过截止时间（{deadline.seconds:g}秒）")
+        return BudgetExhaustedError(f"超出客户端限流预算，{message}", wait)
+
+    def record(self, usage, reservation=0):
+        """
+        按实际用量结算
+
+        参数:
+            usage: message_end / 阻塞响应 metadata 中的 usage；
+                   为 None 时（例如流式请求被提前停止）按预留的 token 数计费
+            reservation: acquire() 的返回值
+        """
+        usage = usage or {}
+        tokens = int(usage.get("total_tokens") or reservation)
+        try:
+            price = float(usage.get("total_price") or 0)
+        except (TypeError, ValueError):
+            price = 0.0
+        if self.token_bucket is not None:
+            self.token_bucket.adjust(tokens - reservation)
+
+        now = time.monotonic()
+        with self._lock:
+            self._reserved -= reservation
+            if usage.get("total_tokens"):
+                # 用实际用量更新预估值（指数滑动平均）
+                self._estimate = tokens if not self._observed else 0.8 * self._estimate + 0.2 * tokens
+                self._observed = True
+            for window in self.windows:
+                window.add(tokens, price, now)
+
+    def release(self, reservation=0, error=None):
+        """
+        退还没有产生用量的请求的额度
+
+        参数:
+            reservation: acquire() 的返回值
+            error: 可选，请求失败的异常；429 且带有 Retry-After 时，在此期间暂停放行新请求
+        """
+        if self.token_bucket is not None:
+            self.token_bucket.adjust(-reservation)
+        with self._lock:
+            self._reserved -= reservation
+            retry_after = getattr(error, "retry_after", None)
+            if getattr(error, "status", None) == 429:
+                self._counts["rate_limited"] += 1
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def spend(self):
+        """
+        当前的用量和额度
+
+        返回:
+            {"windows": {"60s": {"requests", "tokens", "price"}, ...},
+             "tokens_available", "requests_available", "reserved", "estimate",
+             "acquired", "queued", "rejected", "wait_seconds", "rate_limited"}
+        """
+        now = time.monotonic()
+        with self._lock:
+            result = {"windows": {f"{window.window:g}s": window.totals(now) for window in self.windows}}
+            result["reserved"] = self._reserved
+            result["estimate"] = int(self._estimate)
+            result.update(self._counts)
+            result["wait_seconds"] = round(result["wait_seconds"], 3)
+        result["tokens_available"] = int(self.token_bucket.level) if self.token_bucket is not None else None
+        result["requests_available"] = round(self.request_bucket.level, 2) if self.request_bucket is not None else None
+        return result
+
+
+def print_spend(spend):
+    """打印 RateLimiter.spend() 的结果"""
+    print("-" * 60)
+    print("客户端限流用量:")
+    for name, totals in spend["windows"].items():
+        print(f"  最近 {name:>6}: {totals['requests']} 次请求, {totals['tokens']} tokens, 费用 {totals['price']}")
+    if spend["tokens_available"] is not None:
+        print(f"  可用 tokens: {spend['tokens_available']} (预留中 {spend['reserved']}, 每次预估 {spend['estimate']})")
+    print(f"  放行: {spend['acquired']}, 排队: {spend['queued']}, 拒绝: {spend['rejected']}, "
+          f"累计等待: {spend['wait_seconds']:.2f}秒, 429: {spend['rate_limited']}")
+    print("-" * 60)
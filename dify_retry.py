@@ -0,0 +1,249 @@
+"""
+重试、退避和熔断
+为 DifyClient 提供按错误分类的重试策略：
+- 指数退避 + 抖动，429/503 时遵守 Retry-After
+- 重试预算：重试次数不超过请求数的固定比例，避免故障时重试放大流量
+- 熔断器：连续失败达到阈值后快速失败，冷却后放行探测请求
+
+用法:
+    from dify_client import DifyClient
+    from dify_retry import Resilience
+
+    client = DifyClient(API_KEY, resilience=Resilience())
+"""
+
+import collections
+import random
+import threading
+import time
+
+from dify_errors import CircuitOpenError, DeadlineExceededError, DifyError
+
+
+class RetryPolicy:
+    """
+    重试策略：指数退避 + 完全抖动（full jitter）
+
+    参数:
+        max_attempts: 最多尝试次数（包含第一次）
+        base_delay: 第一次重试的退避上限（秒）
+        max_delay: 退避上限（秒）
+        max_retry_after: Retry-After 的上限（秒），超过时不再重试
+    """
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=20.0, max_retry_after=60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt, error=None):
+        """
+        计算第 attempt 次失败（从 0 开始）之后的等待时间
+
+        返回:
+            等待秒数；Retry-After 超过上限时返回 None（表示不再重试）
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryBudget:
+    """
+    重试预算
+
+    在滑动时间窗口内，重试次数不超过 max(min_retries_per_sec * window, ratio * 请求数)。
+
+    参数:
+        ratio: 允许的重试比例
+        min_retries_per_sec: 请求很少时保底允许的重试速率
+        window: 统计窗口（秒）
+    """
+
+    def __init__(self, ratio=0.2, min_retries_per_sec=1.0, window=10.0):
+        self.ratio = ratio
+        self.min_retries_per_sec = min_retries_per_sec
+        self.window = window
+        self._requests = collections.deque()
+        self._retries = collections.deque()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for events in (self._requests, self._retries):
+            while events and events[0] <= now - self.window:
+                events.popleft()
+
+    def record_request(self):
+        """记录一次新请求（不含重试）"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            self._requests.append(now)
+
+    def try_acquire(self):
+        """申请一次重试，预算用完时返回 False"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            allowed = max(self.min_retries_per_sec * self.window, self.ratio * len(self._requests))
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    closed: 正常放行；连续失败 failure_threshold 次后进入 open
+    open: 直接拒绝，recovery_timeout 秒后进入 half_open
+    half_open: 只放行一个探测请求，成功则回到 closed，失败则回到 open
+    不说明上游健康状况的结果（例如 4xx）只释放探测名额，既不算成功也不算失败
+
+    参数:
+        failure_threshold: 触发熔断的连续失败次数
+        recovery_timeout: 熔断持续时间（秒）
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """请求前检查，熔断时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.recovery_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(f"熔断器已打开，{remaining:.1f}秒后重试")
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError("熔断器半开，正在等待探测请求结果")
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_ignored(self):
+        """
+        请求结束但不说明上游是否健康（例如 4xx、调用方的截止时间、非 Dify 异常）
+
+        只释放半开状态下的探测名额，不改变状态和连续失败次数。
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+class Resilience:
+    """
+    组合重试策略、重试预算和熔断器
+
+    参数:
+        policy: RetryPolicy，默认 RetryPolicy()
+        budget: RetryBudget，默认 RetryBudget()；传入 False 表示不限制
+        breaker: CircuitBreaker，默认 CircuitBreaker()；传入 False 表示不熔断
+        verbose: 重试时是否打印提示
+    """
+
+    def __init__(self, policy=None, budget=None, breaker=None, verbose=False):
+        self.policy = policy or RetryPolicy()
+        self.budget = RetryBudget() if budget is None else budget
+        self.breaker = CircuitBreaker() if breaker is None else breaker
+        self.verbose = verbose
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "budget_exhausted": 0, "deadline_exhausted": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def call(self, func, deadline=None):
+        """
+        执行 func()，遇到可重试的 DifyError 时按策略重试
+
+        func 必须在失败时抛出 DifyError；其它异常直接向上抛出。
+
+        参数:
+            func: 无参数的请求函数
+            deadline: 可选，dify_deadline.Deadline；退避等待会超过截止时间时不再重试，
+                      抛出最后一次的错误（__cause__ 为说明截止时间的 DeadlineExceededError）
+        """
+        self._count("calls")
+        if self.budget:
+            self.budget.record_request()
+
+        attempt = 0
+        while True:
+            if self.breaker:
+                try:
+                    self.breaker.before_call()
+                except CircuitOpenError:
+                    self._count("rejected")
+                    raise
+            self._count("attempts")
+            outcome = None
+            try:
+                result = func()
+                outcome = "success"
+            except DifyError as e:
+                outcome = "failure" if e.breaker_failure else "ignored"
+                error = e
+            finally:
+                # 任何异常（包括非 Dify 异常和 KeyboardInterrupt）都要释放半开状态的探测名额
+                if self.breaker:
+                    if outcome == "success":
+                        self.breaker.record_success()
+                    elif outcome == "failure":
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_ignored()
+            if outcome == "success":
+                return result
+
+            if not error.retryable or attempt + 1 >= self.policy.max_attempts:
+                raise error
+            delay = self.policy.delay(attempt, error)
+            if delay is None:
+                raise error
+            if deadline is not None and delay >= deadline.remaining():
+                # 截止时间还没到，只是等不到下一次重试：保留真实的上游错误（状态码、响应体）
+                self._count("deadline_exhausted")
+                raise error from DeadlineExceededError(
+                    f"重试前需要等待 {delay:.2f} 秒，超过截止时间（{deadline.seconds:g}秒）"
+                )
+            if self.budget and not self.budget.try_acquire():
+                self._count("budget_exhausted")
+                raise error
+            self._count("retries")
+            if self.verbose:
+                print(f"⟳ {type(error).__name__}: {error}，{delay:.2f}秒后重试 ({attempt + 1}/{self.policy.max_attempts - 1})")
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,212 @@
+"""
+增量式 SSE（Server-Sent Events）解析器
+直接处理从连接中读到的原始字节块，按 SSE 规范产出事件对象
+"""
+
+import json
+
+
+class SSEEvent:
+    """
+    一个 SSE 事件
+
+    data 以原始字节保存，只在访问 data 属性或调用 json() 时才解码一次。
+
+    属性:
+        event: 事件类型（SSE 的 event 字段，默认为 "message"）
+        data: 事件数据（多行 data 字段以换行符拼接）
+        raw: 事件数据的原始字节
+        id: 最近一次的事件ID（SSE 的 id 字段）
+        retry: 服务器建议的重连间隔（毫秒），未指定时为 None
+    """
+
+    __slots__ = ("event", "raw", "id", "retry")
+
+    def __init__(self, event="message", raw=b"", id=None, retry=None):
+        self.event = event
+        self.raw = raw
+        self.id = id
+        self.retry = retry
+
+    @property
+    def data(self):
+        return self.raw.decode("utf-8", "replace")
+
+    def json(self):
+        """把 data 解析为 JSON，解析失败时抛出 json.JSONDecodeError"""
+        return json.loads(self.raw.decode("utf-8"))
+
+    def __repr__(self):
+        return f"SSEEvent(event={self.event!r}, data={self.data!r}, id={self.id!r})"
+
+
+class SSEParser:
+    """
+    增量式 SSE 解析器
+
+    按字节处理输入：先按空行切分出完整的事件块，只含单行 data 的常见事件
+    直接取出数据，不逐行解码或复制；被拆分在两个数据块之间的多字节字符、
+    行和事件都能正确处理。支持 CRLF / LF / CR 三种换行、多行 data、
+    event / id / retry 字段和注释行。
+
+    用法:
+        parser = SSEParser()
+        for chunk in response.iter_content(chunk_size=None):
+            for event in parser.feed(chunk):
+                ...
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._retry = None
+        self.last_event_id = None
+
+    def feed(self, chunk):
+        """
+        输入一个原始字节块，返回本次解析出的完整事件列表
+
+        参数:
+            chunk: 从连接读到的 bytes
+        """
+        pending = self._pending
+        if pending:
+            last = pending[-1][-1:]
+            if (b"\n\n" not in chunk and b"\r" not in chunk and last != b"\r"
+                    and not (last == b"\n" and chunk[:1] == b"\n")):
+                # 还没有完整的事件，先暂存，避免反复拼接长事件
+                pending.append(chunk)
+                return []
+            pending.append(chunk)
+            buf = b"".join(pending)
+        else:
+            buf = chunk
+        if b"\r" in buf:
+            buf = self._normalize_newlines(buf)
+
+        blocks = buf.split(b"\n\n")
+        tail = blocks.pop()
+        self._pending = [tail] if tail else []
+
+        events = []
+        for block in blocks:
+            if block[:6] == b"data: " and b"\n" not in block:
+                # 常见情况：只有一行 data 的事件；data 为空时按规范不分发
+                if len(block) > 6:
+                    events.append(SSEEvent("message", block[6:], self.last_event_id, self._retry))
+            elif block:
+                self._process_block(block, events)
+        return events
+
+    def close(self):
+        """
+        结束输入
+
+        以单个 CR 结尾的最后一行在此时才能确定是换行；
+        按规范，流结束时未以空行结尾的事件会被丢弃。
+
+        返回:
+            剩余的完整事件列表
+        """
+        events = []
+        if self._pending and self._pending[-1].endswith(b"\r"):
+            events = self.feed(b"\n")
+        self._pending = []
+        return events
+
+    def _normalize_newlines(self, buf):
+        # 末尾的 \r 可能是 CRLF 的前半部分，暂不转换，留到下一个数据块再处理
+        if buf.endswith(b"\r"):
+            return buf[:-1].replace(b"\r\n", b"\n").replace(b"\r", b"\n") + b"\r"
+        return buf.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+    def _process_block(self, block, events):
+        """逐行处理一个完整的事件块，分发出的事件追加到 events"""
+        data = []
+        event_type = b""
+        for line in block.split(b"\n"):
+            if not line:
+                # 事件块开头的多余空行
+                if _has_data(data):
+                    events.append(self._make_event(event_type, data))
+                data = []
+                event_type = b""
+                continue
+            if line[0] == 0x3A:
+                # 以冒号开头的是注释行
+                continue
+
+            field, sep, value = line.partition(b":")
+            if sep and value[:1] == b" ":
+                value = value[1:]
+
+            if field == b"data":
+                data.append(value)
+            elif field == b"event":
+                event_type = value
+            elif field == b"id":
+                if b"\x00" not in value:
+                    self.last_event_id = value.decode("utf-8", "replace")
+            elif field == b"retry":
+                if value.isdigit():
+                    self._retry = int(value)
+            # 其他字段按规范忽略
+
+        if _has_data(data):
+            events.append(self._make_event(event_type, data))
+
+    def _make_event(self, event_type, data):
+        return SSEEvent(
+            event_type.decode("utf-8", "replace") if event_type else "message",
+            data[0] if len(data) == 1 else b"\n".join(data),
+            self.last_event_id,
+            self._retry
+        )
+
+
+def _has_data(data):
+    """按规范，data 缓冲区（各行以换行连接）为空时不分发事件"""
+    return len(data) > 1 or (len(data) == 1 and data[0] != b"")
+
+
+def iter_sse_events(chunks):
+    """
+    从字节块迭代器中逐个产出 SSEEvent
+
+    参数:
+        chunks: 字节块迭代器，例如 response.iter_content(chunk_size=None)
+    """
+    parser = SSEParser()
+    for chunk in chunks:
+        if chunk:
+            yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+async def aiter_sse_events(chunks):
+    """
+    iter_sse_events 的异步版本
+
+    参数:
+        chunks: 异步字节块迭代器，例如 aiohttp 的 response.content.iter_any()
+    """
+    parser = SSEParser()
+    async for chunk in chunks:
+        if chunk:
+            for event in parser.feed(chunk):
+                yield event
+    for event in parser.close():
+        yield event
+
+
+def encode_sse_event(data, event=None):
+    """
+    把一个事件编码为 SSE 格式的字节（与 Dify 相同，data 为单行 JSON）
+
+    参数:
+        data: 事件数据（dict）
+        event: 可选，SSE 的 event 字段
+    """
+    body = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {body}\n\n".encode("utf-8")
+    return f"data: {body}\n\n".encode("utf-8")
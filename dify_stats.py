@@ -0,0 +1,137 @@
+"""
+统计工具：百分位数和延迟汇总
+"""
+
+import math
+
+
+def percentile(values, p):
+    """
+    计算百分位数（线性插值）
+
+    参数:
+        values: 数值列表
+        p: 百分位（0-100）
+
+    返回:
+        百分位数，values 为空时返回 None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = math.floor(rank)
+    high = math.ceil(rank)
+    if low == high:
+        return ordered[low]
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values):
+    """
+    汇总一组数值
+
+    返回:
+        {"count", "mean", "min", "p50", "p90", "p99", "max"}
+    """
+    if not values:
+        return {"count": 0, "mean": None, "min": None, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "min": ordered[0],
+        "p50": percentile(ordered, 50),
+        "p90": percentile(ordered, 90),
+        "p99": percentile(ordered, 99),
+        "max": ordered[-1]
+    }
+
+
+def format_summary(name, summary, unit="秒", scale=1.0):
+    """把 summarize() 的结果格式化为一行文字"""
+    if not summary["count"]:
+        return f"{name}: 无数据"
+    return (
+        f"{name}: p50={summary['p50'] * scale:.3f} p90={summary['p90'] * scale:.3f} "
+        f"p99={summary['p99'] * scale:.3f} max={summary['max'] * scale:.3f} {unit} (n={summary['count']})"
+    )
+
+
+def jaccard(a, b):
+    """
+    两个集合的 Jaccard 相似度 |A∩B| / |A∪B|
+
+    两个集合都为空时返回 1.0
+    """
+    a, b = set(a), set(b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def rank_biased_overlap(a, b, p=0.9):
+    """
+    两个排序列表的排序偏置重叠度（RBO，Webber 等 2010，外推形式）
+
+    越靠前的位置权重越大，p 越小越看重前几位；两个列表相同时为 1.0，完全不相交时为 0.0。
+
+    参数:
+        a, b: 排序后的列表（元素可哈希，例如分段ID）
+        p: 持续概率（0 < p < 1）
+    """
+    if not a and not b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    depth = max(len(a), len(b))
+    seen_a, seen_b = set(), set()
+    overlap = 0
+    weighted_sum = 0.0
+    for d in range(1, depth + 1):
+        if d <= len(a):
+            item = a[d - 1]
+            if item in seen_b:
+                overlap += 1
+            seen_a.add(item)
+        if d <= len(b):
+            item = b[d - 1]
+            if item in seen_a:
+                overlap += 1
+            seen_b.add(item)
+        weighted_sum += overlap / d * p ** d
+    return overlap / depth * p ** depth + (1 - p) / p * weighted_sum
+
+
+def histogram(values, bins=10, low=0.0, high=1.0):
+    """
+    等宽直方图
+
+    返回:
+        每个区间的计数列表，超出 [low, high] 的值计入两端的区间
+    """
+    counts = [0] * bins
+    width = (high - low) / bins
+    for value in values:
+        index = int((value - low) / width)
+        counts[min(max(index, 0), bins - 1)] += 1
+    return counts
+
+
+def linear_fit(xs, ys):
+    """
+    最小二乘直线拟合 y = slope * x + intercept
+
+    返回:
+        (slope, intercept)；样本少于 2 个或 x 全部相同时返回 None
+    """
+    n = len(xs)
+    if n < 2:
+        return None
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if not variance:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+    return slope, mean_y - slope * mean_x
@@ -0,0 +1,357 @@
+"""
+流式对话的逐事件计时
+记录连接、首字节、首个 message 片段、各节点开始/完成和 message_end 的时间，
+并导出为 JSONL、Prometheus 文本格式或 Chrome trace-event 格式
+
+用法:
+    # 汇总 JSONL 中的多次运行，打印各节点延迟并导出 Chrome trace
+    python dify_trace.py traces.jsonl --chrome workflow_trace.json
+"""
+
+import argparse
+import json
+import time
+
+from dify_stats import format_summary, summarize
+
+# Prometheus 直方图的默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 导出到 Prometheus 的阶段及说明
+TRACE_METRICS = (
+    ("connect", "从发出请求到收到响应头的时间"),
+    ("first_byte", "从发出请求到收到第一个字节的时间"),
+    ("first_message", "从发出请求到收到第一个 message 片段的时间（TTFT）"),
+    ("message_end", "从发出请求到收到 message_end 的时间"),
+    ("total", "从发出请求到流结束的总时间"),
+    ("server_latency", "服务器报告的 usage.latency"),
+    ("client_overhead", "客户端总时间减去服务器延迟（网络和排队）")
+)
+
+
+class StreamTrace:
+    """
+    一次流式对话的计时记录
+
+    所有时间都是相对于请求发出时刻的秒数（time.perf_counter）。
+
+    用法:
+        trace = StreamTrace()
+        response = client.post(...)
+        trace.mark("connect")
+        for chunk in trace.wrap_chunks(response.iter_content(chunk_size=None)):
+            ...
+            trace.record_event(data)
+        trace.finish(usage)
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.marks = {}
+        self.events = []
+
+    def elapsed(self):
+        """距请求发出的秒数"""
+        return time.perf_counter() - self._start
+
+    def mark(self, name):
+        """记录一个阶段的时间（同名阶段只记录第一次）"""
+        if name not in self.marks:
+            self.marks[name] = self.elapsed()
+
+    def wrap_chunks(self, chunks):
+        """包装字节块迭代器，记录首字节时间"""
+        for chunk in chunks:
+            if chunk:
+                self.mark("first_byte")
+            yield chunk
+
+    def record_event(self, data):
+        """
+        记录一个已解析的 SSE 事件
+
+        node_started / node_finished 事件会额外记录节点ID、类型和标题。
+        """
+        t = self.elapsed()
+        event = data.get('event', '')
+        entry = {"event": event, "t": t}
+
+        if event == 'message':
+            self.mark("first_message")
+        elif event in ('node_started', 'node_finished'):
+            node_data = data.get('data', {})
+            entry["execution_id"] = node_data.get('id')
+            entry["node_id"] = node_data.get('node_id')
+            entry["node_type"] = node_data.get('node_type')
+            entry["title"] = node_data.get('title')
+            if event == 'node_finished':
+                entry["status"] = node_data.get('status')
+                entry["elapsed_time"] = node_data.get('elapsed_time')
+        elif event == 'message_end':
+            self.mark("message_end")
+
+        self.events.append(entry)
+
+    def finish(self, usage=None):
+        """
+        结束计时
+
+        参数:
+            usage: 可选，message_end 中的 usage，用于对比服务器报告的延迟
+        """
+        self.mark("total")
+        server_latency = (usage or {}).get('latency')
+        if server_latency is not None:
+            self.marks["server_latency"] = server_latency
+            self.marks["client_overhead"] = self.marks["total"] - server_latency
+
+    def to_dict(self):
+        """结构化的计时结果"""
+        trace = {"started_at": self.started_at}
+        for name, _ in TRACE_METRICS:
+            trace[name] = self.marks.get(name)
+        trace["events"] = self.events
+        return trace
+
+
+def write_jsonl(traces, path):
+    """
+    把计时结果追加写入 JSONL 文件（每行一个 trace）
+
+    参数:
+        traces: trace 字典列表（StreamTrace.to_dict() 或结果中的 "trace"）
+        path: 文件路径
+    """
+    with open(path, "a", encoding="utf-8") as f:
+        for trace in traces:
+            f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+
+
+def read_jsonl(path):
+    """读取 write_jsonl 写入的计时结果"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def to_prometheus(traces, prefix="dify_stream", buckets=DEFAULT_BUCKETS):
+    """
+    把一组计时结果汇总为 Prometheus 文本格式的直方图
+
+    参数:
+        traces: trace 字典列表
+        prefix: 指标名前缀
+        buckets: 直方图分桶上界（秒）
+
+    返回:
+        Prometheus 文本格式字符串
+    """
+    lines = []
+    for name, help_text in TRACE_METRICS:
+        values = [trace[name] for trace in traces if trace.get(name) is not None]
+        metric = f"{prefix}_{name}_seconds"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} histogram")
+        for bound in buckets:
+            count = sum(1 for value in values if value <= bound)
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {len(values)}')
+        lines.append(f"{metric}_sum {sum(values)}")
+        lines.append(f"{metric}_count {len(values)}")
+    return "\n".join(lines) + "\n"
+
+
+def node_spans(trace):
+    """
+    把 node_started / node_finished 事件配对为节点执行区间
+
+    按节点执行ID配对（同一节点在循环 / 迭代中可能执行多次），
+    没有执行ID时退回按 node_id 配对。未完成的节点不计入。
+
+    返回:
+        [{"node_id", "node_type", "title", "status", "start", "end", "duration", "server_elapsed"}, ...]，
+        按开始时间排序；duration 为客户端观察到的时间，server_elapsed 为服务器报告的 elapsed_time
+    """
+    started = {}
+    spans = []
+    for entry in trace.get("events", []):
+        event = entry["event"]
+        if event not in ('node_started', 'node_finished'):
+            continue
+        key = entry.get("execution_id") or entry.get("node_id")
+        if event == 'node_started':
+            started[key] = entry
+        elif key in started:
+            begin = started.pop(key)
+            spans.append({
+                "node_id": entry.get("node_id"),
+                "node_type": entry.get("node_type") or begin.get("node_type"),
+                "title": entry.get("title") or begin.get("title"),
+                "status": entry.get("status"),
+                "start": begin["t"],
+                "end": entry["t"],
+                "duration": entry["t"] - begin["t"],
+                "server_elapsed": entry.get("elapsed_time")
+            })
+    spans.sort(key=lambda span: span["start"])
+    return spans
+
+
+def workflow_span(trace):
+    """workflow_started 到 workflow_finished 的区间，没有工作流事件时返回 None"""
+    start = end = None
+    for entry in trace.get("events", []):
+        if entry["event"] == 'workflow_started' and start is None:
+            start = entry["t"]
+        elif entry["event"] == 'workflow_finished':
+            end = entry["t"]
+    if start is None or end is None:
+        return None
+    return {"start": start, "end": end, "duration": end - start}
+
+
+class NodeLatencyStats:
+    """
+    跨多次运行汇总各工作流节点的延迟
+
+    按 (节点类型, 标题) 分组。
+
+    用法:
+        stats = NodeLatencyStats()
+        for trace in traces:
+            stats.add(trace)
+        for (node_type, title), summary in stats.summary().items():
+            ...
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.runs = 0
+
+    def add(self, trace):
+        """加入一次运行的计时结果"""
+        self.runs += 1
+        for span in node_spans(trace):
+            key = (span["node_type"], span["title"])
+            self.durations.setdefault(key, []).append(span["duration"])
+
+    def summary(self):
+        """
+        各节点的延迟汇总，按总耗时从高到低排序
+
+        返回:
+            {(节点类型, 标题): {"count", "mean", "min", "p50", "p90", "p99", "max", "total"}}
+        """
+        result = {}
+        for key, values in self.durations.items():
+            result[key] = dict(summarize(values), total=sum(values))
+        return dict(sorted(result.items(), key=lambda item: item[1]["total"], reverse=True))
+
+    def to_prometheus(self, prefix="dify_workflow_node", buckets=DEFAULT_BUCKETS):
+        """各节点延迟的 Prometheus 直方图（带 node_type / title 标签）"""
+        metric = f"{prefix}_duration_seconds"
+        lines = [
+            f"# HELP {metric} 工作流节点从 node_started 到 node_finished 的时间",
+            f"# TYPE {metric} histogram"
+        ]
+        for (node_type, title), values in self.durations.items():
+            labels = f'node_type="{_escape_label(node_type)}",title="{_escape_label(title)}"'
+            for bound in buckets:
+                count = sum(1 for value in values if value <= bound)
+                lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {len(values)}')
+            lines.append(f"{metric}_sum{{{labels}}} {sum(values)}")
+            lines.append(f"{metric}_count{{{labels}}} {len(values)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_chrome_trace(traces):
+    """
+    转换为 Chrome trace-event 格式（可在 chrome://tracing 或 Perfetto 中查看）
+
+    每次运行占一行（tid），包含整体请求、工作流、各节点的区间，
+    以及首字节、首个回复片段等时间点。
+
+    返回:
+        {"traceEvents": [...], "displayTimeUnit": "ms"}
+    """
+    trace_events = []
+    for tid, trace in enumerate(traces, 1):
+        base = trace.get("started_at", 0) * 1e6
+
+        def complete(name, category, start, duration, args=None):
+            trace_events.append({
+                "name": name, "cat": category, "ph": "X", "pid": 1, "tid": tid,
+                "ts": base + start * 1e6, "dur": duration * 1e6, "args": args or {}
+            })
+
+        trace_events.append({
+            "name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+            "args": {"name": f"run {tid}"}
+        })
+        if trace.get("total") is not None:
+            complete("request", "request", 0, trace["total"], {
+                "server_latency": trace.get("server_latency"),
+                "client_overhead": trace.get("client_overhead")
+            })
+        if trace.get("connect") is not None:
+            complete("connect", "request", 0, trace["connect"])
+
+        span = workflow_span(trace)
+        if span:
+            complete("workflow", "workflow", span["start"], span["duration"])
+        for span in node_spans(trace):
+            complete(span["title"] or span["node_id"], span["node_type"] or "node",
+                     span["start"], span["duration"],
+                     {"node_id": span["node_id"], "status": span["status"]})
+
+        for name in ("first_byte", "first_message", "message_end"):
+            if trace.get(name) is not None:
+                trace_events.append({
+                    "name": name, "cat": "mark", "ph": "i", "s": "t", "pid": 1, "tid": tid,
+                    "ts": base + trace[name] * 1e6
+                })
+
+    return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(traces, path):
+    """把计时结果写入 Chrome trace-event 格式的 JSON 文件"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_chrome_trace(traces), f, ensure_ascii=False)
+
+
+def print_node_summary(stats):
+    """打印各节点的延迟汇总"""
+    print("=" * 60)
+    print(f"工作流节点延迟（{stats.runs} 次运行）")
+    print("=" * 60)
+    for (node_type, title), summary in stats.summary().items():
+        print(format_summary(f"{title} ({node_type})", summary, "毫秒", 1000))
+        print(f"  平均: {summary['mean'] * 1000:.3f} 毫秒, 累计: {summary['total']:.3f}秒")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="汇总流式对话的计时结果")
+    parser.add_argument("path", help="write_jsonl 写入的 JSONL 文件")
+    parser.add_argument("--chrome", default=None, help="导出 Chrome trace-event 格式的文件路径")
+    parser.add_argument("--prometheus", action="store_true", help="打印 Prometheus 文本格式")
+    args = parser.parse_args()
+
+    traces = read_jsonl(args.path)
+    stats = NodeLatencyStats()
+    for trace in traces:
+        stats.add(trace)
+    print_node_summary(stats)
+
+    if args.prometheus:
+        print(to_prometheus(traces), end="")
+        print(stats.to_prometheus(), end="")
+    if args.chrome:
+        write_chrome_trace(traces, args.chrome)
+        print(f"Chrome trace 已写入: {args.chrome}")
@@ -0,0 +1,607 @@
+"""
+本地模拟 Dify 服务器
+提供 /datasets/{id}/retrieve 和 /chat-messages，用于离线压测和基准测试
+
+用法:
+    python mock_dify_server.py --port 8080 --latency 0.2 --token-rate 50
+
+    # 让脚本指向模拟服务器
+    export DIFY_API_BASE_URL=http://127.0.0.1:8080/v1
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import uuid
+
+from aiohttp import web
+
+# 用于生成回复和段落内容的示例文本
+SAMPLE_TEXT = (
+    "人工智能是计算机科学的一个分支，它试图理解智能的实质，"
+    "并生产出一种新的能以人类智能相似的方式做出反应的智能机器。"
+    "该领域的研究包括机器人、语言识别、图像识别、自然语言处理和专家系统等。"
+)
+
+# 不同检索方式的排序扰动程度（见 MockDifyServer._rank）
+SEARCH_METHOD_NOISE = {
+    "semantic_search": 1.5,
+    "hybrid_search": 1.0,
+    "full_text_search": 3.0,
+    "keyword_search": 4.0
+}
+
+
+class MockConfig:
+    """
+    模拟服务器配置
+
+    参数:
+        latency: 首字节前的固定延迟（秒），阻塞模式下为整体额外延迟
+        latency_jitter: 延迟的随机抖动（秒，均匀分布 0 ~ jitter）
+        slow_rate: 请求落入长尾的概率
+        slow_latency: 长尾请求额外增加的延迟（秒）
+        token_rate: 流式模式每秒输出的 token 数，0 表示不限速
+        answer_tokens: 每次回复的 token 数
+        token_size: 每个 token 的字符数
+        records: 检索返回的记录数（不超过请求中的 top_k）
+        segment_size: 每条记录的内容长度（字符）
+        error_rate: 返回 500 的概率
+        rate_limit_rate: 返回 429 的概率
+        retry_after: 429 响应中的 Retry-After（秒）
+        stream_error_rate: 流式输出中途发送 error 事件的概率
+        workflow: 是否发送 workflow_started / node_* / workflow_finished 事件
+        ping_interval: 流式模式下 ping 事件的间隔（秒），0 表示不发送
+        bandwidth: 检索响应的发送速率（字节/秒），0 表示一次性发送
+        rerank_latency: 检索启用重排序时额外增加的延迟（秒）
+        context_latency: 每 1000 个提示词 token 增加的首 token 延迟（秒），
+                         同一会话的历史消息计入提示词，用于模拟上下文变长后的预填充耗时
+        stall_rate: 流式输出中途停顿的概率（停顿期间不发送 message 事件，只按 ping_interval 发送 ping）
+        stall_duration: 停顿持续时间（秒）
+    """
+
+    def __init__(self, latency=0.0, latency_jitter=0.0, slow_rate=0.0, slow_latency=0.0, token_rate=0.0, answer_tokens=50, token_size=2,
+                 records=3, segment_size=200, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1, stream_error_rate=0.0, workflow=True, ping_interval=0.0,
+                 bandwidth=0.0, rerank_latency=0.0, context_latency=0.0, stall_rate=0.0, stall_duration=30.0):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.token_rate = token_rate
+        self.answer_tokens = answer_tokens
+        self.token_size = token_size
+        self.records = records
+        self.segment_size = segment_size
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stream_error_rate = stream_error_rate
+        self.workflow = workflow
+        self.ping_interval = ping_interval
+        self.bandwidth = bandwidth
+        self.rerank_latency = rerank_latency
+        self.context_latency = context_latency
+        self.stall_rate = stall_rate
+        self.stall_duration = stall_duration
+
+
+def sample_text(length, offset=0):
+    """从示例文本中截取指定长度的内容"""
+    repeat = length // len(SAMPLE_TEXT) + 2
+    text = SAMPLE_TEXT * repeat
+    start = offset % len(SAMPLE_TEXT)
+    return text[start:start + length]
+
+
+def error_response(status, code, message, headers=None):
+    """Dify 格式的错误响应"""
+    return web.json_response(
+        {"code": code, "message": message, "status": status},
+        status=status,
+        headers=headers
+    )
+
+
+class MockDifyServer:
+    """
+    模拟 Dify API 的 aiohttp 应用
+
+    参数:
+        config: MockConfig 实例
+    """
+
+    def __init__(self, config=None):
+        self.config = config or MockConfig()
+        self.request_count = 0
+        self.tokens_sent = 0
+        self.stopped_tasks = set()
+        self.history_tokens = {}
+
+    def create_app(self, prefix="/v1"):
+        """创建 aiohttp 应用，路由同时挂在 prefix 下和根路径下"""
+        app = web.Application()
+        for base in {prefix.rstrip("/"), ""}:
+            app.router.add_post(f"{base}/datasets/{{dataset_id}}/retrieve", self.handle_retrieve)
+            app.router.add_post(f"{base}/chat-messages", self.handle_chat_messages)
+            app.router.add_post(f"{base}/chat-messages/{{task_id}}/stop", self.handle_stop)
+        return app
+
+    async def _delay(self):
+        config = self.config
+        delay = config.latency + random.uniform(0, config.latency_jitter)
+        if random.random() < config.slow_rate:
+            delay += config.slow_latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _inject_error(self):
+        """按配置的概率返回 429 / 500 错误响应，否则返回 None"""
+        config = self.config
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            return error_response(
+                429, "too_many_requests", "Too many requests",
+                headers={"Retry-After": str(config.retry_after)}
+            )
+        if roll < config.rate_limit_rate + config.error_rate:
+            return error_response(500, "internal_server_error", "Internal server error")
+        return None
+
+    def _rank(self, query, retrieval_model, count):
+        """
+        模拟不同检索方式的排序结果，返回 [(分段序号, 分数), ...]
+
+        未指定 search_method 时按序号排列；指定时在 2 倍候选中按检索方式加入
+        不同程度的随机扰动（同一查询和配置的结果固定），重排序会减小扰动，
+        不同检索方式的结果因此部分重叠，分数分布也不同。
+        """
+        search_method = retrieval_model.get("search_method")
+        if not search_method:
+            return [(i, round(0.95 - i * 0.05, 4)) for i in range(count)]
+
+        rerank = bool(retrieval_model.get("reranking_enable"))
+        rng = random.Random(f"{query}/{search_method}/{rerank}")
+        noise = SEARCH_METHOD_NOISE.get(search_method, 2.0) * (0.5 if rerank else 1.0)
+        candidates = sorted(range(count * 2), key=lambda i: i + rng.gauss(0, noise))[:count]
+
+        ranked = []
+        for rank, i in enumerate(candidates):
+            if rerank:
+                score = 0.99 * math.exp(-rank / 3)
+            elif search_method == "full_text_search" or search_method == "keyword_search":
+                score = 0.8 * math.exp(-rank / 2) + rng.uniform(0, 0.05)
+            else:
+                score = 0.9 - rank * 0.03 + rng.uniform(-0.02, 0.02)
+            ranked.append((i, round(score, 4)))
+        if retrieval_model.get("score_threshold_enabled"):
+            threshold = retrieval_model.get("score_threshold") or 0.0
+            ranked = [(i, score) for i, score in ranked if score >= threshold]
+        return ranked
+
+    def _make_records(self, dataset_id, query, ranked):
+        records = []
+        for i, score in ranked:
+            content = sample_text(self.config.segment_size, offset=i * 7)
+            document_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{dataset_id}/{i}"))
+            records.append({
+                "segment": {
+                    "id": str(uuid.uuid5(uuid.NAMESPACE_URL, f"{dataset_id}/{query}/{i}")),
+                    "position": i + 1,
+                    "document_id": document_id,
+                    "content": content,
+                    "word_count": len(content),
+                    "tokens": len(content) // 2,
+                    "keywords": ["人工智能", "机器学习"],
+                    "index_node_id": str(uuid.uuid4()),
+                    "index_node_hash": uuid.uuid4().hex,
+                    "hit_count": 0,
+                    "enabled": True,
+                    "status": "completed",
+                    "created_at": int(time.time()),
+                    "document": {
+                        "id": document_id,
+                        "data_source_type": "upload_file",
+                        "name": f"文档{i + 1}.md"
+                    }
+                },
+                "score": score
+            })
+        return records
+
+    async def handle_retrieve(self, request):
+        """POST /datasets/{dataset_id}/retrieve"""
+        self.request_count += 1
+        payload = await request.json()
+        await self._delay()
+
+        error = self._inject_error()
+        if error is not None:
+            return error
+
+        dataset_id = request.match_info["dataset_id"]
+        query = payload.get("query", "")
+        retrieval_model = payload.get("retrieval_model") or {}
+        top_k = retrieval_model.get("top_k", self.config.records)
+        if retrieval_model.get("reranking_enable") and self.config.rerank_latency:
+            await asyncio.sleep(self.config.rerank_latency)
+        ranked = self._rank(query, retrieval_model, min(self.config.records, top_k))
+        result = {
+            "query": {"content": query},
+            "records": self._make_records(dataset_id, query, ranked)
+        }
+        if not self.config.bandwidth:
+            return web.json_response(result)
+
+        # 按带宽限制分块发送，模拟大响应在网络上的传输时间
+        body = json.dumps(result).encode("utf-8")
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        response.content_length = len(body)
+        await response.prepare(request)
+        piece_size = 16384
+        for offset in range(0, len(body), piece_size):
+            await response.write(body[offset:offset + piece_size])
+            await asyncio.sleep(piece_size / self.config.bandwidth)
+        await response.write_eof()
+        return response
+
+    def _prompt_tokens(self, query, conversation_id):
+        """提示词 token 数：系统提示词 + 会话历史 + 本轮查询"""
+        return 100 + self.history_tokens.get(conversation_id, 0) + len(query)
+
+    def _remember(self, query, conversation_id, completion_tokens):
+        """把本轮的查询和回复计入会话历史"""
+        self.history_tokens[conversation_id] = (
+            self.history_tokens.get(conversation_id, 0) + len(query) + completion_tokens
+        )
+
+    def _usage(self, query, completion_tokens, latency, conversation_id=None):
+        prompt_tokens = self._prompt_tokens(query, conversation_id)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "prompt_unit_price": "0.001",
+            "prompt_price_unit": "0.001",
+            "prompt_price": f"{prompt_tokens * 0.000001:.7f}",
+            "completion_tokens": completion_tokens,
+            "completion_unit_price": "0.002",
+            "completion_price_unit": "0.001",
+            "completion_price": f"{completion_tokens * 0.000002:.7f}",
+            "total_tokens": prompt_tokens + completion_tokens,
+            "total_price": f"{prompt_tokens * 0.000001 + completion_tokens * 0.000002:.7f}",
+            "currency": "USD",
+            "latency": latency
+        }
+
+    def _retriever_resources(self, query):
+        resources = []
+        for i, record in enumerate(self._make_records("mock-dataset", query, self._rank(query, {}, self.config.records))):
+            segment = record["segment"]
+            resources.append({
+                "position": i + 1,
+                "dataset_id": "mock-dataset",
+                "dataset_name": "模拟知识库",
+                "document_id": segment["document_id"],
+                "document_name": segment["document"]["name"],
+                "segment_id": segment["id"],
+                "score": record["score"],
+                "content": segment["content"]
+            })
+        return resources
+
+    async def handle_chat_messages(self, request):
+        """POST /chat-messages"""
+        self.request_count += 1
+        payload = await request.json()
+        start_time = time.time()
+        await self._delay()
+
+        error = self._inject_error()
+        if error is not None:
+            return error
+
+        query = payload.get("query", "")
+        ids = {
+            "task_id": str(uuid.uuid4()),
+            "message_id": str(uuid.uuid4()),
+            "conversation_id": payload.get("conversation_id") or str(uuid.uuid4())
+        }
+        if self.config.context_latency:
+            prompt_tokens = self._prompt_tokens(query, ids["conversation_id"])
+            await asyncio.sleep(prompt_tokens / 1000 * self.config.context_latency)
+
+        if payload.get("response_mode") == "streaming":
+            return await self._stream_chat(request, query, ids, start_time)
+
+        token_size = self.config.token_size
+        tokens = [sample_text(token_size, offset=i * token_size) for i in range(self.config.answer_tokens)]
+        if self.config.token_rate > 0:
+            await asyncio.sleep(len(tokens) / self.config.token_rate)
+        usage = self._usage(query, len(tokens), time.time() - start_time, ids["conversation_id"])
+        self._remember(query, ids["conversation_id"], len(tokens))
+        return web.json_response({
+            "event": "message",
+            "task_id": ids["task_id"],
+            "id": ids["message_id"],
+            "message_id": ids["message_id"],
+            "conversation_id": ids["conversation_id"],
+            "mode": "chat",
+            "answer": "".join(tokens),
+            "metadata": {
+                "usage": usage,
+                "retriever_resources": self._retriever_resources(query)
+            },
+            "created_at": int(start_time)
+        })
+
+    async def handle_stop(self, request):
+        """POST /chat-messages/{task_id}/stop"""
+        self.request_count += 1
+        self.stopped_tasks.add(request.match_info["task_id"])
+        return web.json_response({"result": "success"})
+
+    async def _stream_chat(self, request, query, ids, start_time):
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache"
+        })
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+
+        async def send(data):
+            body = json.dumps(data, ensure_ascii=False)
+            await response.write(f"data: {body}\n\n".encode("utf-8"))
+
+        try:
+            await self._send_chat_events(request, response, send, query, ids, start_time)
+            await response.write_eof()
+        except ConnectionResetError:
+            # 客户端取消或提前停止时会直接断开连接
+            pass
+        return response
+
+    async def _send_chat_events(self, request, response, send, query, ids, start_time):
+        config = self.config
+        workflow_run_id = str(uuid.uuid4())
+        base = {"task_id": ids["task_id"], "workflow_run_id": workflow_run_id}
+        nodes = [
+            ("start", "开始"),
+            ("knowledge-retrieval", "知识检索"),
+            ("llm", "LLM"),
+            ("answer", "直接回复")
+        ]
+
+        if config.workflow:
+            await send({**base, "event": "workflow_started", "data": {
+                "id": workflow_run_id, "workflow_id": "mock-workflow",
+                "sequence_number": 1, "created_at": int(time.time())
+            }})
+            # llm 节点之前的节点立即完成
+            for index, (node_type, title) in enumerate(nodes[:2], 1):
+                await self._send_node(send, base, index, node_type, title)
+            llm_node = await self._send_node_started(send, base, 3, *nodes[2])
+
+        stream_error_at = None
+        if random.random() < config.stream_error_rate:
+            stream_error_at = random.randrange(max(config.answer_tokens, 1))
+        stall_at = None
+        if random.random() < config.stall_rate:
+            stall_at = random.randrange(max(config.answer_tokens, 1))
+
+        token_start = time.monotonic()
+        last_ping = token_start
+        completion_tokens = config.answer_tokens
+        for i in range(config.answer_tokens):
+            if ids["task_id"] in self.stopped_tasks:
+                # 收到停止请求后不再生成，与 Dify 一样以 message_end 结束
+                completion_tokens = i
+                break
+
+            if i == stream_error_at:
+                await send({
+                    "event": "error", "task_id": ids["task_id"], "message_id": ids["message_id"],
+                    "status": 500, "code": "internal_server_error", "message": "Mock stream error"
+                })
+                return
+
+            if i == stall_at:
+                await self._stall(request, response)
+                token_start += config.stall_duration
+
+            if config.token_rate > 0:
+                # 按计划时间输出，避免每个 token 的 sleep 误差累积
+                delay = token_start + i / config.token_rate - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            now = time.monotonic()
+            if config.ping_interval and now - last_ping >= config.ping_interval:
+                await response.write(b"event: ping\n\n")
+                last_ping = now
+
+            await send({
+                "event": "message", "task_id": ids["task_id"], "id": ids["message_id"],
+                "message_id": ids["message_id"], "conversation_id": ids["conversation_id"],
+                "answer": sample_text(config.token_size, offset=i * config.token_size),
+                "created_at": int(start_time)
+            })
+            self.tokens_sent += 1
+
+        if config.workflow:
+            await self._send_node_finished(send, base, llm_node)
+            await self._send_node(send, base, 4, *nodes[3])
+            await send({**base, "event": "workflow_finished", "data": {
+                "id": workflow_run_id, "workflow_id": "mock-workflow", "status": "succeeded",
+                "outputs": {}, "error": None, "elapsed_time": time.time() - start_time,
+                "total_tokens": config.answer_tokens, "total_steps": len(nodes),
+                "created_at": int(start_time), "finished_at": int(time.time())
+            }})
+
+        usage = self._usage(query, completion_tokens, time.time() - start_time, ids["conversation_id"])
+        self._remember(query, ids["conversation_id"], completion_tokens)
+        await send({
+            "event": "message_end", "task_id": ids["task_id"], "id": ids["message_id"],
+            "message_id": ids["message_id"], "conversation_id": ids["conversation_id"],
+            "metadata": {
+                "usage": usage,
+                "retriever_resources": self._retriever_resources(query)
+            }
+        })
+
+    async def _stall(self, request, response):
+        """模拟生成卡住：连接保持打开，只按 ping_interval 发送 ping，客户端断开时提前结束"""
+        config = self.config
+        stall_start = time.monotonic()
+        last_ping = stall_start
+        while time.monotonic() - stall_start < config.stall_duration:
+            if request.transport is None or request.transport.is_closing():
+                raise ConnectionResetError("客户端已断开")
+            await asyncio.sleep(0.05)
+            if config.ping_interval and time.monotonic() - last_ping >= config.ping_interval:
+                await response.write(b"event: ping\n\n")
+                last_ping = time.monotonic()
+
+    async def _send_node_started(self, send, base, index, node_type, title):
+        node = {
+            "id": str(uuid.uuid4()), "node_id": f"node-{index}", "node_type": node_type,
+            "title": title, "index": index, "predecessor_node_id": f"node-{index - 1}" if index > 1 else None,
+            "started": time.time()
+        }
+        await send({**base, "event": "node_started", "data": {
+            "id": node["id"], "node_id": node["node_id"], "node_type": node_type, "title": title,
+            "index": index, "predecessor_node_id": node["predecessor_node_id"],
+            "inputs": {}, "created_at": int(node["started"])
+        }})
+        return node
+
+    async def _send_node_finished(self, send, base, node):
+        await send({**base, "event": "node_finished", "data": {
+            "id": node["id"], "node_id": node["node_id"], "node_type": node["node_type"],
+            "title": node["title"], "index": node["index"], "predecessor_node_id": node["predecessor_node_id"],
+            "inputs": {}, "process_data": None, "outputs": {}, "status": "succeeded", "error": None,
+            "elapsed_time": time.time() - node["started"], "execution_metadata": {},
+            "created_at": int(node["started"])
+        }})
+
+    async def _send_node(self, send, base, index, node_type, title):
+        node = await self._send_node_started(send, base, index, node_type, title)
+        await self._send_node_finished(send, base, node)
+
+
+class MockServerThread:
+    """
+    在后台线程中运行模拟服务器，便于在基准测试脚本中直接启动
+
+    用法:
+        server = MockServerThread(MockConfig(token_rate=100)).start()
+        client = DifyClient("test-key", server.base_url)
+        ...
+        server.stop()
+
+    参数:
+        config: MockConfig 实例
+        host: 监听地址
+        port: 监听端口，0 表示自动选择空闲端口
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.server = MockDifyServer(config)
+        self.host = host
+        self.port = port
+        self.base_url = None
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def start(self):
+        """启动服务器，返回自身"""
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._start())
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    async def _start(self):
+        self._runner = web.AppRunner(self.server.create_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        self.base_url = f"http://{self.host}:{self.port}/v1"
+
+    def stop(self):
+        """停止服务器"""
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="本地模拟 Dify 服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="首字节前的延迟（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="延迟随机抖动（秒）")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="长尾请求的概率")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="长尾请求额外延迟（秒）")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="每秒输出的 token 数，0 表示不限速")
+    parser.add_argument("--answer-tokens", type=int, default=50, help="每次回复的 token 数")
+    parser.add_argument("--token-size", type=int, default=2, help="每个 token 的字符数")
+    parser.add_argument("--records", type=int, default=3, help="检索返回的记录数")
+    parser.add_argument("--segment-size", type=int, default=200, help="每条记录的内容长度（字符）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--stream-error-rate", type=float, default=0.0, help="流式输出中途报错的概率")
+    parser.add_argument("--no-workflow", action="store_true", help="不发送 workflow / node 事件")
+    parser.add_argument("--ping-interval", type=float, default=0.0, help="ping 事件间隔（秒）")
+    parser.add_argument("--rerank-latency", type=float, default=0.0, help="重排序额外延迟（秒）")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="检索响应发送速率（字节/秒），0 表示不限速")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="流式输出中途停顿的概率")
+    parser.add_argument("--stall-duration", type=float, default=30.0, help="停顿持续时间（秒）")
+    parser.add_argument("--context-latency", type=float, default=0.0,
+                        help="每 1000 个提示词 token（含会话历史）增加的首 token 延迟（秒）")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = MockConfig(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        slow_rate=args.slow_rate,
+        slow_latency=args.slow_latency,
+        token_rate=args.token_rate,
+        answer_tokens=args.answer_tokens,
+        token_size=args.token_size,
+        records=args.records,
+        segment_size=args.segment_size,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        stream_error_rate=args.stream_error_rate,
+        workflow=not args.no_workflow,
+        ping_interval=args.ping_interval,
+        bandwidth=args.bandwidth,
+        rerank_latency=args.rerank_latency,
+        context_latency=args.context_latency,
+        stall_rate=args.stall_rate,
+        stall_duration=args.stall_duration
+    )
+    print("=" * 60)
+    print("模拟 Dify 服务器")
+    print("=" * 60)
+    print(f"API基础URL: http://{args.host}:{args.port}/v1")
+    print("=" * 60)
+    web.run_app(MockDifyServer(config).create_app(), host=args.host, port=args.port, print=None)
@@ -3,16 +3,142 @@ Dify 聊天消息 API 完整测试脚本
 支持阻塞模式和流式模式
 """
 
-import requests
 import json
+import os
+import threading
 import time
 
+from dify_answer import AnswerBuffer, TerminalSink
+from dify_cache import iter_cached_sse
+from dify_cancel import DEADLINE, CancellationToken, abort_response
+from dify_client import get_shared_client
+from dify_deadline import DEFAULT_STALL_TIMEOUT, Deadline, get_watchdog
+from dify_errors import DifyAPIError, DifyTimeoutError, StreamError
+from dify_sse import iter_sse_events
+from dify_trace import StreamTrace
+
 # API 配置
-API_BASE_URL = "https://api.dify.ai/v1"
+API_BASE_URL = os.getenv("DIFY_API_BASE_URL", "https://api.dify.ai/v1")
 API_KEY = "xxx"
 
+# 流式响应超时后调用停止接口的时间上限（秒），不占用已经用完的截止时间
+STOP_DEADLINE = 5
+
+
+def print_chat_result(result, elapsed_time):
+    """打印阻塞模式的响应结果"""
+    print("✓ 请求成功!")
+    print(f"耗时: {elapsed_time:.2f}秒\n")
+    
+    # 基本信息
+    print(f"事件类型: {result.get('event', 'N/A')}")
+    print(f"任务ID: {result.get('task_id', 'N/A')}")
+    print(f"消息ID: {result.get('message_id', 'N/A')}")
+    print(f"会话ID: {result.get('conversation_id', 'N/A')}")
+    print(f"模式: {result.get('mode', 'N/A')}")
+    print("-" * 60)
+    
+    # AI 回复
+    print(f"\n【AI 回复】")
+    answer = result.get('answer', '')
+    print(answer)
+    print()
+    
+    # 元数据和使用统计
+    metadata = result.get('metadata', {})
+    usage = metadata.get('usage', {})
+    
+    if usage:
+        print("-" * 60)
+        print(f"Token 使用情况:")
+        print(f"  - 提示词 tokens: {usage.get('prompt_tokens', 0)}")
+        print(f"  - 回复 tokens: {usage.get('completion_tokens', 0)}")
+        print(f"  - 总计 tokens: {usage.get('total_tokens', 0)}")
+        print(f"  - 提示词价格: {usage.get('prompt_price', 0)} {usage.get('currency', 'USD')}")
+        print(f"  - 回复价格: {usage.get('completion_price', 0)} {usage.get('currency', 'USD')}")
+        print(f"  - 总费用: {usage.get('total_price', 0)} {usage.get('currency', 'USD')}")
+        print(f"  - 延迟: {usage.get('latency', 0):.2f}秒")
+    
+    # 检索资源（如果有）
+    retriever_resources = metadata.get('retriever_resources', [])
+    if retriever_resources:
+        print(f"\n引用资源数量: {len(retriever_resources)}")
+        for idx, resource in enumerate(retriever_resources, 1):
+            print(f"\n【资源 {idx}】")
+            print(f"  位置: {resource.get('position', 'N/A')}")
+            print(f"  数据集: {resource.get('dataset_name', 'N/A')}")
+            print(f"  文档: {resource.get('document_name', 'N/A')}")
+            print(f"  相关度: {resource.get('score', 0):.4f}")
+            content = resource.get('content', '')
+            print(f"  内容预览: {content[:100]}..." if len(content) > 100 else f"  内容: {content}")
+    
+    print("-" * 60)
+
+
+def print_stream_summary(result, elapsed_time):
+    """打印流式模式的统计信息"""
+    print("-" * 60)
+    print(f"任务ID: {result['task_id']}")
+    print(f"消息ID: {result['message_id']}")
+    print(f"会话ID: {result['conversation_id']}")
+    print(f"总耗时: {elapsed_time:.2f}秒")
+    if result.get('stopped'):
+        print(f"提前停止: {result['stopped']}")
+    if result.get('invalid_events'):
+        print(f"无法解析的事件: {result['invalid_events']} 个")
+    
+    # 显示计时信息
+    trace = result.get('trace')
+    if trace:
+        print(f"收到响应头: {trace['connect']:.3f}秒")
+        if trace['first_byte'] is not None:
+            print(f"首字节: {trace['first_byte']:.3f}秒")
+        if trace['first_message'] is not None:
+            print(f"首个回复片段: {trace['first_message']:.3f}秒")
+        if trace['client_overhead'] is not None:
+            print(f"服务器延迟: {trace['server_latency']:.3f}秒, 网络及排队: {trace['client_overhead']:.3f}秒")
+    
+    # 显示元数据
+    metadata = result['metadata']
+    if metadata:
+        usage = metadata.get('usage', {})
+        if usage:
+            print("-" * 60)
+            print(f"Token 使用情况:")
+            print(f"  - 提示词 tokens: {usage.get('prompt_tokens', 0)}")
+            print(f"  - 回复 tokens: {usage.get('completion_tokens', 0)}")
+            print(f"  - 总计 tokens: {usage.get('total_tokens', 0)}")
+            print(f"  - 总费用: {usage.get('total_price', 0)} {usage.get('currency', 'USD')}")
+            print(f"  - 延迟: {usage.get('latency', 0):.2f}秒")
+        
+        # 检索资源
+        retriever_resources = metadata.get('retriever_resources', [])
+        if retriever_resources:
+            print(f"\n引用资源数量: {len(retriever_resources)}")
+            for idx, resource in enumerate(retriever_resources, 1):
+                print(f"\n【资源 {idx}】")
+                print(f"  数据集: {resource.get('dataset_name', 'N/A')}")
+                print(f"  文档: {resource.get('document_name', 'N/A')}")
+                print(f"  相关度: {resource.get('score', 0):.4f}")
+    
+    print("-" * 60)
+
 
-def send_chat_message_blocking(query, conversation_id=None, inputs=None, user="test-user"):
+def settle_reservation(limiter, reservation, sent, error):
+    """
+    请求失败时结算限流额度
+
+    已经收到响应（服务端开始生成）时不知道生成了多少，按预留的额度计费；
+    请求没有被服务（连接失败、熔断、重试预算用完、发送前已超过截止时间等）时退还额度。
+    """
+    if sent:
+        limiter.record(None, reservation)
+    else:
+        limiter.release(reservation, error)
+
+
+def send_chat_message_blocking(query, conversation_id=None, inputs=None, user="test-user", client=None,
+                               cache=None, limiter=None, deadline=None, verbose=True, raise_errors=False):
     """
     发送聊天消息 - 阻塞模式
     
@@ -21,16 +147,37 @@ def send_chat_message_blocking(query, conversation_id=None, inputs=None, user="t
         conversation_id: 可选，会话ID（用于继续之前的对话）
         inputs: 可选，App 定义的各变量值
         user: 用户标识
+        client: 可选，DifyClient 实例（默认使用共享的连接池客户端）
+        cache: 可选，ChatResponseCache 实例，只用于没有 conversation_id 的请求
+        limiter: 可选，RateLimiter 实例（见 dify_ratelimit.py），请求前预留额度，按 usage 结算
+        deadline: 可选，端到端截止时间（Deadline 或秒数，见 dify_deadline.py），
+                  包括限流排队、重试和读取响应体，超过时抛出 DeadlineExceededError
+        verbose: 是否打印请求和响应内容
+        raise_errors: 为 True 时请求失败抛出 dify_errors 中的异常，而不是打印后返回 None
     
     返回:
-        响应结果
+        响应结果（命中缓存时 "cached" 为 True，没有 message_id / conversation_id）
     """
-    url = f"{API_BASE_URL}/chat-messages"
+    client = client or get_shared_client(API_KEY, API_BASE_URL)
     
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # 首轮对话先查缓存
+    cache_key = None
+    if cache is not None and not conversation_id:
+        cache_key = cache.make_key(client.api_key, query, inputs, user)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            result = {
+                "event": "message",
+                "message_id": None,
+                "conversation_id": None,
+                "answer": cached["answer"],
+                "metadata": cached["metadata"],
+                "cached": True
+            }
+            if verbose:
+                print(f"✓ 命中缓存: {query}")
+                print_chat_result(result, 0.0)
+            return result
     
     # 构建请求体
     payload = {
@@ -44,76 +191,100 @@ def send_chat_message_blocking(query, conversation_id=None, inputs=None, user="t
     if conversation_id:
         payload["conversation_id"] = conversation_id
     
+    reservation = None
+    sent = False
     try:
-        print(f"正在发送消息: {query}")
-        print(f"请求模式: 阻塞模式")
-        print("-" * 60)
+        if verbose:
+            print(f"正在发送消息: {query}")
+            print(f"请求模式: 阻塞模式")
+            print("-" * 60)
         
         start_time = time.time()
-        response = requests.post(url, headers=headers, json=payload)
+        deadline = Deadline.of(deadline)
+        if limiter is not None:
+            reservation = limiter.acquire(deadline=deadline)
+        response = client.request("/chat-messages", payload, deadline=deadline)
+        sent = True
+        result = response.json()
         elapsed_time = time.time() - start_time
+        if reservation is not None:
+            limiter.record((result.get("metadata") or {}).get("usage"), reservation)
+            reservation = None
         
-        if response.status_code == 200:
-            result = response.json()
-            print("✓ 请求成功!")
-            print(f"耗时: {elapsed_time:.2f}秒\n")
-            
-            # 基本信息
-            print(f"事件类型: {result.get('event', 'N/A')}")
-            print(f"任务ID: {result.get('task_id', 'N/A')}")
-            print(f"消息ID: {result.get('message_id', 'N/A')}")
-            print(f"会话ID: {result.get('conversation_id', 'N/A')}")
-            print(f"模式: {result.get('mode', 'N/A')}")
-            print("-" * 60)
-            
-            # AI 回复
-            print(f"\n【AI 回复】")
-            answer = result.get('answer', '')
-            print(answer)
-            print()
-            
-            # 元数据和使用统计
-            metadata = result.get('metadata', {})
-            usage = metadata.get('usage', {})
-            
-            if usage:
-                print("-" * 60)
-                print(f"Token 使用情况:")
-                print(f"  - 提示词 tokens: {usage.get('prompt_tokens', 0)}")
-                print(f"  - 回复 tokens: {usage.get('completion_tokens', 0)}")
-                print(f"  - 总计 tokens: {usage.get('total_tokens', 0)}")
-                print(f"  - 提示词价格: {usage.get('prompt_price', 0)} {usage.get('currency', 'USD')}")
-                print(f"  - 回复价格: {usage.get('completion_price', 0)} {usage.get('currency', 'USD')}")
-                print(f"  - 总费用: {usage.get('total_price', 0)} {usage.get('currency', 'USD')}")
-                print(f"  - 延迟: {usage.get('latency', 0):.2f}秒")
-            
-            # 检索资源（如果有）
-            retriever_resources = metadata.get('retriever_resources', [])
-            if retriever_resources:
-                print(f"\n引用资源数量: {len(retriever_resources)}")
-                for idx, resource in enumerate(retriever_resources, 1):
-                    print(f"\n【资源 {idx}】")
-                    print(f"  位置: {resource.get('position', 'N/A')}")
-                    print(f"  数据集: {resource.get('dataset_name', 'N/A')}")
-                    print(f"  文档: {resource.get('document_name', 'N/A')}")
-                    print(f"  相关度: {resource.get('score', 0):.4f}")
-                    content = resource.get('content', '')
-                    print(f"  内容预览: {content[:100]}..." if len(content) > 100 else f"  内容: {content}")
-            
-            print("-" * 60)
-            return result
-        else:
-            print(f"✗ 请求失败!")
-            print(f"状态码: {response.status_code}")
-            print(f"错误信息: {response.text}")
-            return None
+        if cache_key is not None:
+            cache.set(cache_key, result.get("answer", ""), result.get("metadata"))
+        if verbose:
+            print_chat_result(result, elapsed_time)
+        return result
+    
+    except DifyAPIError as e:
+        if reservation is not None:
+            limiter.release(reservation, e)
+        if raise_errors:
+            raise
+        print(f"✗ 请求失败!")
+        print(f"状态码: {e.status}")
+        print(f"错误信息: {e.body}")
+        return None
+    
+    except DifyTimeoutError as e:
+        if reservation is not None:
+            settle_reservation(limiter, reservation, sent, e)
+        if raise_errors:
+            raise
+        print(f"✗ 请求超时: {e}")
+        return None
             
     except Exception as e:
+        if reservation is not None:
+            settle_reservation(limiter, reservation, sent, e)
+        if raise_errors:
+            raise
+        print(f"✗ 发生异常: {str(e)}")
+        return None
+
+
+def stop_chat_message(task_id, user="test-user", client=None, deadline=None, verbose=True, raise_errors=False):
+    """
+    停止正在进行的流式生成
+    
+    参数:
+        task_id: 任务ID（流式响应的任意事件中都带有 task_id）
+        user: 用户标识，必须与发送消息时一致
+        client: 可选，DifyClient 实例（默认使用共享的连接池客户端）
+        deadline: 可选，截止时间（Deadline 或秒数）
+        verbose: 是否打印结果
+        raise_errors: 为 True 时请求失败抛出 dify_errors 中的异常，而不是打印后返回 None
+    
+    返回:
+        响应结果，例如 {"result": "success"}
+    """
+    client = client or get_shared_client(API_KEY, API_BASE_URL)
+    try:
+        response = client.request(f"/chat-messages/{task_id}/stop", {"user": user}, deadline=deadline)
+        result = response.json()
+        if verbose:
+            print(f"✓ 已停止任务: {task_id}")
+        return result
+    
+    except DifyAPIError as e:
+        if raise_errors:
+            raise
+        print(f"✗ 停止任务失败!")
+        print(f"状态码: {e.status}")
+        print(f"错误信息: {e.body}")
+        return None
+    
+    except Exception as e:
+        if raise_errors:
+            raise
         print(f"✗ 发生异常: {str(e)}")
         return None
 
 
-def send_chat_message_streaming(query, conversation_id=None, inputs=None, user="test-user"):
+def send_chat_message_streaming(query, conversation_id=None, inputs=None, user="test-user", client=None,
+                                sinks=None, cache=None, cancel_token=None, stop=None, limiter=None,
+                                deadline=None, stall_timeout=DEFAULT_STALL_TIMEOUT, verbose=True, raise_errors=False):
     """
     发送聊天消息 - 流式模式
     
@@ -122,16 +293,37 @@ def send_chat_message_streaming(query, conversation_id=None, inputs=None, user="
         conversation_id: 可选，会话ID（用于继续之前的对话）
         inputs: 可选，App 定义的各变量值
         user: 用户标识
+        client: 可选，DifyClient 实例（默认使用共享的连接池客户端）
+        sinks: 可选，回复片段的输出目标列表（见 dify_answer.py），默认在 verbose 时输出到终端
+        cache: 可选，ChatResponseCache 实例，只用于没有 conversation_id 的请求；
+               命中时把缓存的回复作为合成的 SSE 流回放，sinks 照常收到回复片段
+        cancel_token: 可选，CancellationToken，可以在其它线程中取消本次请求
+        stop: 可选，StopConditions，满足任一条件时提前停止（见 dify_cancel.py）
+               取消或提前停止时关闭连接，并调用停止接口让服务端停止生成
+        limiter: 可选，RateLimiter 实例（见 dify_ratelimit.py），请求前预留额度，按 message_end 的 usage 结算；
+               命中缓存时不占用额度
+        deadline: 可选，端到端截止时间（Deadline 或秒数，见 dify_deadline.py），包括限流排队，直到读完最后一个事件；
+                  与 stop 中的 deadline 不同，超过时不返回部分回复，而是抛出 DeadlineExceededError
+        stall_timeout: 两次收到数据之间的最长间隔（秒），ping 事件也算收到数据；
+                  超过时抛出 StreamStalledError，None 表示不检测停顿
+               截止时间或停顿超时都会立即关闭连接（连接池名额随即释放），并调用停止接口
+        verbose: 是否打印请求、工作流事件和统计信息
+        raise_errors: 为 True 时请求失败或收到 error 事件时抛出 dify_errors 中的异常，而不是打印后返回
     
     返回:
-        响应结果
+        响应结果（"trace" 字段为逐事件计时，见 dify_trace.py；命中缓存时 "cached" 为 True；
+        "stopped" 为提前停止的原因，正常结束时为 None；"invalid_events" 为无法解析的事件数）
     """
-    url = f"{API_BASE_URL}/chat-messages"
+    client = client or get_shared_client(API_KEY, API_BASE_URL)
+    if sinks is None:
+        sinks = [TerminalSink()] if verbose else []
     
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # 首轮对话先查缓存
+    cache_key = None
+    cached = None
+    if cache is not None and not conversation_id:
+        cache_key = cache.make_key(client.api_key, query, inputs, user)
+        cached = cache.get(cache_key)
     
     # 构建请求体
     payload = {
@@ -145,138 +337,230 @@ def send_chat_message_streaming(query, conversation_id=None, inputs=None, user="
     if conversation_id:
         payload["conversation_id"] = conversation_id
     
+    reservation = None
+    sent = False
     try:
-        print(f"正在发送消息: {query}")
-        print(f"请求模式: 流式模式")
-        print("-" * 60)
+        if verbose:
+            print(f"正在发送消息: {query}")
+            print(f"请求模式: 流式模式")
+            print("-" * 60)
         
         start_time = time.time()
-        response = requests.post(url, headers=headers, json=payload, stream=True)
+        deadline = Deadline.of(deadline)
+        if limiter is not None and cached is None:
+            # 先排队再开始计时，限流排队不计入连接、首字延迟和客户端开销
+            reservation = limiter.acquire(deadline=deadline)
+        trace = StreamTrace()
+        response = None
+        watch = None
         
-        if response.status_code == 200:
-            print("✓ 连接成功，开始接收流式响应...\n")
-            print("【AI 回复】")
-            
-            full_answer = ""
-            message_id = None
-            conversation_id_result = None
-            task_id = None
-            metadata = None
-            
-            # 处理 SSE 流
-            for line in response.iter_lines():
-                if line:
-                    line_text = line.decode('utf-8')
+        # 外部取消和截止时间都通过这个令牌中断阻塞中的读取
+        token = CancellationToken(parent=cancel_token)
+        monitor = stop.monitor() if stop is not None else None
+        deadline_timer = None
+        if monitor is not None and monitor.remaining() is not None:
+            deadline_timer = threading.Timer(max(0.0, monitor.remaining()), token.cancel, args=(DEADLINE,))
+            deadline_timer.daemon = True
+            deadline_timer.start()
+        
+        if cached is not None:
+            chunks = iter_cached_sse(cached)
+            trace.mark("connect")
+            if verbose:
+                print("✓ 命中缓存，回放缓存的回复...\n")
+                print("【AI 回复】")
+        else:
+            response = client.request("/chat-messages", payload, stream=True, deadline=deadline)
+            sent = True
+            token.register(lambda reason: abort_response(response))
+            # 看门狗通过令牌中断读取，超时原因记录在 watch.reason 中
+            watch = get_watchdog().watch(token.cancel, deadline=deadline, stall_timeout=stall_timeout)
+            chunks = watch.wrap(response.iter_content(chunk_size=None))
+            trace.mark("connect")
+            if verbose:
+                print("✓ 连接成功，开始接收流式响应...\n")
+                print("【AI 回复】")
+        
+        answer = AnswerBuffer(sinks)
+        message_id = None
+        conversation_id_result = None
+        task_id = None
+        metadata = None
+        failed = False
+        stopped = None
+        invalid_events = 0
+        
+        # 处理 SSE 流
+        try:
+            for sse in iter_sse_events(trace.wrap_chunks(chunks)):
+                try:
+                    data = sse.json()
+                except json.JSONDecodeError:
+                    invalid_events += 1
+                    if verbose:
+                        print(f"\n✗ [无法解析的事件数据] {sse.data[:200]}")
+                    continue
+                
+                trace.record_event(data)
+                event = data.get('event', '')
+                if event != 'message':
+                    # 先输出缓冲中的回复片段，保证打印顺序
+                    answer.flush()
+                # 停止接口需要 task_id，所有事件中都有
+                if not task_id:
+                    task_id = data.get('task_id')
+                
+                if event == 'message':
+                    # 收到消息块
+                    chunk = data.get('answer', '')
+                    if monitor is not None:
+                        chunk, stopped = monitor.feed(chunk)
+                    answer.append(chunk)
                     
-                    # SSE 格式：data: {...}
-                    if line_text.startswith('data: '):
-                        data_str = line_text[6:]  # 去掉 "data: " 前缀
-                        
-                        try:
-                            data = json.loads(data_str)
-                            event = data.get('event', '')
-                            
-                            if event == 'message':
-                                # 收到消息块
-                                answer_chunk = data.get('answer', '')
-                                print(answer_chunk, end='', flush=True)
-                                full_answer += answer_chunk
-                                
-                                # 保存 ID 信息
-                                if not message_id:
-                                    message_id = data.get('message_id')
-                                if not conversation_id_result:
-                                    conversation_id_result = data.get('conversation_id')
-                                if not task_id:
-                                    task_id = data.get('task_id')
-                            
-                            elif event == 'message_end':
-                                # 消息结束
-                                print("\n")
-                                metadata = data.get('metadata', {})
-                                message_id = data.get('message_id') or message_id
-                                conversation_id_result = data.get('conversation_id') or conversation_id_result
-                            
-                            elif event == 'workflow_started':
-                                print(f"\n[工作流开始] workflow_run_id: {data.get('workflow_run_id')}")
-                            
-                            elif event == 'node_started':
-                                node_data = data.get('data', {})
-                                print(f"[节点开始] {node_data.get('title', 'N/A')} ({node_data.get('node_type', 'N/A')})")
-                            
-                            elif event == 'node_finished':
-                                node_data = data.get('data', {})
-                                print(f"[节点完成] {node_data.get('title', 'N/A')} - 状态: {node_data.get('status', 'N/A')}")
-                            
-                            elif event == 'workflow_finished':
-                                workflow_data = data.get('data', {})
-                                print(f"[工作流完成] 状态: {workflow_data.get('status', 'N/A')}")
-                            
-                            elif event == 'message_file':
-                                print(f"\n[文件] 类型: {data.get('type')}, URL: {data.get('url')}")
-                            
-                            elif event == 'message_replace':
-                                print(f"\n[消息替换] {data.get('answer')}")
-                                full_answer = data.get('answer', '')
-                            
-                            elif event == 'error':
-                                print(f"\n✗ [错误] {data.get('message')}")
-                            
-                            elif event == 'ping':
-                                # ping 事件，保持连接
-                                pass
-                        
-                        except json.JSONDecodeError:
-                            # 跳过无法解析的行
-                            pass
-            
-            elapsed_time = time.time() - start_time
-            
-            # 显示统计信息
-            print("-" * 60)
-            print(f"任务ID: {task_id}")
-            print(f"消息ID: {message_id}")
-            print(f"会话ID: {conversation_id_result}")
-            print(f"总耗时: {elapsed_time:.2f}秒")
-            
-            # 显示元数据
-            if metadata:
-                usage = metadata.get('usage', {})
-                if usage:
-                    print("-" * 60)
-                    print(f"Token 使用情况:")
-                    print(f"  - 提示词 tokens: {usage.get('prompt_tokens', 0)}")
-                    print(f"  - 回复 tokens: {usage.get('completion_tokens', 0)}")
-                    print(f"  - 总计 tokens: {usage.get('total_tokens', 0)}")
-                    print(f"  - 总费用: {usage.get('total_price', 0)} {usage.get('currency', 'USD')}")
-                    print(f"  - 延迟: {usage.get('latency', 0):.2f}秒")
+                    # 保存 ID 信息
+                    if not message_id:
+                        message_id = data.get('message_id')
+                    if not conversation_id_result:
+                        conversation_id_result = data.get('conversation_id')
                 
-                # 检索资源
-                retriever_resources = metadata.get('retriever_resources', [])
-                if retriever_resources:
-                    print(f"\n引用资源数量: {len(retriever_resources)}")
-                    for idx, resource in enumerate(retriever_resources, 1):
-                        print(f"\n【资源 {idx}】")
-                        print(f"  数据集: {resource.get('dataset_name', 'N/A')}")
-                        print(f"  文档: {resource.get('document_name', 'N/A')}")
-                        print(f"  相关度: {resource.get('score', 0):.4f}")
-            
-            print("-" * 60)
-            
-            return {
-                "message_id": message_id,
-                "conversation_id": conversation_id_result,
-                "task_id": task_id,
-                "answer": full_answer,
-                "metadata": metadata
-            }
-        else:
-            print(f"✗ 请求失败!")
-            print(f"状态码: {response.status_code}")
-            print(f"错误信息: {response.text}")
-            return None
+                elif event == 'message_end':
+                    # 消息结束
+                    if verbose:
+                        print("\n")
+                    metadata = data.get('metadata', {})
+                    message_id = data.get('message_id') or message_id
+                    conversation_id_result = data.get('conversation_id') or conversation_id_result
+                
+                elif event == 'workflow_started':
+                    if verbose:
+                        print(f"\n[工作流开始] workflow_run_id: {data.get('workflow_run_id')}")
+                
+                elif event == 'node_started':
+                    node_data = data.get('data', {})
+                    if verbose:
+                        print(f"[节点开始] {node_data.get('title', 'N/A')} ({node_data.get('node_type', 'N/A')})")
+                
+                elif event == 'node_finished':
+                    node_data = data.get('data', {})
+                    if verbose:
+                        print(f"[节点完成] {node_data.get('title', 'N/A')} - 状态: {node_data.get('status', 'N/A')}")
+                
+                elif event == 'workflow_finished':
+                    workflow_data = data.get('data', {})
+                    if verbose:
+                        print(f"[工作流完成] 状态: {workflow_data.get('status', 'N/A')}")
+                
+                elif event == 'message_file':
+                    if verbose:
+                        print(f"\n[文件] 类型: {data.get('type')}, URL: {data.get('url')}")
+                
+                elif event == 'message_replace':
+                    replacement = data.get('answer', '')
+                    if monitor is not None:
+                        # 被替换掉的文本不再计入停止条件，替换后的回复重新检查
+                        monitor.reset()
+                        replacement, stopped = monitor.feed(replacement)
+                    answer.replace(replacement)
+                
+                elif event == 'error':
+                    failed = True
+                    if raise_errors:
+                        raise StreamError(data.get('message'), data.get('status'), data.get('code'))
+                    print(f"\n✗ [错误] {data.get('message')}")
+                
+                elif event == 'ping':
+                    # ping 事件，保持连接
+                    pass
+                
+                if stopped is None and token.cancelled:
+                    stopped = token.reason
+                if stopped is not None:
+                    break
+        except Exception:
+            # 取消时中断读取会使连接上的读取抛出异常
+            if not token.cancelled:
+                raise
+            stopped = stopped or token.reason
+        finally:
+            if deadline_timer is not None:
+                deadline_timer.cancel()
+            if watch is not None:
+                watch.close()
+            token.detach()
+            if response is not None:
+                # 读取中途抛出异常（例如 raise_errors 时的 StreamError）也要关闭连接，不能留在连接池之外
+                response.close()
+        
+        if watch is not None and watch.reason is not None:
+            # 截止时间或停顿超时：连接已经关闭，让服务端停止生成后抛出超时异常
+            answer.close()
+            if verbose:
+                print(f"\n\n[超时] 原因: {watch.reason}")
+            if task_id:
+                stop_chat_message(task_id, user=user, client=client, deadline=STOP_DEADLINE, verbose=verbose)
+            raise watch.error()
+        
+        if stopped is None and monitor is not None:
+            answer.append(monitor.flush())
+        if stopped is not None:
+            # 关闭连接，并让服务端停止生成
+            token.cancel(stopped)
+            answer.flush()
+            if verbose:
+                print(f"\n\n[已停止] 原因: {stopped}")
+            if task_id:
+                stop_chat_message(task_id, user=user, client=client, verbose=verbose)
+        
+        answer.close()
+        elapsed_time = time.time() - start_time
+        trace.finish(None if cached is not None else (metadata or {}).get('usage'))
+        if reservation is not None:
+            # 提前停止时没有 usage，按预留的额度计费
+            limiter.record((metadata or {}).get('usage'), reservation)
+            reservation = None
+        
+        result = {
+            "message_id": message_id,
+            "conversation_id": conversation_id_result,
+            "task_id": task_id,
+            "answer": answer.getvalue(),
+            "metadata": metadata,
+            "trace": trace.to_dict(),
+            "stopped": stopped,
+            "invalid_events": invalid_events
+        }
+        if cached is not None:
+            result["cached"] = True
+        elif cache_key is not None and metadata is not None and not failed and stopped is None:
+            cache.set(cache_key, result["answer"], metadata)
+        if verbose:
+            print_stream_summary(result, elapsed_time)
+        
+        return result
+    
+    except DifyAPIError as e:
+        if reservation is not None:
+            limiter.release(reservation, e)
+        if raise_errors:
+            raise
+        print(f"✗ 请求失败!")
+        print(f"状态码: {e.status}")
+        print(f"错误信息: {e.body}")
+        return None
+    
+    except DifyTimeoutError as e:
+        if reservation is not None:
+            settle_reservation(limiter, reservation, sent, e)
+        if raise_errors:
+            raise
+        print(f"✗ 请求超时: {e}")
+        return None
             
     except Exception as e:
+        if reservation is not None:
+            settle_reservation(limiter, reservation, sent, e)
+        if raise_errors:
+            raise
         print(f"✗ 发生异常: {str(e)}")
         import traceback
         traceback.print_exc()
@@ -4,9 +4,13 @@ Dify 聊天消息 API - 简单测试示例
 
 import requests
 import json
+import os
+
+from dify_answer import AnswerBuffer, TerminalSink
+from dify_sse import iter_sse_events
 
 # 配置
-API_BASE_URL = "https://api.dify.ai/v1"
+API_BASE_URL = os.getenv("DIFY_API_BASE_URL", "https://api.dify.ai/v1")
 API_KEY = "xxx"
 
 # 构建请求
@@ -28,59 +32,56 @@ payload = {
 print(f"正在发送消息: {payload['query']}")
 print("-" * 60)
 
-response = requests.post(url, headers=headers, json=payload, stream=True)
+# (连接超时, 读取超时)，流式模式下读取超时是两次收到数据之间的最长间隔
+response = requests.post(url, headers=headers, json=payload, stream=True, timeout=(5, 60))
 
 # 处理响应
 if response.status_code == 200:
     print(f"✓ 连接成功，开始接收流式响应...\n")
     print("【AI 回复】")
     
-    full_answer = ""
+    answer = AnswerBuffer([TerminalSink()])
     message_id = None
     conversation_id = None
     task_id = None
     metadata = None
     
     # 处理 SSE 流
-    for line in response.iter_lines():
-        if line:
-            line_text = line.decode('utf-8')
+    for sse in iter_sse_events(response.iter_content(chunk_size=None)):
+        try:
+            data = sse.json()
+        except json.JSONDecodeError:
+            print(f"\n✗ [无法解析的事件数据] {sse.data[:200]}")
+            continue
+        
+        event = data.get('event', '')
+        if event != 'message':
+            # 先输出缓冲中的回复片段，保证打印顺序
+            answer.flush()
+        
+        if event == 'message':
+            # 收到消息块，按固定帧率合并打印
+            answer.append(data.get('answer', ''))
             
-            # SSE 格式：data: {...}
-            if line_text.startswith('data: '):
-                data_str = line_text[6:]  # 去掉 "data: " 前缀
-                
-                try:
-                    data = json.loads(data_str)
-                    event = data.get('event', '')
-                    
-                    if event == 'message':
-                        # 收到消息块，实时打印
-                        answer_chunk = data.get('answer', '')
-                        print(answer_chunk, end='', flush=True)
-                        full_answer += answer_chunk
-                        
-                        # 保存 ID 信息
-                        if not message_id:
-                            message_id = data.get('message_id')
-                        if not conversation_id:
-                            conversation_id = data.get('conversation_id')
-                        if not task_id:
-                            task_id = data.get('task_id')
-                    
-                    elif event == 'message_end':
-                        # 消息结束
-                        print("\n")
-                        metadata = data.get('metadata', {})
-                        message_id = data.get('message_id') or message_id
-                        conversation_id = data.get('conversation_id') or conversation_id
-                    
-                    elif event == 'error':
-                        print(f"\n✗ [错误] {data.get('message')}")
-                
-                except json.JSONDecodeError:
-                    # 跳过无法解析的行
-                    pass
+            # 保存 ID 信息
+            if not message_id:
+                message_id = data.get('message_id')
+            if not conversation_id:
+                conversation_id = data.get('conversation_id')
+            if not task_id:
+                task_id = data.get('task_id')
+        
+        elif event == 'message_end':
+            # 消息结束
+            print("\n")
+            metadata = data.get('metadata', {})
+            message_id = data.get('message_id') or message_id
+            conversation_id = data.get('conversation_id') or conversation_id
+        
+        elif event == 'error':
+            print(f"\n✗ [错误] {data.get('message')}")
+    
+    answer.close()
     
     # 显示统计信息
     print("-" * 60)
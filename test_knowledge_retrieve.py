@@ -2,32 +2,100 @@
 Dify 知识库检索 API 测试脚本
 """
 
-import requests
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dify_cancel import abort_response
+from dify_client import DifyClient, get_shared_client
+from dify_deadline import Deadline, get_watchdog
+from dify_errors import DifyAPIError, DifyTimeoutError
+from dify_json_stream import iter_retrieve_records, top_records
+from dify_merge import TopKMerger
+from dify_models import RetrieveResult, parse_retrieve_response
 
 # API 配置
-API_BASE_URL = "https://api.dify.ai/v1"
+API_BASE_URL = os.getenv("DIFY_API_BASE_URL", "https://api.dify.ai/v1")
 DATASET_ID = "ff09e8db-836d-4375-ae98-fa40228b967f"
 API_KEY = "xxx"
 
 
-def retrieve_from_knowledge_base(query, retrieval_config=None):
+def print_retrieve_result(result):
+    """打印检索结果"""
+    print(f"\n查询内容: {result.get('query', {}).get('content', '')}")
+    print(f"检索到的记录数: {len(result.get('records', []))}")
+    print("\n" + "=" * 60)
+    
+    # 打印检索结果
+    for idx, record in enumerate(result.get('records', []), 1):
+        segment = record.get('segment', {})
+        score = record.get('score', 0)
+        
+        print(f"\n【结果 {idx}】")
+        print(f"相关度分数: {score}")
+        print(f"段落ID: {segment.get('id', 'N/A')}")
+        print(f"文档ID: {segment.get('document_id', 'N/A')}")
+        print(f"位置: {segment.get('position', 'N/A')}")
+        print(f"字数: {segment.get('word_count', 'N/A')}")
+        print(f"Token数: {segment.get('tokens', 'N/A')}")
+        
+        # 打印文档信息
+        document = segment.get('document', {})
+        if document:
+            print(f"\n文档信息:")
+            print(f"  - 文档名称: {document.get('name', 'N/A')}")
+            print(f"  - 数据源类型: {document.get('data_source_type', 'N/A')}")
+        
+        # 打印内容（截取前200字符）
+        content = segment.get('content', '')
+        print(f"\n内容预览:")
+        print(f"  {content[:200]}{'...' if len(content) > 200 else ''}")
+        
+        # 如果有关键词，打印关键词
+        keywords = segment.get('keywords', [])
+        if keywords:
+            print(f"\n关键词: {', '.join(keywords)}")
+        
+        print("-" * 60)
+
+
+def retrieve_from_knowledge_base(query, retrieval_config=None, client=None, cache=None,
+                                 hedger=None, as_records=False, dataset_id=None, deadline=None,
+                                 verbose=True, raise_errors=False):
     """
     从知识库检索相关块
     
     参数:
         query: 搜索查询字符串
         retrieval_config: 可选的检索配置
+        client: 可选，DifyClient 实例（默认使用共享的连接池客户端）
+        cache: 可选，RetrievalCache 实例，命中时不再请求 API
+        hedger: 可选，Hedger 实例，请求超过近期延迟百分位仍未返回时发送对冲请求
+        as_records: 为 True 时返回 RetrieveResult 对象（见 dify_models.py），而不是 dict
+        dataset_id: 可选，知识库ID（默认为 DATASET_ID）
+        deadline: 可选，端到端截止时间（Deadline 或秒数，见 dify_deadline.py），包括重试、对冲和读取响应体
+        verbose: 是否打印请求和检索结果
+        raise_errors: 为 True 时请求失败抛出 dify_errors 中的异常，而不是打印后返回 None
     
     返回:
         检索结果
     """
-    url = f"{API_BASE_URL}/datasets/{DATASET_ID}/retrieve"
+    client = client or get_shared_client(API_KEY, API_BASE_URL)
+    dataset_id = dataset_id or DATASET_ID
+    path = f"/datasets/{dataset_id}/retrieve"
+    url = client.url(path)
     
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    # 先查缓存
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(dataset_id, query, retrieval_config)
+        result = cache.get(cache_key)
+        if result is not None:
+            if verbose:
+                print(f"✓ 命中缓存: {query}")
+                print_retrieve_result(result)
+            return RetrieveResult.from_dict(result) if as_records else result
     
     # 构建请求体
     payload = {
@@ -39,65 +107,246 @@ def retrieve_from_knowledge_base(query, retrieval_config=None):
         payload["retrieval_model"] = retrieval_config
     
     try:
-        print(f"正在发送请求到: {url}")
-        print(f"查询内容: {query}")
-        print(f"请求体: {json.dumps(payload, ensure_ascii=False, indent=2)}")
-        print("-" * 60)
+        if verbose:
+            print(f"正在发送请求到: {url}")
+            print(f"查询内容: {query}")
+            print(f"请求体: {json.dumps(payload, ensure_ascii=False, indent=2)}")
+            print("-" * 60)
         
-        response = requests.post(url, headers=headers, json=payload)
+        deadline = Deadline.of(deadline)
+        if hedger is not None:
+            response = hedger.call(lambda token: client.request(path, payload, deadline=deadline, cancel_token=token),
+                                   on_discard=lambda r: r.close())
+        else:
+            response = client.request(path, payload, deadline=deadline)
         
-        print(f"响应状态码: {response.status_code}")
+        if verbose:
+            print(f"响应状态码: {response.status_code}")
         
-        if response.status_code == 200:
+        if as_records and cache is None:
+            # 直接从响应字节构造对象，不保留中间的 dict
+            records = parse_retrieve_response(response.content)
+            result = records.to_dict() if verbose else None
+        else:
+            # 缓存保存完整的响应（to_dict() 只保留模型中的字段），同一个缓存键也供 as_records=False 的调用使用
             result = response.json()
+            records = RetrieveResult.from_dict(result) if as_records else None
+        if cache is not None:
+            cache.set(cache_key, result)
+        if verbose:
             print("✓ 请求成功!")
-            print(f"\n查询内容: {result.get('query', {}).get('content', '')}")
-            print(f"检索到的记录数: {len(result.get('records', []))}")
-            print("\n" + "=" * 60)
-            
-            # 打印检索结果
-            for idx, record in enumerate(result.get('records', []), 1):
-                segment = record.get('segment', {})
-                score = record.get('score', 0)
-                
-                print(f"\n【结果 {idx}】")
-                print(f"相关度分数: {score}")
-                print(f"段落ID: {segment.get('id', 'N/A')}")
-                print(f"文档ID: {segment.get('document_id', 'N/A')}")
-                print(f"位置: {segment.get('position', 'N/A')}")
-                print(f"字数: {segment.get('word_count', 'N/A')}")
-                print(f"Token数: {segment.get('tokens', 'N/A')}")
-                
-                # 打印文档信息
-                document = segment.get('document', {})
-                if document:
-                    print(f"\n文档信息:")
-                    print(f"  - 文档名称: {document.get('name', 'N/A')}")
-                    print(f"  - 数据源类型: {document.get('data_source_type', 'N/A')}")
-                
-                # 打印内容（截取前200字符）
-                content = segment.get('content', '')
-                print(f"\n内容预览:")
-                print(f"  {content[:200]}{'...' if len(content) > 200 else ''}")
-                
-                # 如果有关键词，打印关键词
-                keywords = segment.get('keywords', [])
-                if keywords:
-                    print(f"\n关键词: {', '.join(keywords)}")
-                
-                print("-" * 60)
-            
-            return result
-        else:
-            print(f"✗ 请求失败!")
-            print(f"错误信息: {response.text}")
-            return None
+            print_retrieve_result(result)
+        
+        return records if as_records else result
+    
+    except DifyAPIError as e:
+        if raise_errors:
+            raise
+        print(f"✗ 请求失败!")
+        print(f"状态码: {e.status}")
+        print(f"错误信息: {e.body}")
+        return None
+    
+    except DifyTimeoutError as e:
+        if raise_errors:
+            raise
+        print(f"✗ 请求超时: {e}")
+        return None
             
     except Exception as e:
+        if raise_errors:
+            raise
         print(f"✗ 发生异常: {str(e)}")
         return None
 
 
+def retrieve_records_streaming(query, retrieval_config=None, client=None, top_n=None, dataset_id=None,
+                               deadline=None, stall_timeout=None):
+    """
+    从知识库检索相关块 - 增量解码
+    
+    不等待响应体全部到达，边接收边解析，每条记录完整到达后立即产出（见 dify_json_stream.py）。
+    适合 top_k 较大、段落较长的检索。
+    
+    参数:
+        query: 搜索查询字符串
+        retrieval_config: 可选的检索配置
+        client: 可选，DifyClient 实例（默认使用共享的连接池客户端）
+        top_n: 可选，只保留分数最高的 top_n 条记录（内存中最多同时保存 top_n 条），
+               此时在响应结束后按分数从高到低产出
+        dataset_id: 可选，知识库ID（默认为 DATASET_ID）
+        deadline: 可选，端到端截止时间（Deadline 或秒数），从发出请求到读完响应体
+        stall_timeout: 可选，两次收到数据之间的最长间隔（秒）
+    
+    返回:
+        Record 对象的生成器；请求失败时抛出 dify_errors 中的异常，
+        超时时关闭连接并抛出 DeadlineExceededError / StreamStalledError
+    """
+    client = client or get_shared_client(API_KEY, API_BASE_URL)
+    path = f"/datasets/{dataset_id or DATASET_ID}/retrieve"
+    
+    # 构建请求体
+    payload = {
+        "query": query
+    }
+    if retrieval_config:
+        payload["retrieval_model"] = retrieval_config
+    
+    deadline = Deadline.of(deadline)
+    response = client.request(path, payload, stream=True, deadline=deadline)
+    watch = get_watchdog().watch(lambda reason: abort_response(response), deadline=deadline, stall_timeout=stall_timeout)
+    try:
+        records = iter_retrieve_records(watch.wrap(response.iter_content(chunk_size=65536)))
+        if top_n is not None:
+            records = top_records(records, top_n)
+        yield from records
+    except Exception as e:
+        if watch.reason is not None:
+            raise watch.error() from e
+        raise
+    finally:
+        watch.close()
+        response.close()
+
+
+def retrieve_many(queries, retrieval_config=None, concurrency=8, client=None, cache=None, deadline=None):
+    """
+    批量检索
+    
+    重复的查询只请求一次，其余查询在线程池中并行执行；
+    单个查询失败不会中断整个批次。
+    
+    参数:
+        queries: 查询字符串列表
+        retrieval_config: 可选的检索配置（所有查询共用）
+        concurrency: 最大并行数
+        client: 可选，DifyClient 实例（默认创建一个连接池大小为 concurrency 的客户端）
+        cache: 可选，RetrievalCache 实例
+        deadline: 可选，整个批次的截止时间（Deadline 或秒数），所有查询共用；
+                  排队到截止时间之后才开始的查询直接记为超时，不再发出请求
+    
+    返回:
+        与 queries 顺序一致的列表，每项为
+        {"query": 查询, "result": 检索结果或 None, "error": 错误信息或 None, "elapsed_time": 耗时}
+    """
+    deadline = Deadline.of(deadline)
+    own_client = client is None
+    if own_client:
+        client = DifyClient(API_KEY, API_BASE_URL, pool_size=concurrency)
+    
+    def run(query):
+        start_time = time.time()
+        try:
+            result = retrieve_from_knowledge_base(
+                query,
+                retrieval_config=retrieval_config,
+                client=client,
+                cache=cache,
+                deadline=deadline,
+                verbose=False,
+                raise_errors=True
+            )
+            error = None
+        except Exception as e:
+            result = None
+            error = f"{type(e).__name__}: {e}"
+        return {
+            "query": query,
+            "result": result,
+            "error": error,
+            "elapsed_time": time.time() - start_time
+        }
+    
+    unique_queries = list(dict.fromkeys(queries))
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = dict(zip(unique_queries, executor.map(run, unique_queries)))
+    finally:
+        if own_client:
+            client.close()
+    
+    return [outcomes[query] for query in queries]
+
+
+def retrieve_from_datasets(query, dataset_ids, retrieval_config=None, top_k=None, client=None, cache=None,
+                           deadline=None):
+    """
+    同时检索多个知识库并合并结果
+    
+    所有知识库并行检索，使用相同的检索配置；每个知识库返回后立即合并到
+    全局 top-k 中（见 dify_merge.py），分段ID 或内容相同的记录只保留分数最高的一条。
+    单个知识库失败不会中断整个检索。
+    
+    参数:
+        query: 搜索查询字符串
+        dataset_ids: 知识库ID列表
+        retrieval_config: 可选的检索配置（所有知识库共用）
+        top_k: 可选，合并后保留的记录数（默认为 retrieval_config 中的 top_k，都没有时不限制）
+        client: 可选，DifyClient 实例（默认创建一个连接池大小为知识库数量的客户端）
+        cache: 可选，RetrievalCache 实例
+        deadline: 可选，截止时间（Deadline 或秒数），所有知识库共用；超时的知识库记为失败，
+                  合并已经返回的知识库的结果
+    
+    返回:
+        {"query": 查询, "records": 合并后的记录（每条记录带 "dataset_id" 字段）,
+         "datasets": {知识库ID: {"records": 记录数, "elapsed_time": 耗时, "error": 错误信息或 None}},
+         "duplicates": 去重的记录数, "elapsed_time": 总耗时}
+    """
+    dataset_ids = list(dict.fromkeys(dataset_ids))
+    deadline = Deadline.of(deadline)
+    if top_k is None and retrieval_config:
+        top_k = retrieval_config.get("top_k")
+    own_client = client is None
+    if own_client:
+        client = DifyClient(API_KEY, API_BASE_URL, pool_size=max(len(dataset_ids), 1))
+    
+    def run(dataset_id):
+        start_time = time.time()
+        try:
+            result = retrieve_from_knowledge_base(
+                query,
+                retrieval_config=retrieval_config,
+                client=client,
+                cache=cache,
+                dataset_id=dataset_id,
+                deadline=deadline,
+                verbose=False,
+                raise_errors=True
+            )
+            error = None
+        except Exception as e:
+            result = None
+            error = f"{type(e).__name__}: {e}"
+        return dataset_id, result, error, time.time() - start_time
+    
+    merger = TopKMerger(top_k)
+    datasets = {}
+    start_time = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(dataset_ids), 1)) as executor:
+            futures = [executor.submit(run, dataset_id) for dataset_id in dataset_ids]
+            for future in as_completed(futures):
+                dataset_id, result, error, elapsed_time = future.result()
+                records = (result or {}).get("records", [])
+                merger.add_many(records, dataset_id=dataset_id)
+                datasets[dataset_id] = {
+                    "records": len(records),
+                    "elapsed_time": elapsed_time,
+                    "error": error
+                }
+    finally:
+        if own_client:
+            client.close()
+    
+    return {
+        "query": query,
+        "records": merger.results(),
+        "datasets": {dataset_id: datasets[dataset_id] for dataset_id in dataset_ids},
+        "duplicates": merger.duplicates,
+        "elapsed_time": time.time() - start_time
+    }
+
+
 def test_basic_search():
     """测试基本搜索"""
     print("\n" + "=" * 60)
@@ -200,6 +449,50 @@ def test_with_metadata_filtering():
     return result
 
 
+def test_retrieve_many():
+    """测试批量检索"""
+    print("\n" + "=" * 60)
+    print("测试 6: 批量检索")
+    print("=" * 60)
+    
+    queries = ["什么是人工智能?", "机器学习算法", "深度学习", "神经网络", "什么是人工智能?"]
+    
+    start_time = time.time()
+    results = retrieve_many(queries, concurrency=4)
+    elapsed_time = time.time() - start_time
+    
+    for item in results:
+        if item["error"]:
+            print(f"✗ {item['query']}: {item['error']}")
+        else:
+            records = item["result"].get('records', [])
+            print(f"✓ {item['query']}: {len(records)} 条结果, 耗时 {item['elapsed_time']:.2f}秒")
+    print(f"\n总耗时: {elapsed_time:.2f}秒")
+    return results
+
+
+def test_retrieve_from_datasets():
+    """测试多知识库检索"""
+    print("\n" + "=" * 60)
+    print("测试 7: 多知识库检索")
+    print("=" * 60)
+    
+    # 替换为实际的知识库ID列表
+    dataset_ids = [DATASET_ID, "your-second-dataset-id"]
+    
+    result = retrieve_from_datasets("什么是人工智能?", dataset_ids, retrieval_config={"top_k": 5})
+    for dataset_id, info in result["datasets"].items():
+        if info["error"]:
+            print(f"✗ {dataset_id}: {info['error']}")
+        else:
+            print(f"✓ {dataset_id}: {info['records']} 条结果, 耗时 {info['elapsed_time']:.2f}秒")
+    print(f"\n合并后: {len(result['records'])} 条结果, 去重 {result['duplicates']} 条, 总耗时 {result['elapsed_time']:.2f}秒")
+    for idx, record in enumerate(result["records"], 1):
+        segment = record.get('segment', {})
+        print(f"{idx}. [{record.get('score', 0):.4f}] {record['dataset_id']} - {segment.get('content', '')[:50]}")
+    return result
+
+
 if __name__ == "__main__":
     print("=" * 60)
     print("Dify 知识库检索 API 测试")
@@ -221,6 +514,8 @@ if __name__ == "__main__":
     # test_semantic_search()
     # test_full_text_search()
     # test_with_metadata_filtering()
+    # test_retrieve_many()
+    # test_retrieve_from_datasets()
     
     print("\n" + "=" * 60)
     print("测试完成!")
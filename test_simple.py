@@ -3,9 +3,10 @@ Dify 知识库检索 API - 简单测试示例
 """
 
 import requests
+import os
 
 # 配置
-API_BASE_URL = "https://api.dify.ai/v1"
+API_BASE_URL = os.getenv("DIFY_API_BASE_URL", "https://api.dify.ai/v1")
 DATASET_ID = "ff09e8db-836d-4375-ae98-fa40228b967f"
 API_KEY = "xxx"
 
@@ -23,7 +24,8 @@ payload = {
 
 # 发送请求
 print(f"正在搜索: {payload['query']}")
-response = requests.post(url, headers=headers, json=payload)
+# (连接超时, 读取超时)，避免服务器无响应时一直阻塞
+response = requests.post(url, headers=headers, json=payload, timeout=(5, 60))
 
 # 处理响应
 if response.status_code == 200: